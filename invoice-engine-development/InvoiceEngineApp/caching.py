@@ -0,0 +1,117 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+# The reference data read by this process, by model and tenancy, together
+# with the generation it belongs to
+local_reference_data = {}
+
+
+def get_generation_key(company_id):
+    return 'reference_data_generation:{}'.format(company_id)
+
+
+def get_generation(company_id):
+    """Static function to return the current generation of the reference
+    data of a tenancy. A new generation starts with the current time, so that
+    it cannot be mistaken for an older generation after it was evicted from
+    the cache.
+    """
+    key = get_generation_key(company_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(company_id):
+    """Static function to start a new generation of the reference data of a
+    tenancy, so that all cached reference data of it is read again.
+    """
+    def bump():
+        try:
+            cache.incr(get_generation_key(company_id))
+        except ValueError:
+            cache.add(get_generation_key(company_id), time.time_ns(), None)
+
+    bump()
+    # Objects that are read before the transaction is committed could be
+    # cached for the new generation, so it is started again after the commit
+    transaction.on_commit(bump)
+
+
+def sync_generation(company_id, version):
+    """Static function to start a new generation of the reference data of a
+    tenancy if its version in the database is not the version the cached
+    reference data was read at, because it was changed by another process.
+    """
+    key = 'reference_data_version:{}'.format(company_id)
+    if cache.get(key) != version:
+        bump_generation(company_id)
+        cache.set(key, version, None)
+
+
+def get_reference_data(model, company_id, ids=()):
+    """Static function to return the contract types, base components or VAT
+    rates of a tenancy as a dictionary by primary key, in the order of their
+    primary keys. The objects are cached in this process and in the shared
+    cache until one of them is changed. They are shared by all users of the
+    cache, so they must not be changed.
+
+    The cache may not contain the objects that were created by another
+    process yet. If it does not contain all ids, the objects are read from
+    the database again.
+    """
+    objects = get_cached_reference_data(model, company_id)
+    if not {pk for pk in ids if pk is not None} <= objects.keys():
+        bump_generation(company_id)
+        objects = get_cached_reference_data(model, company_id)
+    return objects
+
+
+def get_cached_reference_data(model, company_id):
+    generation = get_generation(company_id)
+    local_key = (model._meta.label, company_id)
+    local_generation, objects = local_reference_data.get(
+        local_key, (None, None)
+    )
+    if local_generation == generation:
+        return objects
+
+    key = 'reference_data:{}:{}:{}'.format(
+        model._meta.label, company_id, generation
+    )
+    objects = cache.get(key)
+    if objects is None:
+        objects = {
+            obj.pk: obj
+            for obj in model.objects.filter(
+                tenancy_id=company_id
+            ).order_by('pk')
+        }
+        # Link the VAT rates to their successors, which are in the same
+        # tenancy
+        for obj in objects.values():
+            successor_id = getattr(obj, 'successor_vat_rate_id', None)
+            if successor_id in objects:
+                obj.successor_vat_rate = objects[successor_id]
+        cache.set(key, objects, settings.INVOICE_ENGINE_CACHE_TIMEOUT)
+
+    local_reference_data[local_key] = (generation, objects)
+    return objects
+
+
+def get_invoice_contract_id(invoice_id):
+    """Static function to return the id of the contract of an invoice, if it
+    is known by the cache. It never changes, so it is cached until it is
+    evicted.
+    """
+    return cache.get('invoice_contract:{}'.format(invoice_id))
+
+
+def set_invoice_contract_id(invoice_id, contract_id):
+    cache.set('invoice_contract:{}'.format(invoice_id), contract_id, None)
@@ -1,9 +1,48 @@
 import datetime
 
 from django import forms
-from django.db.models import Func
+from django.db.models import (
+    Case, Exists, IntegerField, OuterRef, Q, Value, When
+)
 
 from InvoiceEngineApp import models
+from InvoiceEngineApp.caching import get_reference_data
+
+
+def set_cached_choices(field, model, company_id):
+    """Static function to render the choices of a selector from the cached
+    reference data of the tenancy, instead of querying its queryset. The
+    queryset is still used to validate the selected object.
+    """
+    choices = [
+        (obj.pk, field.label_from_instance(obj))
+        for obj in get_reference_data(model, company_id).values()
+    ]
+    if field.empty_label is not None:
+        choices.insert(0, ('', field.empty_label))
+    field.choices = choices
+
+
+def set_cached_validation(field, model, company_id):
+    """Static function to validate the selected object of a selector with the
+    cached reference data of the tenancy, so that validating a form does not
+    need a query per selector. Used when many forms are validated at once.
+    """
+    objects = get_reference_data(model, company_id)
+
+    def to_python(value):
+        if value in field.empty_values:
+            return None
+        try:
+            return objects[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise forms.ValidationError(
+                field.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value}
+            )
+
+    field.to_python = to_python
 
 
 class TenancySubscriberForm(forms.ModelForm):
@@ -68,6 +107,9 @@ class ContractForm(forms.ModelForm):
             models.ContractType.objects.filter(
                 tenancy_id=company_id
             )
+        set_cached_choices(
+            self.fields['contract_type'], models.ContractType, company_id
+        )
 
     def disable_fields(self):
         for field in self.fields:
@@ -141,7 +183,9 @@ class ContractSearchForm(forms.Form):
         required=False,
         widget=forms.DateInput(attrs={'size': 8, 'placeholder': '2021-01-01'})
     )
-    total_amount = forms.FloatField(
+    total_amount = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
         required=False,
         widget=forms.TextInput(
             attrs={'size': 8,
@@ -150,7 +194,31 @@ class ContractSearchForm(forms.Form):
                    }
         )
     )
-    balance = forms.FloatField(
+    total_amount_min = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        required=False,
+        widget=forms.TextInput(
+            attrs={'size': 8,
+                   'style': 'text-align: right',
+                   'placeholder': 'min'
+                   }
+        )
+    )
+    total_amount_max = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        required=False,
+        widget=forms.TextInput(
+            attrs={'size': 8,
+                   'style': 'text-align: right',
+                   'placeholder': 'max'
+                   }
+        )
+    )
+    balance = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
         required=False,
         widget=forms.TextInput(
             attrs={'size': 8,
@@ -159,18 +227,44 @@ class ContractSearchForm(forms.Form):
                    }
         )
     )
+    balance_min = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        required=False,
+        widget=forms.TextInput(
+            attrs={'size': 8,
+                   'style': 'text-align: right',
+                   'placeholder': 'min'
+                   }
+        )
+    )
+    balance_max = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        required=False,
+        widget=forms.TextInput(
+            attrs={'size': 8,
+                   'style': 'text-align: right',
+                   'placeholder': 'max'
+                   }
+        )
+    )
+    # The maximum difference between the amount of a contract and the
+    # searched total amount or balance
+    amount_tolerance = forms.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        required=False,
+        min_value=0,
+        widget=forms.TextInput(
+            attrs={'size': 8,
+                   'style': 'text-align: right',
+                   'placeholder': '0.00'
+                   }
+        )
+    )
 
     def filter_queryset(self, qs):
-        class Round2(Func):
-            function = "ROUND"
-            template = "%(function)s(%(expressions)s::numeric, 2)"
-
-            def __rand__(self, other):
-                pass
-
-            def __ror__(self, other):
-                pass
-
         if self.cleaned_data.get('contract_type'):
             qs = qs.filter(
                 contract_type__description__icontains=self.cleaned_data.get(
@@ -202,36 +296,110 @@ class ContractSearchForm(forms.Form):
                     'next_invoice_date'
                 )
             )
-        if self.cleaned_data.get('total_amount'):
-            qs = qs.annotate(rounded_total=Round2('total_amount')).filter(
-                rounded_total=self.cleaned_data.get(
-                    'total_amount'
-                )
-            )
-        if self.cleaned_data.get('balance'):
-            qs = qs.annotate(rounded_balance=Round2('balance')).filter(
-                rounded_balance=self.cleaned_data.get(
-                    'balance'
-                )
-            )
+        # The amounts are compared with ranges on the columns themselves, so
+        # the (tenancy, amount) indexes of the contracts can be used
+        tolerance = self.cleaned_data.get('amount_tolerance') or 0
+        for field in ['total_amount', 'balance']:
+            amount = self.cleaned_data.get(field)
+            if amount is not None:
+                qs = qs.filter(**{
+                    field + '__range': (amount - tolerance, amount + tolerance)
+                })
+            if self.cleaned_data.get(field + '_min') is not None:
+                qs = qs.filter(**{
+                    field + '__gte': self.cleaned_data.get(field + '_min')
+                })
+            if self.cleaned_data.get(field + '_max') is not None:
+                qs = qs.filter(**{
+                    field + '__lte': self.cleaned_data.get(field + '_max')
+                })
+
+        # The contract persons are searched with subqueries instead of joins,
+        # so every contract is returned once. The icontains lookups can use
+        # the trigram indexes on the contract persons (see migration 0061).
+        persons = models.ContractPerson.objects.filter(contract=OuterRef('pk'))
+        ranks = []
         if self.cleaned_data.get('name'):
-            qs = qs.filter(
-                contractperson__name__icontains=self.cleaned_data.get(
-                    'name'
-                )
+            name = self.cleaned_data.get('name')
+            qs = qs.filter(Exists(persons.filter(name__icontains=name)))
+            ranks.append(
+                self.get_rank(persons, Q(name__iexact=name),
+                              Q(name__istartswith=name))
             )
         if self.cleaned_data.get('address'):
             # Filter both the address and the city
+            address = self.cleaned_data.get('address')
             qs = qs.filter(
-                contractperson__address__icontains=self.cleaned_data.get(
-                    'address'
+                Exists(
+                    persons.filter(
+                        Q(address__icontains=address)
+                        | Q(city__icontains=address)
+                    )
                 )
-            ) | qs.filter(
-                contractperson__city__icontains=self.cleaned_data.get(
-                    'address'
+            )
+            ranks.append(
+                self.get_rank(
+                    persons,
+                    Q(address__iexact=address) | Q(city__iexact=address),
+                    Q(address__istartswith=address)
+                    | Q(city__istartswith=address)
                 )
             )
 
+        if ranks:
+            # Show the best matches first, in the original order otherwise
+            qs = qs.annotate(
+                search_rank=sum(ranks[1:], ranks[0])
+            ).order_by('-search_rank', *qs.query.order_by)
+
+        return qs
+
+    @staticmethod
+    def get_rank(persons, exact_match, prefix_match):
+        """Return an expression that ranks a contract by how well its
+        contract persons match a search term.
+        """
+        return Case(
+            When(Exists(persons.filter(exact_match)), then=Value(2)),
+            When(Exists(persons.filter(prefix_match)), then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField()
+        )
+
+
+class TrialBalanceForm(forms.Form):
+    """The form the user can use to select the period and account of the
+    trial balance. Without input, the current month is shown.
+    """
+    start_date = forms.DateField(
+        required=False,
+        widget=forms.DateInput(attrs={'size': 8, 'placeholder': '2021-01-01'})
+    )
+    end_date = forms.DateField(
+        required=False,
+        widget=forms.DateInput(attrs={'size': 8, 'placeholder': '2021-01-31'})
+    )
+    gl_account = forms.CharField(
+        max_length=10,
+        required=False,
+        widget=forms.TextInput(attrs={'size': 8, 'placeholder': '8000'})
+    )
+
+    def get_period(self):
+        """Return the start and end date of the selected period."""
+        today = datetime.date.today()
+        start_date = today.replace(day=1)
+        end_date = today
+        if self.is_valid():
+            start_date = self.cleaned_data.get('start_date') or start_date
+            end_date = self.cleaned_data.get('end_date') or end_date
+        return start_date, end_date
+
+    def filter_queryset(self, qs):
+        start_date, end_date = self.get_period()
+        qs = qs.filter(date__gte=start_date, date__lte=end_date)
+        if self.is_valid() and self.cleaned_data.get('gl_account'):
+            qs = qs.filter(gl_account=self.cleaned_data.get('gl_account'))
         return qs
 
 
@@ -249,6 +417,12 @@ class ComponentForm(forms.ModelForm):
             models.VATRate.objects.filter(
                 tenancy_id=company_id
             )
+        set_cached_choices(
+            self.fields['base_component'], models.BaseComponent, company_id
+        )
+        set_cached_choices(
+            self.fields['vat_rate'], models.VATRate, company_id
+        )
 
     def disable_fields(self):
         for field in self.fields:
@@ -259,6 +433,9 @@ class ComponentForm(forms.ModelForm):
     def clean(self):
         cleaned_data = super().clean()
         base_amount = cleaned_data.get("base_amount")
+        if not cleaned_data.get("base_component"):
+            # The base component is invalid
+            return cleaned_data
         unit_id = cleaned_data.get("base_component").unit_id
         unit_amount = cleaned_data.get("unit_amount")
         number_of_units = cleaned_data.get("number_of_units")
@@ -318,6 +495,57 @@ class ComponentForm(forms.ModelForm):
         ]
 
 
+class ComponentIndexationForm(forms.Form):
+    """A form for the user to index the prices of the components of a base
+    component, optionally only for the contracts of one contract type.
+    """
+    base_component = forms.ModelChoiceField(
+        queryset=models.BaseComponent.objects.none()
+    )
+    contract_type = forms.ModelChoiceField(
+        queryset=models.ContractType.objects.none(),
+        required=False
+    )
+    effective_date = forms.DateField(
+        widget=forms.DateInput(attrs={'placeholder': '2021-01-01'})
+    )
+    percentage = forms.DecimalField(
+        max_digits=5, decimal_places=2, required=False
+    )
+    amount = forms.DecimalField(
+        max_digits=15, decimal_places=2, required=False
+    )
+
+    def filter_selectors(self, company_id):
+        """Filter the selectors for base component and contract type based on
+        the tenancy.
+        """
+        self.fields['base_component'].queryset = \
+            models.BaseComponent.objects.filter(
+                tenancy_id=company_id
+            )
+        self.fields['contract_type'].queryset = \
+            models.ContractType.objects.filter(
+                tenancy_id=company_id
+            )
+        set_cached_choices(
+            self.fields['base_component'], models.BaseComponent, company_id
+        )
+        set_cached_choices(
+            self.fields['contract_type'], models.ContractType, company_id
+        )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        percentage = cleaned_data.get("percentage")
+        amount = cleaned_data.get("amount")
+        if (percentage is None) == (amount is None):
+            raise forms.ValidationError(
+                "Please specify either a percentage or an amount."
+            )
+        return cleaned_data
+
+
 class ContractPersonFormSet(forms.BaseModelFormSet):
     contract = None
     restricted = False
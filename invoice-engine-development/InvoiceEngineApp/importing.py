@@ -0,0 +1,320 @@
+import csv
+import io
+import json
+
+from django.db import connection, models, transaction
+from django.forms import modelformset_factory
+
+from InvoiceEngineApp.forms import (
+    ComponentForm,
+    ContractForm,
+    ContractPersonFormSet,
+    set_cached_validation
+)
+from InvoiceEngineApp.models import (
+    BaseComponent,
+    Component,
+    Contract,
+    ContractPerson,
+    ContractType,
+    Tenancy,
+    VATRate
+)
+
+
+ContractPersonImportFormSet = modelformset_factory(
+    ContractPerson,
+    exclude=('contract', 'tenancy'),
+    formset=ContractPersonFormSet,
+    extra=0
+)
+
+
+def read_json_lines(file):
+    """Static function to read contracts from a file with one JSON object
+    per line. Every object contains the fields of a contract, and the lists
+    'components' and 'contract_persons' with the fields of its components and
+    contract persons.
+
+    Yields the line number, contract, components and contract persons of
+    every contract.
+    """
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            contract = json.loads(line)
+        except ValueError:
+            yield line_number, None, [], []
+            continue
+        if not isinstance(contract, dict):
+            yield line_number, None, [], []
+            continue
+        yield (
+            line_number,
+            contract,
+            contract.pop('components', None) or [],
+            contract.pop('contract_persons', None) or []
+        )
+
+
+def read_csv(file):
+    """Static function to read contracts from a CSV file with a header. The
+    column 'record' is 'contract', 'component' or 'contract_person', and the
+    other columns are the fields of the record. The components and contract
+    persons of a contract follow the row of the contract. Empty cells are
+    left out.
+
+    Yields the line number, contract, components and contract persons of
+    every contract.
+    """
+    reader = csv.DictReader(file)
+    contract = None
+    for row in reader:
+        record = row.pop('record', None)
+        values = {key: value for key, value in row.items() if value != ''}
+        if record == 'contract':
+            if contract:
+                yield contract
+            contract = (reader.line_num, values, [], [])
+        elif record == 'component' and contract:
+            contract[2].append(values)
+        elif record == 'contract_person' and contract:
+            contract[3].append(values)
+        else:
+            if contract:
+                yield contract
+            contract = None
+            yield reader.line_num, None, [], []
+    if contract:
+        yield contract
+
+
+def get_error_messages(form):
+    return [
+        message if field == '__all__' else '{}: {}'.format(field, message)
+        for field, messages in form.errors.items()
+        for message in messages
+    ]
+
+
+def to_copy_value(value):
+    """Static function to write a value in the text format of COPY."""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+class ContractImporter:
+    """Imports contracts with their components and contract persons into a
+    tenancy, for example when migrating a customer. The contracts are
+    validated with the same forms as the pages to create them, and are
+    imported as drafts.
+
+    The contracts are validated and written in batches. The objects of a
+    batch are copied into temporary staging tables with COPY and moved to
+    the tables of the models with one INSERT per model. All
+    valid contracts are imported in one transaction, and the number of
+    contracts of the tenancy is updated once.
+    """
+    def __init__(self, tenancy, batch_size=1000):
+        self.tenancy = tenancy
+        self.batch_size = batch_size
+
+        self.number_of_contracts = 0
+        self.number_of_components = 0
+        self.number_of_contract_persons = 0
+        self.errors = []
+
+    def import_contracts(self, contracts):
+        """Import the contracts read by read_json_lines or read_csv. Returns
+        the number of imported contracts, components and contract persons,
+        and the errors of the contracts that were not imported by line
+        number.
+        """
+        with transaction.atomic():
+            batch = []
+            for contract in contracts:
+                batch.append(contract)
+                if len(batch) >= self.batch_size:
+                    self.import_batch(batch)
+                    batch = []
+            self.import_batch(batch)
+
+            Tenancy.objects.filter(
+                company_id=self.tenancy.company_id
+            ).update(
+                number_of_contracts=models.F('number_of_contracts')
+                + self.number_of_contracts
+            )
+
+        return {
+            'contracts': self.number_of_contracts,
+            'components': self.number_of_components,
+            'contract_persons': self.number_of_contract_persons,
+            'errors': self.errors
+        }
+
+    def import_batch(self, batch):
+        contracts = []
+        components = []
+        persons = []
+        for line_number, contract_data, component_data, person_data in batch:
+            if contract_data is None:
+                self.errors.append((line_number, ["Invalid record."]))
+                continue
+            result = self.validate(contract_data, component_data, person_data)
+            if isinstance(result, list):
+                self.errors.append((line_number, result))
+                continue
+            contracts.append(result[0])
+            components.extend(result[1])
+            persons.extend(result[2])
+
+        if not contracts:
+            return
+
+        for model, objects in [(Contract, contracts),
+                               (Component, components),
+                               (ContractPerson, persons)]:
+            for obj, pk in zip(objects, self.reserve_ids(model, len(objects))):
+                obj.pk = pk
+
+        self.write(Contract, contracts)
+        # The components and contract persons refer to the ids of the
+        # contracts
+        for obj in components + persons:
+            obj.contract_id = obj.contract.contract_id
+        self.write(Component, components)
+        self.write(ContractPerson, persons)
+
+        self.number_of_contracts += len(contracts)
+        self.number_of_components += len(components)
+        self.number_of_contract_persons += len(persons)
+
+    def validate(self, contract_data, component_data, person_data):
+        """Validate a contract, its components and its contract persons with
+        the forms of their pages. Returns the unsaved objects, or a list of
+        error messages.
+        """
+        company_id = self.tenancy.company_id
+        form = ContractForm(contract_data)
+        set_cached_validation(
+            form.fields['contract_type'], ContractType, company_id
+        )
+        if not form.is_valid():
+            return get_error_messages(form)
+        contract = form.save(commit=False)
+        contract.tenancy_id = company_id
+
+        errors = []
+        components = []
+        for data in component_data:
+            form = ComponentForm(data)
+            set_cached_validation(
+                form.fields['base_component'], BaseComponent, company_id
+            )
+            set_cached_validation(
+                form.fields['vat_rate'], VATRate, company_id
+            )
+            if not form.is_valid():
+                errors.extend(
+                    'component {}: {}'.format(len(components) + 1, message)
+                    for message in get_error_messages(form)
+                )
+                continue
+            component = form.save(commit=False)
+            component.tenancy_id = company_id
+            component.contract = contract
+            component.unit_id = component.base_component.unit_id
+            component.set_derived_fields()
+            components.append(component)
+
+        persons = []
+        if person_data:
+            if not contract.start_date:
+                return errors + [
+                    "A contract with contract persons needs a start date."
+                ]
+            data = {
+                'form-TOTAL_FORMS': len(person_data),
+                'form-INITIAL_FORMS': 0,
+            }
+            for i, person in enumerate(person_data):
+                for field, value in person.items():
+                    data['form-{}-{}'.format(i, field)] = value
+            formset = ContractPersonImportFormSet(
+                data, queryset=ContractPerson.objects.none()
+            )
+            formset.set_contract(contract)
+            if not formset.is_valid():
+                errors.extend(formset.non_form_errors())
+                for i, form in enumerate(formset.forms):
+                    errors.extend(
+                        'contract person {}: {}'.format(i + 1, message)
+                        for message in get_error_messages(form)
+                    )
+            for form in formset.forms:
+                person = form.instance
+                person.tenancy_id = company_id
+                person.contract = contract
+                persons.append(person)
+
+        if errors:
+            return errors
+        return contract, components, persons
+
+    def reserve_ids(self, model, number):
+        """Return number new primary keys of the model from its sequence."""
+        if not number:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                'FROM generate_series(1, %s)',
+                ['"{}"'.format(model._meta.db_table),
+                 model._meta.pk.column, number]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def write(self, model, objects):
+        """Write the objects of a batch to the database."""
+        if not objects:
+            return
+
+        table = model._meta.db_table
+        staging = 'import_' + table
+        fields = model._meta.concrete_fields
+        columns = ', '.join('"{}"'.format(field.column) for field in fields)
+
+        data = io.StringIO()
+        for obj in objects:
+            data.write('\t'.join(
+                to_copy_value(
+                    field.get_db_prep_save(
+                        getattr(obj, field.attname), connection
+                    )
+                )
+                for field in fields
+            ))
+            data.write('\n')
+        data.seek(0)
+
+        with connection.cursor() as cursor:
+            # Another import in the same transaction may have created the
+            # staging table already, which it left empty
+            cursor.execute(
+                'CREATE TEMPORARY TABLE IF NOT EXISTS "{}" '
+                '(LIKE "{}" INCLUDING DEFAULTS) ON COMMIT DROP'
+                .format(staging, table)
+            )
+            cursor.copy_expert(
+                'COPY "{}" ({}) FROM STDIN'.format(staging, columns), data
+            )
+            cursor.execute(
+                'INSERT INTO "{table}" ({columns}) '
+                'SELECT {columns} FROM "{staging}"'
+                .format(table=table, columns=columns, staging=staging)
+            )
+            cursor.execute('TRUNCATE "{}"'.format(staging))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.models import Tenancy
+
+
+class Command(BaseCommand):
+    help = "Activate draft contracts of a tenancy at once, so that they can " \
+           "be invoiced. Contracts without a start date, without components " \
+           "or of which the percentages of the contract persons do not add " \
+           "up to 100 are reported and stay drafts."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tenancy', type=int, dest='company_id', required=True,
+            help="The company id of the tenancy"
+        )
+        parser.add_argument(
+            '--contract', type=int, dest='contract_ids', action='append',
+            help="Activate the contract with this id (can be repeated). "
+                 "Without it, all draft contracts are activated"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            tenancy = Tenancy.objects.get(company_id=options['company_id'])
+        except Tenancy.DoesNotExist:
+            raise CommandError(
+                "Tenancy {} does not exist.".format(options['company_id'])
+            )
+
+        activated, rejected = tenancy.activate_contracts(
+            options['contract_ids']
+        )
+        for contract_id, reason in sorted(rejected.items()):
+            self.stdout.write("Contract {}: {}".format(contract_id, reason))
+        self.stdout.write(
+            "Activated {} contracts, rejected {} contracts.".format(
+                len(activated), len(rejected)
+            )
+        )
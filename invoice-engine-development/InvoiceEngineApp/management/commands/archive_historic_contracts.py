@@ -0,0 +1,82 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Prefetch
+
+from InvoiceEngineApp.models import (
+    Contract,
+    ContractArchive,
+    Invoice,
+    InvoiceLine,
+    TenancySummary
+)
+
+
+class Command(BaseCommand):
+    help = "Archive the contracts that ended more than a number of years " \
+           "ago. Their invoices, invoice lines, collections and general " \
+           "ledger posts are moved to one archive document per contract " \
+           "and the contracts become historic."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--years', type=int, default=7,
+            help="Archive contracts that ended more than this many years ago"
+        )
+        parser.add_argument(
+            '--tenancy', type=int, dest='company_id',
+            help="Only archive the contracts of the tenancy with this company id"
+        )
+
+    def handle(self, *args, **options):
+        today = dt.date.today()
+        end_date = dt.date(
+            today.year - options['years'], today.month, min(today.day, 28)
+        )
+        contracts = Contract.objects.filter(
+            status=Contract.ENDED,
+            end_date__lt=end_date
+        ).order_by('contract_id')
+        if options['company_id']:
+            contracts = contracts.filter(tenancy_id=options['company_id'])
+
+        archived = 0
+        for contract in contracts.iterator():
+            self.archive_contract(contract, today)
+            archived += 1
+
+        self.stdout.write("Archived {} contracts.".format(archived))
+
+    @staticmethod
+    def archive_contract(contract, date):
+        """Move the invoices of the contract and all objects that refer to
+        them to the archive, and make the contract historic.
+        """
+        invoices = Invoice.objects.filter(
+            contract=contract
+        ).prefetch_related(
+            Prefetch(
+                'invoiceline_set',
+                queryset=InvoiceLine.objects.order_by('invoice_line_id')
+            ),
+            'invoiceline_set__generalledgerpost_set',
+            'generalledgerpost_set',
+            'collection_set'
+        ).order_by('date', 'invoice_id')
+
+        archive = ContractArchive(
+            tenancy_id=contract.tenancy_id,
+            contract=contract,
+            archive_date=date
+        )
+        with transaction.atomic():
+            archive.archive(invoices)
+            archive.save()
+            # The open balance of the tenancy only contains invoices that are
+            # not archived
+            TenancySummary.add_invoices(invoices, -1)
+            # Deleting the invoices deletes the objects that refer to them
+            Invoice.objects.filter(contract=contract).delete()
+            contract.status = Contract.HISTORIC
+            contract.save(update_fields=['status'])
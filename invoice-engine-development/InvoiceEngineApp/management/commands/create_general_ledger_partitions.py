@@ -0,0 +1,87 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from InvoiceEngineApp.models import GeneralLedgerPost
+
+
+def add_months(date, months):
+    """Static function to return the first day of the month a number of
+    months after the month of date.
+    """
+    month = date.month - 1 + months
+    return dt.date(date.year + month // 12, month % 12 + 1, 1)
+
+
+class Command(BaseCommand):
+    help = "Create the monthly partitions of the general ledger posts up to " \
+           "a number of months ahead. Posts in the default partition are " \
+           "moved to the partition of their month. Should be run at least " \
+           "once a month."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months', type=int, default=3,
+            help="The number of months ahead to create partitions for"
+        )
+
+    def handle(self, *args, **options):
+        table = GeneralLedgerPost._meta.db_table
+        default_partition = table + '_default'
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT MIN(date) FROM "{}"'.format(default_partition)
+            )
+            first_date = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT inhrelid::regclass::text FROM pg_inherits "
+                "WHERE inhparent = %s::regclass",
+                ['"{}"'.format(table)]
+            )
+            partitions = {row[0].strip('"') for row in cursor.fetchall()}
+
+        today = dt.date.today()
+        month = add_months(min(first_date or today, today), 0)
+        last_month = add_months(today, options['months'])
+        created = 0
+        while month <= last_month:
+            partition = '{}_{}'.format(table, month.strftime('%Y%m'))
+            if partition not in partitions:
+                self.create_partition(
+                    table, default_partition, partition,
+                    month, add_months(month, 1)
+                )
+                created += 1
+            month = add_months(month, 1)
+
+        self.stdout.write(
+            "Created {} general ledger partitions.".format(created)
+        )
+
+    @staticmethod
+    def create_partition(table, default_partition, partition, start, end):
+        """Create the partition for the posts from start up to end. A
+        partition cannot be added while the default partition contains posts
+        for its range, so these posts are moved to the new table first.
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE "{partition}" (LIKE "{table}" INCLUDING DEFAULTS)'
+                .format(partition=partition, table=table)
+            )
+            cursor.execute(
+                'WITH moved AS ('
+                'DELETE FROM "{default}" WHERE date >= %s AND date < %s '
+                'RETURNING *'
+                ') INSERT INTO "{partition}" SELECT * FROM moved'
+                .format(default=default_partition, partition=partition),
+                [start, end]
+            )
+            cursor.execute(
+                'ALTER TABLE "{table}" ATTACH PARTITION "{partition}" '
+                'FOR VALUES FROM (%s) TO (%s)'
+                .format(table=table, partition=partition),
+                [start, end]
+            )
@@ -0,0 +1,53 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.models import Tenancy
+
+
+class Command(BaseCommand):
+    help = "End contracts of a tenancy at once, for example after the sale " \
+           "of a building. Contracts that have been invoiced past their end " \
+           "date get a correction invoice for the invoiced days after it."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tenancy', type=int, dest='company_id', required=True,
+            help="The company id of the tenancy"
+        )
+        parser.add_argument(
+            '--contract', type=int, dest='contract_ids', action='append',
+            help="End the contract with this id (can be repeated). Without "
+                 "it, all contracts terminated on or before today are ended"
+        )
+        parser.add_argument(
+            '--as-of', type=dt.date.fromisoformat,
+            help="End the contracts as of this date (YYYY-MM-DD) instead of "
+                 "today, which is also the date of the correction invoices"
+        )
+        parser.add_argument(
+            '--termination-date', type=dt.date.fromisoformat,
+            help="Terminate the contracts on this date (YYYY-MM-DD) before "
+                 "ending them"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            tenancy = Tenancy.objects.get(company_id=options['company_id'])
+        except Tenancy.DoesNotExist:
+            raise CommandError(
+                "Tenancy {} does not exist.".format(options['company_id'])
+            )
+
+        ended, rejected = tenancy.end_contracts(
+            options['contract_ids'],
+            termination_date=options['termination_date'],
+            as_of=options['as_of']
+        )
+        for contract_id, reason in sorted(rejected.items()):
+            self.stdout.write("Contract {}: {}".format(contract_id, reason))
+        self.stdout.write(
+            "Ended {} contracts, rejected {} contracts.".format(
+                len(ended), len(rejected)
+            )
+        )
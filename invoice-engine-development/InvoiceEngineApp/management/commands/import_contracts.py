@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.importing import (
+    ContractImporter,
+    read_csv,
+    read_json_lines
+)
+from InvoiceEngineApp.models import Tenancy
+
+
+class Command(BaseCommand):
+    help = "Import draft contracts with their components and contract " \
+           "persons into a tenancy from a JSON lines file (one contract per " \
+           "line) or a CSV file (with a 'record' column). Contracts that are " \
+           "not valid are reported and not imported."
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="The file to import")
+        parser.add_argument(
+            '--tenancy', type=int, dest='company_id', required=True,
+            help="The company id of the tenancy"
+        )
+        parser.add_argument(
+            '--format', choices=['jsonl', 'csv'],
+            help="The format of the file. By default, it is derived from the "
+                 "extension of the file"
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="The number of contracts validated and written at once"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            tenancy = Tenancy.objects.get(company_id=options['company_id'])
+        except Tenancy.DoesNotExist:
+            raise CommandError(
+                "Tenancy {} does not exist.".format(options['company_id'])
+            )
+
+        file_format = options['format'] or (
+            'csv' if options['file'].lower().endswith('.csv') else 'jsonl'
+        )
+        read = read_csv if file_format == 'csv' else read_json_lines
+
+        importer = ContractImporter(tenancy, options['batch_size'])
+        with open(options['file'], newline='', encoding='utf-8') as file:
+            report = importer.import_contracts(read(file))
+
+        for line_number, messages in report['errors']:
+            for message in messages:
+                self.stdout.write("Line {}: {}".format(line_number, message))
+        self.stdout.write(
+            "Imported {contracts} contracts with {components} components and "
+            "{contract_persons} contract persons.".format(**report)
+        )
+        if report['errors']:
+            self.stdout.write(
+                "{} contracts were not imported.".format(len(report['errors']))
+            )
@@ -0,0 +1,68 @@
+import datetime as dt
+import decimal as dc
+
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.models import Tenancy
+
+
+class Command(BaseCommand):
+    help = "Index the prices of the components of a base component from an " \
+           "effective date, for example for the annual rent increase. The " \
+           "components end the day before and are succeeded by components " \
+           "with the new price. Contracts that have been invoiced past the " \
+           "effective date get a correction invoice."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tenancy', type=int, dest='company_id', required=True,
+            help="The company id of the tenancy"
+        )
+        parser.add_argument(
+            '--base-component', type=int, dest='base_component_id',
+            required=True,
+            help="Index the components of the base component with this id"
+        )
+        parser.add_argument(
+            '--contract-type', type=int, dest='contract_type_id',
+            help="Only index the components of contracts of this contract type"
+        )
+        parser.add_argument(
+            '--date', type=dt.date.fromisoformat, required=True,
+            help="The effective date of the new prices (YYYY-MM-DD)"
+        )
+        increase = parser.add_mutually_exclusive_group(required=True)
+        increase.add_argument(
+            '--percentage', type=dc.Decimal,
+            help="Increase the prices by this percentage"
+        )
+        increase.add_argument(
+            '--amount', type=dc.Decimal,
+            help="Increase the prices by this amount"
+        )
+        parser.add_argument(
+            '--as-of', type=dt.date.fromisoformat,
+            help="The date of the correction invoices (YYYY-MM-DD), by "
+                 "default today"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            tenancy = Tenancy.objects.get(company_id=options['company_id'])
+        except Tenancy.DoesNotExist:
+            raise CommandError(
+                "Tenancy {} does not exist.".format(options['company_id'])
+            )
+
+        report = tenancy.index_components(
+            options['base_component_id'],
+            options['date'],
+            percentage=options['percentage'],
+            amount=options['amount'],
+            contract_type_id=options['contract_type_id'],
+            as_of=options['as_of']
+        )
+        self.stdout.write(
+            "Indexed {components} components of {contracts} contracts and "
+            "created {invoices} correction invoices.".format(**report)
+        )
@@ -0,0 +1,39 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand
+
+from InvoiceEngineApp.models import Tenancy
+
+
+class Command(BaseCommand):
+    help = "Run the invoicing process of the tenancies as of a date, by " \
+           "default today. With --backfill, every invoicing period that was " \
+           "missed since the last run gets its own invoice, for example " \
+           "after the invoicing process did not run for some days."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tenancy', type=int, dest='company_id',
+            help="Only invoice the contracts of the tenancy with this company "
+                 "id"
+        )
+        parser.add_argument(
+            '--as-of', type=dt.date.fromisoformat,
+            help="Invoice the contracts as of this date (YYYY-MM-DD)"
+        )
+        parser.add_argument(
+            '--backfill', action='store_true',
+            help="Create an invoice for every missed invoicing period instead "
+                 "of one invoice for all of them"
+        )
+
+    def handle(self, *args, **options):
+        tenancies = Tenancy.objects.order_by('company_id')
+        if options['company_id']:
+            tenancies = tenancies.filter(company_id=options['company_id'])
+
+        for tenancy in tenancies:
+            tenancy.invoice_contracts(
+                as_of=options['as_of'], backfill=options['backfill']
+            )
+            self.stdout.write("Invoiced the contracts of {}.".format(tenancy))
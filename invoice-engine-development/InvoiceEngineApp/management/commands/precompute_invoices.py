@@ -0,0 +1,42 @@
+import datetime as dt
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from InvoiceEngineApp.models import Tenancy
+
+
+class Command(BaseCommand):
+    help = "Compute the invoices of the invoicing run of a date in advance, " \
+           "for example a few days before the end of the month. The " \
+           "invoicing run of that date uses the precomputed invoices of the " \
+           "contracts that did not change since, and only invoices the " \
+           "other contracts itself."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date', type=dt.date.fromisoformat, required=True,
+            help="The date of the invoicing run (YYYY-MM-DD)"
+        )
+        parser.add_argument(
+            '--tenancy', type=int, dest='company_id',
+            help="Only precompute the invoices of the tenancy with this "
+                 "company id"
+        )
+
+    def handle(self, *args, **options):
+        if not settings.INVOICE_ENGINE_PRECOMPUTE_INVOICES:
+            raise CommandError(
+                "Set INVOICE_ENGINE_PRECOMPUTE_INVOICES to True to use "
+                "precomputed invoices."
+            )
+
+        tenancies = Tenancy.objects.order_by('company_id')
+        if options['company_id']:
+            tenancies = tenancies.filter(company_id=options['company_id'])
+
+        for tenancy in tenancies:
+            number_of_invoices = tenancy.precompute_invoices(options['date'])
+            self.stdout.write("Precomputed {} invoices of {}.".format(
+                number_of_invoices, tenancy
+            ))
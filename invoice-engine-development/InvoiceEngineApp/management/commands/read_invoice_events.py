@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from InvoiceEngineApp.models import InvoiceEvent
+
+
+class Command(BaseCommand):
+    help = "Write the invoice events of a tenancy after an event id as JSON " \
+           "lines, in the order in which they were added. Every event " \
+           "contains the range of the ids of the invoices it announces. " \
+           "Store the id of the last event and pass it with --after to read " \
+           "the next events."
+
+    def add_arguments(self, parser):
+        # The ids are only in the order of the commits within a tenancy
+        parser.add_argument(
+            '--tenancy', type=int, dest='company_id', required=True,
+            help="Read the events of the tenancy with this company id"
+        )
+        parser.add_argument(
+            '--after', type=int, default=0,
+            help="Read the events after the event with this id"
+        )
+        parser.add_argument(
+            '--limit', type=int,
+            help="Read at most this many events"
+        )
+
+    def handle(self, *args, **options):
+        events = InvoiceEvent.objects.filter(
+            tenancy_id=options['company_id'],
+            id__gt=options['after']
+        ).order_by('id')
+        if options['limit']:
+            events = events[:options['limit']]
+
+        for event in events.values().iterator():
+            self.stdout.write(json.dumps(event, cls=DjangoJSONEncoder))
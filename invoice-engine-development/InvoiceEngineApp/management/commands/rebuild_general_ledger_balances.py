@@ -0,0 +1,114 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum, Exists, F, OuterRef, Prefetch
+
+from InvoiceEngineApp.models import (
+    ContractArchive,
+    GeneralLedgerBalance,
+    GeneralLedgerPost,
+    Invoice,
+    InvoiceLine,
+    derive_general_ledger_posts,
+    update_general_ledger_balances
+)
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "Recompute the general ledger balances from the general ledger " \
+           "posts. Only needed for posts that were created before the " \
+           "balances were introduced, or after removing posts manually."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tenancy', type=int, dest='company_id',
+            help="Only rebuild the balances of the tenancy with this company id"
+        )
+
+    def handle(self, *args, **options):
+        posts = GeneralLedgerPost.objects.all()
+        balances = GeneralLedgerBalance.objects.all()
+        invoices = Invoice.objects.all()
+        archives = ContractArchive.objects.all()
+        if options['company_id']:
+            posts = posts.filter(tenancy_id=options['company_id'])
+            balances = balances.filter(tenancy_id=options['company_id'])
+            invoices = invoices.filter(tenancy_id=options['company_id'])
+            archives = archives.filter(tenancy_id=options['company_id'])
+
+        rows = posts.values(
+            'tenancy_id',
+            'date',
+            gl_account=F('gl_dimensions__gl_account'),
+            gl_dimension_base_component=F(
+                'gl_dimensions__gl_dimension_base_component'
+            ),
+            gl_dimension_contract_1=F('gl_dimensions__gl_dimension_contract_1'),
+            gl_dimension_contract_2=F('gl_dimensions__gl_dimension_contract_2'),
+            gl_dimension_vat=F('gl_dimensions__gl_dimension_vat')
+        ).annotate(
+            total_debit=Sum('amount_debit'),
+            total_credit=Sum('amount_credit'),
+            total_posts=Count('id')
+        ).order_by()
+
+        with transaction.atomic():
+            balances.delete()
+            GeneralLedgerBalance.objects.bulk_create(
+                (
+                    GeneralLedgerBalance(
+                        tenancy_id=row['tenancy_id'],
+                        date=row['date'],
+                        gl_account=row['gl_account'],
+                        gl_dimension_base_component=row[
+                            'gl_dimension_base_component'
+                        ],
+                        gl_dimension_contract_1=row['gl_dimension_contract_1'],
+                        gl_dimension_contract_2=row['gl_dimension_contract_2'],
+                        gl_dimension_vat=row['gl_dimension_vat'],
+                        amount_debit=row['total_debit'],
+                        amount_credit=row['total_credit'],
+                        number_of_posts=row['total_posts']
+                    ) for row in rows.iterator()
+                ),
+                batch_size=BATCH_SIZE
+            )
+
+            # Invoices created while the posts were not stored
+            self.add_derived_posts(invoices)
+
+            # The posts of archived contracts are part of the balances too
+            for archive in archives.select_related('contract').iterator():
+                update_general_ledger_balances(archive.get_gl_posts())
+
+        self.stdout.write(
+            "Rebuilt {} general ledger balances.".format(balances.count())
+        )
+
+    @staticmethod
+    def add_derived_posts(invoices):
+        """Add the posts of the invoices that have no stored general ledger
+        posts to the balances, in batches of invoices.
+        """
+        invoice_ids = list(
+            invoices.filter(
+                ~Exists(
+                    GeneralLedgerPost.objects.filter(invoice=OuterRef('pk'))
+                )
+            ).order_by('invoice_id').values_list('invoice_id', flat=True)
+        )
+        for i in range(0, len(invoice_ids), BATCH_SIZE):
+            batch = Invoice.objects.filter(
+                invoice_id__in=invoice_ids[i:i + BATCH_SIZE]
+            ).select_related(
+                'tenancy', 'contract'
+            ).prefetch_related(
+                Prefetch(
+                    'invoiceline_set',
+                    queryset=InvoiceLine.objects.select_related(
+                        'gl_dimensions'
+                    ).order_by('invoice_line_id')
+                )
+            )
+            update_general_ledger_balances(derive_general_ledger_posts(batch))
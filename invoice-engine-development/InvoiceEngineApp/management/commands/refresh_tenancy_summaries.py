@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from InvoiceEngineApp.models import Tenancy, TenancySummary
+
+
+class Command(BaseCommand):
+    help = "Compute the dashboard summaries of the tenancies from their " \
+           "contracts and invoices. The overdue amounts depend on the date, " \
+           "so this should be run daily."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tenancy', type=int, dest='company_id',
+            help="Only refresh the summary of the tenancy with this company id"
+        )
+
+    def handle(self, *args, **options):
+        tenancies = Tenancy.objects.order_by('company_id')
+        if options['company_id']:
+            tenancies = tenancies.filter(company_id=options['company_id'])
+
+        refreshed = 0
+        for company_id in tenancies.values_list('company_id', flat=True):
+            TenancySummary.refresh(company_id)
+            refreshed += 1
+
+        self.stdout.write("Refreshed {} tenancy summaries.".format(refreshed))
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.7 on 2026-10-19 15:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0055_auto_20221106_1258'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeneralLedgerBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('gl_account', models.CharField(max_length=10)),
+                ('gl_dimension_base_component', models.CharField(max_length=10, null=True)),
+                ('gl_dimension_contract_1', models.CharField(max_length=10)),
+                ('gl_dimension_contract_2', models.CharField(max_length=10)),
+                ('gl_dimension_vat', models.CharField(max_length=10, null=True)),
+                ('amount_debit', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('amount_credit', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('number_of_posts', models.PositiveIntegerField(default=0)),
+                ('tenancy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='InvoiceEngineApp.tenancy')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='generalledgerbalance',
+            index=models.Index(fields=['tenancy', 'date', 'gl_account'], name='InvoiceEngi_tenancy_3e5bb5_idx'),
+        ),
+    ]
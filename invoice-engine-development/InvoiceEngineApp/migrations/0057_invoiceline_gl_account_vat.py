@@ -0,0 +1,31 @@
+# Generated by Django 3.1.7 on 2026-10-19 15:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0056_auto_20261019_1506'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceline',
+            name='gl_account_vat',
+            field=models.CharField(max_length=10, null=True),
+        ),
+        # Copy the VAT account of existing invoice lines from their component
+        migrations.RunSQL(
+            sql="""
+                UPDATE "InvoiceEngineApp_invoiceline" AS l
+                SET gl_account_vat = v.gl_account
+                FROM "InvoiceEngineApp_component" AS c
+                JOIN "InvoiceEngineApp_vatrate" AS v
+                    ON v.vat_rate_id = c.vat_rate_id
+                WHERE c.component_id = l.component_id
+                    AND l.vat_type IS NOT NULL
+            """,
+            reverse_sql=migrations.RunSQL.noop
+        ),
+    ]
@@ -0,0 +1,200 @@
+# Generated by Django 3.1.7 on 2026-10-19 15:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0057_invoiceline_gl_account_vat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeneralLedgerDimensions',
+            fields=[
+                ('gl_dimensions_id', models.AutoField(primary_key=True, serialize=False)),
+                ('gl_account', models.CharField(max_length=10, null=True)),
+                ('gl_account_vat', models.CharField(max_length=10, null=True)),
+                ('gl_dimension_base_component', models.CharField(max_length=10, null=True)),
+                ('gl_dimension_contract_1', models.CharField(max_length=10, null=True)),
+                ('gl_dimension_contract_2', models.CharField(max_length=10, null=True)),
+                ('gl_dimension_vat', models.CharField(max_length=10, null=True)),
+                ('tenancy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='InvoiceEngineApp.tenancy')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='generalledgerpost',
+            name='gl_dimensions',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.RESTRICT, to='InvoiceEngineApp.generalledgerdimensions'),
+        ),
+        migrations.AddField(
+            model_name='invoiceline',
+            name='gl_dimensions',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.RESTRICT, to='InvoiceEngineApp.generalledgerdimensions'),
+        ),
+        # Make the old columns nullable, so the migration can be reversed
+        migrations.AlterField(
+            model_name='generalledgerpost',
+            name='gl_account',
+            field=models.CharField(max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='generalledgerpost',
+            name='gl_dimension_contract_1',
+            field=models.CharField(max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='generalledgerpost',
+            name='gl_dimension_contract_2',
+            field=models.CharField(max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='invoiceline',
+            name='gl_account',
+            field=models.CharField(max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='invoiceline',
+            name='gl_dimension_base_component',
+            field=models.CharField(max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='invoiceline',
+            name='gl_dimension_contract_1',
+            field=models.CharField(max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='invoiceline',
+            name='gl_dimension_contract_2',
+            field=models.CharField(max_length=10, null=True),
+        ),
+        # Store every distinct combination once per tenancy and refer to it
+        migrations.RunSQL(
+            sql=[
+                """
+                INSERT INTO "InvoiceEngineApp_generalledgerdimensions" (
+                    tenancy_id, gl_account, gl_account_vat,
+                    gl_dimension_base_component, gl_dimension_contract_1,
+                    gl_dimension_contract_2, gl_dimension_vat
+                )
+                SELECT i.tenancy_id, l.gl_account, l.gl_account_vat,
+                    l.gl_dimension_base_component, l.gl_dimension_contract_1,
+                    l.gl_dimension_contract_2, l.gl_dimension_vat
+                FROM "InvoiceEngineApp_invoiceline" AS l
+                JOIN "InvoiceEngineApp_invoice" AS i
+                    ON i.invoice_id = l.invoice_id
+                UNION
+                SELECT p.tenancy_id, p.gl_account, NULL,
+                    p.gl_dimension_base_component, p.gl_dimension_contract_1,
+                    p.gl_dimension_contract_2, p.gl_dimension_vat
+                FROM "InvoiceEngineApp_generalledgerpost" AS p
+                """,
+                """
+                UPDATE "InvoiceEngineApp_invoiceline" AS l
+                SET gl_dimensions_id = d.gl_dimensions_id
+                FROM "InvoiceEngineApp_invoice" AS i,
+                    "InvoiceEngineApp_generalledgerdimensions" AS d
+                WHERE i.invoice_id = l.invoice_id
+                    AND d.tenancy_id = i.tenancy_id
+                    AND d.gl_account IS NOT DISTINCT FROM l.gl_account
+                    AND d.gl_account_vat IS NOT DISTINCT FROM l.gl_account_vat
+                    AND d.gl_dimension_base_component
+                        IS NOT DISTINCT FROM l.gl_dimension_base_component
+                    AND d.gl_dimension_contract_1
+                        IS NOT DISTINCT FROM l.gl_dimension_contract_1
+                    AND d.gl_dimension_contract_2
+                        IS NOT DISTINCT FROM l.gl_dimension_contract_2
+                    AND d.gl_dimension_vat
+                        IS NOT DISTINCT FROM l.gl_dimension_vat
+                """,
+                """
+                UPDATE "InvoiceEngineApp_generalledgerpost" AS p
+                SET gl_dimensions_id = d.gl_dimensions_id
+                FROM "InvoiceEngineApp_generalledgerdimensions" AS d
+                WHERE d.tenancy_id = p.tenancy_id
+                    AND d.gl_account IS NOT DISTINCT FROM p.gl_account
+                    AND d.gl_account_vat IS NULL
+                    AND d.gl_dimension_base_component
+                        IS NOT DISTINCT FROM p.gl_dimension_base_component
+                    AND d.gl_dimension_contract_1
+                        IS NOT DISTINCT FROM p.gl_dimension_contract_1
+                    AND d.gl_dimension_contract_2
+                        IS NOT DISTINCT FROM p.gl_dimension_contract_2
+                    AND d.gl_dimension_vat
+                        IS NOT DISTINCT FROM p.gl_dimension_vat
+                """,
+            ],
+            reverse_sql=[
+                """
+                UPDATE "InvoiceEngineApp_invoiceline" AS l
+                SET gl_account = d.gl_account,
+                    gl_account_vat = d.gl_account_vat,
+                    gl_dimension_base_component = d.gl_dimension_base_component,
+                    gl_dimension_contract_1 = d.gl_dimension_contract_1,
+                    gl_dimension_contract_2 = d.gl_dimension_contract_2,
+                    gl_dimension_vat = d.gl_dimension_vat
+                FROM "InvoiceEngineApp_generalledgerdimensions" AS d
+                WHERE d.gl_dimensions_id = l.gl_dimensions_id
+                """,
+                """
+                UPDATE "InvoiceEngineApp_generalledgerpost" AS p
+                SET gl_account = d.gl_account,
+                    gl_dimension_base_component = d.gl_dimension_base_component,
+                    gl_dimension_contract_1 = d.gl_dimension_contract_1,
+                    gl_dimension_contract_2 = d.gl_dimension_contract_2,
+                    gl_dimension_vat = d.gl_dimension_vat
+                FROM "InvoiceEngineApp_generalledgerdimensions" AS d
+                WHERE d.gl_dimensions_id = p.gl_dimensions_id
+                """,
+            ]
+        ),
+        migrations.RemoveField(
+            model_name='generalledgerpost',
+            name='gl_account',
+        ),
+        migrations.RemoveField(
+            model_name='generalledgerpost',
+            name='gl_dimension_base_component',
+        ),
+        migrations.RemoveField(
+            model_name='generalledgerpost',
+            name='gl_dimension_contract_1',
+        ),
+        migrations.RemoveField(
+            model_name='generalledgerpost',
+            name='gl_dimension_contract_2',
+        ),
+        migrations.RemoveField(
+            model_name='generalledgerpost',
+            name='gl_dimension_vat',
+        ),
+        migrations.RemoveField(
+            model_name='invoiceline',
+            name='gl_account',
+        ),
+        migrations.RemoveField(
+            model_name='invoiceline',
+            name='gl_account_vat',
+        ),
+        migrations.RemoveField(
+            model_name='invoiceline',
+            name='gl_dimension_base_component',
+        ),
+        migrations.RemoveField(
+            model_name='invoiceline',
+            name='gl_dimension_contract_1',
+        ),
+        migrations.RemoveField(
+            model_name='invoiceline',
+            name='gl_dimension_contract_2',
+        ),
+        migrations.RemoveField(
+            model_name='invoiceline',
+            name='gl_dimension_vat',
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 3.1.7 on 2026-10-19 15:13
+
+from django.db import migrations, models
+
+
+TABLE = '"InvoiceEngineApp_generalledgerpost"'
+
+# The constraints and indexes Django created for the general ledger posts.
+# A primary key of a partitioned table has to contain the partition key, so
+# the primary key becomes (id, date). Django keeps using id on its own.
+CONSTRAINTS = """
+    ALTER TABLE {table}
+        ADD CONSTRAINT "InvoiceEngineApp_generalledgerpost_pkey"
+        PRIMARY KEY ({primary_key});
+    ALTER TABLE {table}
+        ADD CONSTRAINT "InvoiceEngineApp_gen_tenancy_id_d376268b_fk_InvoiceEn"
+        FOREIGN KEY (tenancy_id)
+        REFERENCES "InvoiceEngineApp_tenancy" (company_id)
+        DEFERRABLE INITIALLY DEFERRED;
+    ALTER TABLE {table}
+        ADD CONSTRAINT "InvoiceEngineApp_generalledgerpost_invoice_id_32bae744_fk"
+        FOREIGN KEY (invoice_id)
+        REFERENCES "InvoiceEngineApp_invoice" (invoice_id)
+        DEFERRABLE INITIALLY DEFERRED;
+    ALTER TABLE {table}
+        ADD CONSTRAINT "InvoiceEngineApp_generalledgerpost_invoice_line_id_92660d5a_fk"
+        FOREIGN KEY (invoice_line_id)
+        REFERENCES "InvoiceEngineApp_invoiceline" (invoice_line_id)
+        DEFERRABLE INITIALLY DEFERRED;
+    ALTER TABLE {table}
+        ADD CONSTRAINT "InvoiceEngineApp_gen_gl_dimensions_id_763569e8_fk_InvoiceEn"
+        FOREIGN KEY (gl_dimensions_id)
+        REFERENCES "InvoiceEngineApp_generalledgerdimensions" (gl_dimensions_id)
+        DEFERRABLE INITIALLY DEFERRED;
+    CREATE INDEX "InvoiceEngineApp_generalledgerpost_tenancy_id_d376268b"
+        ON {table} (tenancy_id);
+    CREATE INDEX "InvoiceEngineApp_generalledgerpost_invoice_id_32bae744"
+        ON {table} (invoice_id);
+    CREATE INDEX "InvoiceEngineApp_generalledgerpost_invoice_line_id_92660d5a"
+        ON {table} (invoice_line_id);
+    CREATE INDEX "InvoiceEngineApp_generalledgerpost_gl_dimensions_id_763569e8"
+        ON {table} (gl_dimensions_id);
+"""
+
+# Replace the table by a table partitioned by month on the date. All existing
+# posts are moved to the default partition, the create_general_ledger_partitions
+# management command moves them to their monthly partitions.
+PARTITION_SQL = """
+    ALTER TABLE {table} RENAME TO "InvoiceEngineApp_generalledgerpost_old";
+    CREATE TABLE {table} (
+        LIKE "InvoiceEngineApp_generalledgerpost_old" INCLUDING DEFAULTS
+    ) PARTITION BY RANGE (date);
+    CREATE TABLE "InvoiceEngineApp_generalledgerpost_default"
+        PARTITION OF {table} DEFAULT;
+    INSERT INTO {table}
+        SELECT * FROM "InvoiceEngineApp_generalledgerpost_old";
+    ALTER SEQUENCE "InvoiceEngineApp_generalledgerpost_id_seq"
+        OWNED BY {table}.id;
+    DROP TABLE "InvoiceEngineApp_generalledgerpost_old";
+""".format(table=TABLE) + CONSTRAINTS.format(table=TABLE, primary_key='id, date')
+
+UNPARTITION_SQL = """
+    ALTER TABLE {table} RENAME TO "InvoiceEngineApp_generalledgerpost_old";
+    CREATE TABLE {table} (
+        LIKE "InvoiceEngineApp_generalledgerpost_old" INCLUDING DEFAULTS
+    );
+    INSERT INTO {table}
+        SELECT * FROM "InvoiceEngineApp_generalledgerpost_old";
+    ALTER SEQUENCE "InvoiceEngineApp_generalledgerpost_id_seq"
+        OWNED BY {table}.id;
+    DROP TABLE "InvoiceEngineApp_generalledgerpost_old";
+""".format(table=TABLE) + CONSTRAINTS.format(table=TABLE, primary_key='id')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0058_auto_20261019_1510'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['tenancy', 'date'], name='InvoiceEngi_tenancy_118e1b_idx'),
+        ),
+        migrations.RunSQL(
+            sql=PARTITION_SQL,
+            reverse_sql=UNPARTITION_SQL
+        ),
+    ]
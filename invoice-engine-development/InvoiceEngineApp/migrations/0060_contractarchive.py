@@ -0,0 +1,29 @@
+# Generated by Django 3.1.7 on 2026-10-19 15:15
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0059_auto_20261019_1513'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContractArchive',
+            fields=[
+                ('contract', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='InvoiceEngineApp.contract')),
+                ('archive_date', models.DateField()),
+                ('last_invoice_id', models.PositiveIntegerField(null=True)),
+                ('last_invoice_line_id', models.PositiveIntegerField(null=True)),
+                ('document', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('tenancy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='InvoiceEngineApp.tenancy')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+from django.db import migrations
+
+
+# The columns searched with icontains in the contract search. Django compares
+# UPPER("column"::text), so the indexes are created on that expression.
+SEARCH_INDEXES = [
+    ('InvoiceEngineApp_contractperson', 'name'),
+    ('InvoiceEngineApp_contractperson', 'address'),
+    ('InvoiceEngineApp_contractperson', 'city'),
+    ('InvoiceEngineApp_contracttype', 'description'),
+]
+
+
+def get_index_name(table, column):
+    return '{}_{}_trgm'.format(table, column)
+
+
+def create_search_indexes(apps, schema_editor):
+    """Create trigram indexes for the contract search. The pg_trgm extension
+    is part of the Postgres contrib package. Without it, the search still
+    works, but without an index.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+        )
+        if cursor.fetchone() is None:
+            return
+
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column in SEARCH_INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS "{}" ON "{}" '
+            'USING gin (UPPER("{}"::text) gin_trgm_ops)'.format(
+                get_index_name(table, column), table, column
+            )
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in SEARCH_INDEXES:
+        schema_editor.execute(
+            'DROP INDEX IF EXISTS "{}"'.format(get_index_name(table, column))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0060_contractarchive'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.7 on 2026-10-19 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0061_contract_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(fields=['tenancy', 'total_amount'], name='InvoiceEngi_tenancy_f92b49_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(fields=['tenancy', 'balance'], name='InvoiceEngi_tenancy_e2deeb_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.7 on 2026-10-19 15:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0062_auto_20261019_1520'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TenancySummary',
+            fields=[
+                ('tenancy', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='InvoiceEngineApp.tenancy')),
+                ('number_of_active_contracts', models.PositiveIntegerField(default=0)),
+                ('open_balance', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('last_run_date', models.DateField(null=True)),
+                ('last_run_number_of_invoices', models.PositiveIntegerField(default=0)),
+                ('last_run_total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('overdue_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('overdue_date', models.DateField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.7 on 2026-10-19 15:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0063_tenancysummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingCorrection',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('base_amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('vat_amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('unit_amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('component', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='InvoiceEngineApp.component')),
+                ('contract', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='InvoiceEngineApp.contract')),
+                ('tenancy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='InvoiceEngineApp.tenancy')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
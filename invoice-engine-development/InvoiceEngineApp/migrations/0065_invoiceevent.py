@@ -0,0 +1,31 @@
+# Generated by Django 3.1.7 on 2026-10-19 15:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0064_pendingcorrection'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('R', 'Invoicing run'), ('C', 'Correction'), ('I', 'Price indexation'), ('E', 'Ending of contracts')], max_length=1)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('first_invoice_id', models.PositiveIntegerField()),
+                ('last_invoice_id', models.PositiveIntegerField()),
+                ('number_of_invoices', models.PositiveIntegerField()),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('tenancy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='InvoiceEngineApp.tenancy')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='invoiceevent',
+            index=models.Index(fields=['tenancy', 'id'], name='InvoiceEngi_tenancy_9d8d63_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.7 on 2026-10-19 15:49
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0065_invoiceevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecomputedInvoice',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('document', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('contract', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='InvoiceEngineApp.contract')),
+                ('tenancy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='InvoiceEngineApp.tenancy')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.1.7 on 2026-10-19 16:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0066_precomputedinvoice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceline',
+            name='tenancy',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='InvoiceEngineApp.tenancy'),
+        ),
+        # Copy the tenancy of existing invoice lines from their invoice
+        migrations.RunSQL(
+            sql="""
+                UPDATE "InvoiceEngineApp_invoiceline" AS l
+                SET tenancy_id = i.tenancy_id
+                FROM "InvoiceEngineApp_invoice" AS i
+                WHERE i.invoice_id = l.invoice_id
+            """,
+            reverse_sql=migrations.RunSQL.noop
+        ),
+        migrations.AlterField(
+            model_name='invoiceline',
+            name='tenancy',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='InvoiceEngineApp.tenancy'),
+        ),
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(fields=['tenancy', 'id'], name='InvoiceEngi_tenancy_acf537_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(fields=['tenancy', 'contract_id'], name='InvoiceEngi_tenancy_f293b7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='generalledgerpost',
+            index=models.Index(fields=['tenancy', 'id'], name='InvoiceEngi_tenancy_a21cc4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['tenancy', 'invoice_id'], name='InvoiceEngi_tenancy_9506e0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoiceline',
+            index=models.Index(fields=['tenancy', 'invoice_line_id'], name='InvoiceEngi_tenancy_2821bc_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.1.7 on 2026-10-19 17:00
+
+from django.db import migrations, models
+import time
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0067_auto_20261019_1630'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contract',
+            name='version',
+            field=models.BigIntegerField(default=time.time_ns, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tenancy',
+            name='reference_data_version',
+            field=models.BigIntegerField(default=time.time_ns, editable=False),
+        ),
+    ]
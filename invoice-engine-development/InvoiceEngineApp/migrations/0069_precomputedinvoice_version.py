@@ -0,0 +1,21 @@
+# Generated by Django 3.1.7 on 2026-10-19 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0068_auto_20261019_1700'),
+    ]
+
+    operations = [
+        # Existing precomputed invoices are invalid, because their version
+        # is not known
+        migrations.AddField(
+            model_name='precomputedinvoice',
+            name='version',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+    ]
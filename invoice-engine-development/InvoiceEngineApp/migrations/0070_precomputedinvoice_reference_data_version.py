@@ -0,0 +1,21 @@
+# Generated by Django 3.1.7 on 2026-10-19 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0069_precomputedinvoice_version'),
+    ]
+
+    operations = [
+        # Existing precomputed invoices are invalid, because the version of
+        # their reference data is not known
+        migrations.AddField(
+            model_name='precomputedinvoice',
+            name='reference_data_version',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+    ]
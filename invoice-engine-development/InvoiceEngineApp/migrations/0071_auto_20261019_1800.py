@@ -0,0 +1,43 @@
+# Generated by Django 3.1.7 on 2026-10-19 18:00
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0070_precomputedinvoice_reference_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contractarchive',
+            name='invoice_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), default=list, size=None),
+        ),
+        # Copy the ids of the invoices of existing archives from their document
+        migrations.RunSQL(
+            sql="""
+                UPDATE "InvoiceEngineApp_contractarchive"
+                SET invoice_ids = ARRAY(
+                    SELECT (invoice ->> 'invoice_id')::integer
+                    FROM jsonb_array_elements(document -> 'invoices') AS invoice
+                )
+            """,
+            reverse_sql=migrations.RunSQL.noop
+        ),
+        migrations.AddIndex(
+            model_name='contractarchive',
+            index=models.Index(fields=['last_invoice_id'], name='InvoiceEngi_last_in_d73871_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contractarchive',
+            index=models.Index(fields=['last_invoice_line_id'], name='InvoiceEngi_last_in_9c5d2e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contractarchive',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['invoice_ids'], name='InvoiceEngi_invoice_cc78f2_gin'),
+        ),
+    ]
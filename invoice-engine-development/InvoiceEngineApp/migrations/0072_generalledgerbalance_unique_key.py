@@ -0,0 +1,73 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+# The key of a general ledger balance. Postgres considers NULL values distinct
+# in a unique index, so the dimensions that may be empty are indexed as a
+# value and a flag.
+UNIQUE_INDEX = 'InvoiceEngineApp_generalledgerbalance_key'
+UNIQUE_KEY = [
+    ('tenancy_id', False),
+    ('date', False),
+    ('gl_account', False),
+    ('gl_dimension_base_component', True),
+    ('gl_dimension_contract_1', False),
+    ('gl_dimension_contract_2', False),
+    ('gl_dimension_vat', True),
+]
+
+
+def merge_balances(apps, schema_editor):
+    """Add the totals of duplicate balances to the first one."""
+    GeneralLedgerBalance = apps.get_model(
+        'InvoiceEngineApp', 'GeneralLedgerBalance'
+    )
+    fields = [column for column, nullable in UNIQUE_KEY]
+    for key in GeneralLedgerBalance.objects.values(*fields).annotate(
+            number=Count('pk')
+    ).filter(number__gt=1).order_by():
+        del key['number']
+        balance, *duplicates = GeneralLedgerBalance.objects.filter(**{
+            field if value is not None else field + '__isnull':
+                value if value is not None else True
+            for field, value in key.items()
+        }).order_by('pk')
+        for duplicate in duplicates:
+            balance.amount_debit += duplicate.amount_debit
+            balance.amount_credit += duplicate.amount_credit
+            balance.number_of_posts += duplicate.number_of_posts
+            duplicate.delete()
+        balance.save()
+
+
+def create_unique_index(apps, schema_editor):
+    # An index cannot be created on a table with pending foreign key checks,
+    # which the merge of the duplicates leaves in the same transaction
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    expressions = ', '.join(
+        "COALESCE(\"{0}\", ''), (\"{0}\" IS NULL)".format(column)
+        if nullable else '"{}"'.format(column)
+        for column, nullable in UNIQUE_KEY
+    )
+    schema_editor.execute(
+        'CREATE UNIQUE INDEX "{}" '
+        'ON "InvoiceEngineApp_generalledgerbalance" ({})'.format(
+            UNIQUE_INDEX, expressions
+        )
+    )
+
+
+def drop_unique_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS "{}"'.format(UNIQUE_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0071_auto_20261019_1800'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_balances, migrations.RunPython.noop),
+        migrations.RunPython(create_unique_index, drop_unique_index),
+    ]
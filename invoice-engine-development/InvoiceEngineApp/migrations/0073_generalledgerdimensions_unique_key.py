@@ -0,0 +1,92 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+# The key of a combination of general ledger dimensions. Postgres considers
+# NULL values distinct in a unique index, so the dimensions, which may all be
+# empty, are indexed as a value and a flag.
+UNIQUE_INDEX = 'InvoiceEngineApp_generalledgerdimensions_key'
+UNIQUE_KEY = [
+    ('tenancy_id', False),
+    ('gl_account', True),
+    ('gl_account_vat', True),
+    ('gl_dimension_base_component', True),
+    ('gl_dimension_contract_1', True),
+    ('gl_dimension_contract_2', True),
+    ('gl_dimension_vat', True),
+]
+
+
+def merge_dimensions(apps, schema_editor):
+    """Point the invoice lines, general ledger posts and archived documents
+    that refer to duplicate dimensions to the first one.
+    """
+    GeneralLedgerDimensions = apps.get_model(
+        'InvoiceEngineApp', 'GeneralLedgerDimensions'
+    )
+    InvoiceLine = apps.get_model('InvoiceEngineApp', 'InvoiceLine')
+    GeneralLedgerPost = apps.get_model('InvoiceEngineApp', 'GeneralLedgerPost')
+    ContractArchive = apps.get_model('InvoiceEngineApp', 'ContractArchive')
+
+    fields = [column for column, nullable in UNIQUE_KEY]
+    for key in GeneralLedgerDimensions.objects.values(*fields).annotate(
+            number=Count('pk')
+    ).filter(number__gt=1).order_by():
+        del key['number']
+        dimensions, *duplicates = GeneralLedgerDimensions.objects.filter(**{
+            field if value is not None else field + '__isnull':
+                value if value is not None else True
+            for field, value in key.items()
+        }).order_by('pk')
+        duplicate_ids = {duplicate.pk for duplicate in duplicates}
+        for model in (InvoiceLine, GeneralLedgerPost):
+            model.objects.filter(
+                gl_dimensions_id__in=duplicate_ids
+            ).update(gl_dimensions_id=dimensions.pk)
+
+        for archive in ContractArchive.objects.filter(
+                tenancy_id=dimensions.tenancy_id
+        ).iterator():
+            changed = False
+            for invoice in archive.document['invoices']:
+                for values in invoice['invoice_lines'] + invoice['gl_posts']:
+                    if values.get('gl_dimensions_id') in duplicate_ids:
+                        values['gl_dimensions_id'] = dimensions.pk
+                        changed = True
+            if changed:
+                archive.save(update_fields=['document'])
+
+        GeneralLedgerDimensions.objects.filter(pk__in=duplicate_ids).delete()
+
+
+def create_unique_index(apps, schema_editor):
+    # An index cannot be created on a table with pending foreign key checks,
+    # which the merge of the duplicates leaves in the same transaction
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    expressions = ', '.join(
+        "COALESCE(\"{0}\", ''), (\"{0}\" IS NULL)".format(column)
+        if nullable else '"{}"'.format(column)
+        for column, nullable in UNIQUE_KEY
+    )
+    schema_editor.execute(
+        'CREATE UNIQUE INDEX "{}" '
+        'ON "InvoiceEngineApp_generalledgerdimensions" ({})'.format(
+            UNIQUE_INDEX, expressions
+        )
+    )
+
+
+def drop_unique_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS "{}"'.format(UNIQUE_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('InvoiceEngineApp', '0072_generalledgerbalance_unique_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_dimensions, migrations.RunPython.noop),
+        migrations.RunPython(create_unique_index, drop_unique_index),
+    ]
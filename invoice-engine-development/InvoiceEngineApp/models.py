@@ -1,11 +1,26 @@
 import datetime as dt
 import decimal as dc
+import time
 
-from django.db import models, transaction
-from django.db.models import Q, F
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
+from django.db.models import (
+    Case, Exists, F, Func, OuterRef, Q, Subquery, Value, When
+)
+from django.db.models.functions import Coalesce, Greatest
+
+from InvoiceEngineApp.caching import (
+    bump_generation,
+    get_reference_data,
+    sync_generation
+)
 
 
 TWO_PLACES = dc.Decimal('.01')
+ZERO = dc.Decimal('0.00')
 
 
 def mul_f(x, y):
@@ -23,6 +38,83 @@ def div(x, y):
     return (x / y).quantize(TWO_PLACES)
 
 
+def round_2(expression):
+    """Function for rounding a database expression to two decimal places.
+    Rounds half away from zero, like ROUND_HALF_UP.
+    """
+    return Func(
+        expression, Value(2), function='ROUND',
+        output_field=models.DecimalField(max_digits=15, decimal_places=2)
+    )
+
+
+def index_price(price, percentage=None, amount=None):
+    """Function for increasing a price by a percentage or by an amount."""
+    if percentage is not None:
+        return mul_d(price, 1 + percentage / 100)
+    return price + amount
+
+
+def is_prefetched(obj, cache_name):
+    """Function to check whether a reverse relation of obj was loaded with
+    prefetch_related, so it can be used without a query.
+    """
+    return cache_name in getattr(obj, '_prefetched_objects_cache', {})
+
+
+def get_field_values(obj, names, include=False):
+    """Function to return the values of the fields of obj by attribute name,
+    without the fields in names (or only those if include is True). The
+    general ledger account and dimensions are returned instead of the
+    foreign key to their combination.
+    """
+    values = {}
+    for field in obj._meta.concrete_fields:
+        if (field.name in names) != include:
+            continue
+        if field.name == 'gl_dimensions':
+            values.update(obj.get_gl_values())
+        else:
+            values[field.attname] = getattr(obj, field.attname)
+    return values
+
+
+def from_field_values(model, values, **kwargs):
+    """Function to create an object from values returned by
+    get_field_values, which may have been stored as JSON.
+    """
+    fields = {field.attname: field for field in model._meta.concrete_fields}
+    for name, value in values.items():
+        kwargs[name] = fields[name].to_python(value) if name in fields \
+            else value
+    return model(**kwargs)
+
+
+def get_next_version(field_name):
+    """Function to return an expression for the next version in a version
+    field, which is the time in nanoseconds of the change. The version is
+    always increased, also if the clock of this process is behind.
+    """
+    return Greatest(
+        F(field_name) + Value(1, output_field=models.BigIntegerField()),
+        Value(time.time_ns(), output_field=models.BigIntegerField())
+    )
+
+
+def contracts_changed(contract_ids):
+    """Function to call after a change of contracts or of their components,
+    contract persons or invoices. Starts a new version of the contracts, which
+    also invalidates their precomputed invoices. The version is kept in the
+    database, so it is seen by all processes.
+    """
+    contract_ids = {
+        contract_id for contract_id in contract_ids if contract_id is not None
+    }
+    Contract.objects.filter(contract_id__in=contract_ids).update(
+        version=get_next_version('version')
+    )
+
+
 def get_next_invoice_id():
     """Static function to return the highest possible invoice id and invoice
     line id. Function needed because the ids are needed for other objects to
@@ -42,9 +134,170 @@ def get_next_invoice_id():
             models.Max('invoice_line_id')
         ).get('invoice_line_id__max') + 1
 
+    # The ids of archived invoices may not be used again
+    archived = ContractArchive.objects.aggregate(
+        models.Max('last_invoice_id'), models.Max('last_invoice_line_id')
+    )
+    if archived.get('last_invoice_id__max') is not None:
+        next_invoice_id = max(
+            next_invoice_id, archived.get('last_invoice_id__max') + 1
+        )
+    if archived.get('last_invoice_line_id__max') is not None:
+        next_invoice_line_id = max(
+            next_invoice_line_id, archived.get('last_invoice_line_id__max') + 1
+        )
+
     return next_invoice_id, next_invoice_line_id
 
 
+def save_invoices(new_invoices, new_invoice_lines, new_gl_posts,
+                  new_collections):
+    """Static function to write the output of an invoicing process to the
+    database. Every process that creates invoices (the invoicing run and the
+    correction invoices) uses this function, so that objects derived from the
+    invoices are kept up to date as well.
+
+    Should be called within a transaction, which should end with announcing
+    the invoices with InvoiceEvent.add_invoices.
+    """
+    Invoice.objects.bulk_create(new_invoices)
+    contracts_changed(invoice.contract_id for invoice in new_invoices)
+    TenancySummary.add_invoices(new_invoices)
+    encode_gl_dimensions(new_invoice_lines)
+    InvoiceLine.objects.bulk_create(new_invoice_lines)
+    if settings.INVOICE_ENGINE_STORE_GL_POSTS:
+        encode_gl_dimensions(new_gl_posts)
+        GeneralLedgerPost.objects.bulk_create(new_gl_posts)
+    Collection.objects.bulk_create(new_collections)
+    update_general_ledger_balances(new_gl_posts)
+
+
+def encode_gl_dimensions(objects):
+    """Static function to point objects with general ledger dimensions to
+    their combination in the dimensions table. All combinations of the
+    tenancies involved are read in one query and the missing combinations are
+    created in one query, so this can be used before a bulk_create. The
+    combinations that another process created at the same time are skipped,
+    so the combinations are read again after creating them.
+    """
+    objects_per_key = {}
+    for obj in objects:
+        key = obj.get_gl_dimensions_key()
+        if key is not None:
+            objects_per_key.setdefault(key, []).append(obj)
+
+    if not objects_per_key:
+        return
+
+    known_dimensions = {
+        dimensions.get_key(): dimensions
+        for dimensions in GeneralLedgerDimensions.objects.filter(
+            tenancy_id__in={key[0] for key in objects_per_key}
+        )
+    }
+    new_dimensions = [
+        GeneralLedgerDimensions(
+            tenancy_id=key[0],
+            **dict(zip(GL_DIMENSION_FIELDS, key[1:]))
+        )
+        for key in objects_per_key if key not in known_dimensions
+    ]
+    if new_dimensions:
+        # The ids are not returned when conflicts are ignored
+        GeneralLedgerDimensions.objects.bulk_create(
+            new_dimensions, ignore_conflicts=True
+        )
+        known_dimensions = {
+            dimensions.get_key(): dimensions
+            for dimensions in GeneralLedgerDimensions.objects.filter(
+                tenancy_id__in={x.tenancy_id for x in new_dimensions}
+            )
+        }
+
+    for key, key_objects in objects_per_key.items():
+        for obj in key_objects:
+            obj.gl_dimensions = known_dimensions[key]
+            del obj._gl_values
+
+
+def derive_general_ledger_posts(invoices):
+    """Static function to generate the general ledger posts of invoices
+    without storing them. The posts are generated in the same order as they
+    are stored by the invoicing process.
+
+    The invoices should have their tenancy, contract and invoice lines
+    (ordered by id) loaded to prevent a query per invoice.
+    """
+    gl_posts = []
+    for invoice in invoices:
+        for invoice_line in invoice.get_invoice_lines():
+            invoice_line.create_gl_posts(gl_posts)
+        invoice.create_gl_post(gl_posts)
+    return gl_posts
+
+
+def update_general_ledger_balances(gl_posts):
+    """Static function to add general ledger posts to the general ledger
+    balances. The posts are summed per key in memory first, so that every
+    balance is only updated once. The missing balances are created empty
+    first, skipping the ones that another process created at the same time,
+    so that all balances can be locked and updated in the same way.
+    """
+    totals = {}
+    for post in gl_posts:
+        key = GeneralLedgerBalance.get_key(post)
+        debit, credit, number_of_posts = totals.get(key, (0, 0, 0))
+        totals[key] = (
+            debit + dc.Decimal(post.amount_debit),
+            credit + dc.Decimal(post.amount_credit),
+            number_of_posts + 1
+        )
+
+    if not totals:
+        return
+
+    # Lock the existing balances of the affected days, so that concurrent
+    # processes cannot overwrite each other's totals
+    balances = GeneralLedgerBalance.objects.select_for_update().filter(
+        tenancy_id__in={key[0] for key in totals},
+        date__in={key[1] for key in totals}
+    )
+    existing_balances = {
+        GeneralLedgerBalance.get_key(balance): balance for balance in balances
+    }
+    new_balances = [
+        GeneralLedgerBalance(
+            tenancy_id=key[0],
+            date=key[1],
+            gl_account=key[2],
+            gl_dimension_base_component=key[3],
+            gl_dimension_contract_1=key[4],
+            gl_dimension_contract_2=key[5],
+            gl_dimension_vat=key[6]
+        )
+        for key in totals if key not in existing_balances
+    ]
+    if new_balances:
+        GeneralLedgerBalance.objects.bulk_create(
+            new_balances, ignore_conflicts=True
+        )
+        existing_balances = {
+            GeneralLedgerBalance.get_key(balance): balance
+            for balance in balances.all()
+        }
+
+    for key, (debit, credit, number_of_posts) in totals.items():
+        balance = existing_balances[key]
+        balance.amount_debit += debit
+        balance.amount_credit += credit
+        balance.number_of_posts += number_of_posts
+
+    GeneralLedgerBalance.objects.bulk_update(
+        [existing_balances[key] for key in totals],
+        ['amount_debit', 'amount_credit', 'number_of_posts']
+    )
+
+
 class Tenancy(models.Model):
     """This class represents a company. Only a user with the same username as
     the tenancy_id has access to this company and all its data. Therefore,
@@ -59,6 +312,11 @@ class Tenancy(models.Model):
     days_until_invoice_expiration = models.PositiveSmallIntegerField(
         default=14
     )
+    # The version of the contract types, base components and VAT rates of
+    # the tenancy, the time in nanoseconds of their last change
+    reference_data_version = models.BigIntegerField(
+        default=time.time_ns, editable=False
+    )
 
     def __str__(self):
         return self.name
@@ -66,57 +324,102 @@ class Tenancy(models.Model):
     def create(self, kwargs):
         pass
 
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is None and not self._state.adding:
+            # The version of the reference data is only changed by
+            # ReferenceDataModel, and a copy of the tenancy that was read
+            # before should not undo the change
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name != 'reference_data_version'
+            ]
+        super().save(*args, **kwargs)
+
+    def get_reference_data_version(self):
+        """Method to read the version of the reference data of this tenancy
+        from the database, and to make sure that the reference data is read
+        again if it was changed by another process since it was cached.
+        """
+        version = Tenancy.objects.filter(
+            company_id=self.company_id
+        ).values_list('reference_data_version', flat=True).get()
+        sync_generation(self.company_id, version)
+        return version
+
+    @staticmethod
+    def has_access(company_id, username):
+        """Return whether the user with this username has access to the
+        tenancy with this company id. The decision is not cached, so a change
+        of owner is seen by every process at once; the lookup only reads a
+        single row by its primary key.
+        """
+        tenancy_id = Tenancy.objects.filter(
+            company_id=company_id
+        ).values_list('tenancy_id', flat=True).first()
+        return tenancy_id is not None and str(tenancy_id) == str(username)
+
     def get_details(self):
-        """Method to print all fields and their values."""
-        return {
+        """Method to print all fields and their values, and the figures of
+        the summary if there is one.
+        """
+        details = {
             'name': self.name,
             'number of contracts': self.number_of_contracts,
             'last invoice number': self.last_invoice_number,
             'date of next prolonging': self.date_next_prolongation,
             'days until invoice expiration': self.days_until_invoice_expiration
         }
+        if hasattr(self, 'tenancysummary'):
+            details.update(self.tenancysummary.get_details())
+        return details
 
-    def invoice_contracts(self):
+    def invoice_contracts(self, as_of=None, backfill=False):
         """"Method to go over all components linked to this tenancy, and
         to create invoices, invoice lines, collections, and general ledger
-        posts for each of them.
+        posts for each of them. The contracts are invoiced as of a date, by
+        default today.
+
+        Contracts of which several invoicing periods have passed since their
+        next invoicing date get one invoice for all of them, unless backfill
+        is True. With backfill, every missed period gets its own invoice,
+        dated on the invoicing date of the period, as if the invoicing run
+        had run on each of these dates. The components, contract persons and
+        reference data are loaded once for all periods.
 
         The ids for invoices and invoice lines have to be set manually,
         because they will be linked to by other objects. It is not possible
         to link after entry into the database.
-        """
-        date_today = dt.date.today()
 
-        # Load all components into memory
-        # There is some inefficiency here: if for a contract
-        # date_next_prolongation = 2021-01-01 and it has a component with
-        # start_date = date_next_prolongation = 2021-05-01, the component
-        # will be loaded into memory to discard later
-        components = list(
-            self.component_set.filter(
-                Q(date_next_prolongation__isnull=False)
-                & Q(contract__date_next_prolongation__isnull=False)
-                & Q(contract__date_next_prolongation__lte=date_today)
-            ).order_by(
-                'contract_id'
-            ).select_related(
-                'contract__contract_type',
-                'vat_rate__successor_vat_rate',
-                'base_component'
+        If INVOICE_ENGINE_PRECOMPUTE_INVOICES is True, the invoices that were
+        precomputed for today by precompute_invoices are used for the
+        contracts that have not changed since, and only the other contracts
+        are invoiced here. The precomputed invoices are read again in the
+        transaction that saves them, with their contracts locked, so the
+        contracts that changed in the meantime are invoiced in the
+        transaction, and changes after that wait for the run.
+        """
+        date_today = as_of or dt.date.today()
+
+        precomputed_contract_ids = []
+        if settings.INVOICE_ENGINE_PRECOMPUTE_INVOICES and not backfill:
+            precomputed_contract_ids = list(PrecomputedInvoice.get_valid(
+                self, date_today
+            ).values_list('contract_id', flat=True))
+
+        self.get_reference_data_version()
+        components, contract_persons, pending_corrections = \
+            self.get_invoicing_data(
+                date_today, precomputed_contract_ids, backfill
             )
-        )
 
-        if not components:
+        if not components and not precomputed_contract_ids:
             # There are no contracts to prolong
             return
 
-        # Load all contract persons into memory
-        contract_persons = list(
-            self.contractperson_set.filter(
-                Q(start_date__lte=date_today)
-                & (Q(end_date__gte=date_today) | Q(end_date__isnull=True))
-            ).order_by('contract_id')
-        )
+        # Set the id for the next invoice & invoice line.
+        # Take the highest id that is currently in the database and add 1
+        next_invoice_id, next_invoice_line_id = get_next_invoice_id()
 
         # Create lists to store the generated objects
         # This is to use one single database transaction at the end
@@ -125,10 +428,234 @@ class Tenancy(models.Model):
         new_gl_posts = []
         new_collections = []
 
-        # Set the id for the next invoice & invoice line.
-        # Take the highest id that is currently in the database and add 1
-        next_invoice_id, next_invoice_line_id = get_next_invoice_id()
+        if components and backfill:
+            self.create_backfill_invoices(
+                date_today, components, contract_persons, pending_corrections,
+                next_invoice_id, next_invoice_line_id,
+                new_invoices, new_invoice_lines, new_gl_posts, new_collections
+            )
+        elif components:
+            next_invoice_id, next_invoice_line_id = self.create_invoices(
+                date_today, components, contract_persons, pending_corrections,
+                next_invoice_id, next_invoice_line_id,
+                new_invoices, new_invoice_lines, new_gl_posts, new_collections
+            )
 
+        # End of main program loop
+        # Save the changes made to the database in one transaction
+        # If one fails, they will all fail
+        with transaction.atomic():
+            # A change of a contract or of the reference data starts a new
+            # version of it, which waits for the run while the contract and
+            # the tenancy are locked
+            precomputed_invoices = {
+                precomputed_invoice.contract_id: precomputed_invoice
+                for precomputed_invoice in PrecomputedInvoice.get_valid(
+                    self, date_today
+                ).filter(
+                    contract_id__in=precomputed_contract_ids
+                ).select_related('contract', 'tenancy').select_for_update(
+                    of=('contract', 'tenancy')
+                ).order_by('contract_id')
+            }
+            changed_contract_ids = [
+                contract_id for contract_id in precomputed_contract_ids
+                if contract_id not in precomputed_invoices
+            ]
+            if changed_contract_ids:
+                changed_components, contract_persons, changed_corrections = \
+                    self.get_invoicing_data(
+                        date_today, contract_ids=changed_contract_ids
+                    )
+                if changed_components:
+                    next_invoice_id, next_invoice_line_id = \
+                        self.create_invoices(
+                            date_today, changed_components, contract_persons,
+                            changed_corrections, next_invoice_id,
+                            next_invoice_line_id, new_invoices,
+                            new_invoice_lines, new_gl_posts, new_collections
+                        )
+                    components.extend(changed_components)
+                    pending_corrections.update(changed_corrections)
+
+            # Take the invoices of the unchanged contracts from the
+            # precomputed invoices
+            contracts = {
+                component.contract_id: component.contract
+                for component in components
+            }
+            for precomputed_invoice in precomputed_invoices.values():
+                contract, contract_components = precomputed_invoice.invoice(
+                    self, next_invoice_id, next_invoice_line_id,
+                    new_invoices, new_invoice_lines, new_gl_posts,
+                    new_collections
+                )
+                contracts[contract.contract_id] = contract
+                components.extend(contract_components)
+                next_invoice_id += 1
+                next_invoice_line_id += len(
+                    precomputed_invoice.document['invoice_lines']
+                )
+
+            # The contracts and components are not saved one by one, so they
+            # are marked as changed once, by save_invoices for the contracts
+            # that were invoiced
+            Contract.objects.bulk_update(
+                contracts.values(),
+                PrecomputedInvoice.CONTRACT_FIELDS,
+                batch_size=1000
+            )
+            Component.objects.bulk_update(
+                components,
+                PrecomputedInvoice.COMPONENT_FIELDS,
+                batch_size=1000
+            )
+            uninvoiced_contract_ids = set(contracts).difference(
+                invoice.contract_id for invoice in new_invoices
+            )
+            if uninvoiced_contract_ids:
+                contracts_changed(uninvoiced_contract_ids)
+
+            save_invoices(
+                new_invoices, new_invoice_lines, new_gl_posts, new_collections
+            )
+            PendingCorrection.objects.filter(
+                id__in=[correction.id
+                        for corrections in pending_corrections.values()
+                        for correction in corrections]
+                + [correction_id
+                   for precomputed_invoice in precomputed_invoices.values()
+                   for correction_id in precomputed_invoice.document[
+                       'pending_corrections'
+                   ]]
+            ).delete()
+            # Precomputed invoices of other days can no longer be used
+            PrecomputedInvoice.objects.filter(tenancy=self).delete()
+            TenancySummary.objects.filter(tenancy=self).update(
+                last_run_date=date_today,
+                last_run_number_of_invoices=len(new_invoices),
+                last_run_total_amount=sum(
+                    invoice.total_amount for invoice in new_invoices
+                )
+            )
+
+            # Save the tenancy with the new last_invoice_number
+            self.save(update_fields=['last_invoice_number'])
+            InvoiceEvent.add_invoices(new_invoices, InvoiceEvent.RUN)
+
+    def get_invoicing_data(self, date_today, exclude_contract_ids=(),
+                           backfill=False, contract_ids=None):
+        """Method to load the components that are invoiced on a date with
+        their contracts, the contract persons that are active on the date and
+        the pending corrections of the contracts. The components are ordered
+        by contract. With backfill, the contract persons that are active on
+        any date since the first next invoicing date are loaded. The data can
+        be limited to the contracts with contract_ids.
+        """
+        # Load all components into memory
+        # There is some inefficiency here: if for a contract
+        # date_next_prolongation = 2021-01-01 and it has a component with
+        # start_date = date_next_prolongation = 2021-05-01, the component
+        # will be loaded into memory to discard later
+        components = self.component_set.filter(
+            Q(date_next_prolongation__isnull=False)
+            & Q(contract__date_next_prolongation__isnull=False)
+            & Q(contract__date_next_prolongation__lte=date_today)
+        ).order_by(
+            'contract_id'
+        ).select_related(
+            'contract'
+        )
+        if exclude_contract_ids:
+            components = components.exclude(
+                contract_id__in=list(exclude_contract_ids)
+            )
+        if contract_ids is not None:
+            components = components.filter(contract_id__in=list(contract_ids))
+        components = list(components)
+
+        if not components:
+            return [], [], {}
+
+        # Take the contract types, base components and VAT rates from the
+        # cache instead of joining them to every component
+        contract_types = get_reference_data(
+            ContractType, self.company_id,
+            [component.contract.contract_type_id for component in components]
+        )
+        base_components = get_reference_data(
+            BaseComponent, self.company_id,
+            [component.base_component_id for component in components]
+        )
+        vat_rates = get_reference_data(
+            VATRate, self.company_id,
+            [component.vat_rate_id for component in components]
+        )
+        for component in components:
+            component.contract.contract_type = \
+                contract_types[component.contract.contract_type_id]
+            component.base_component = \
+                base_components[component.base_component_id]
+            if component.vat_rate_id is not None:
+                component.vat_rate = vat_rates[component.vat_rate_id]
+
+        # Load all contract persons into memory
+        first_date = min(
+            component.contract.date_next_prolongation
+            for component in components
+        ) if backfill else date_today
+        contract_persons = self.contractperson_set.filter(
+            Q(start_date__lte=date_today)
+            & (Q(end_date__gte=first_date) | Q(end_date__isnull=True))
+        ).order_by('contract_id')
+        if exclude_contract_ids:
+            contract_persons = contract_persons.exclude(
+                contract_id__in=list(exclude_contract_ids)
+            )
+        if contract_ids is not None:
+            contract_persons = contract_persons.filter(
+                contract_id__in=list(contract_ids)
+            )
+        contract_persons = list(contract_persons)
+
+        # Load the corrections that are waiting for the next invoice of the
+        # contracts
+        pending_corrections = {}
+        corrections = list(PendingCorrection.objects.filter(
+            contract_id__in={component.contract_id for component in components}
+        ).select_related('component').order_by('id'))
+        if corrections:
+            base_components = get_reference_data(
+                BaseComponent, self.company_id,
+                [correction.component.base_component_id
+                 for correction in corrections]
+            )
+            vat_rates = get_reference_data(
+                VATRate, self.company_id,
+                [correction.component.vat_rate_id
+                 for correction in corrections]
+            )
+        for correction in corrections:
+            correction.component.base_component = \
+                base_components[correction.component.base_component_id]
+            if correction.component.vat_rate_id is not None:
+                correction.component.vat_rate = \
+                    vat_rates[correction.component.vat_rate_id]
+            pending_corrections.setdefault(
+                correction.contract_id, []
+            ).append(correction)
+
+        return components, contract_persons, pending_corrections
+
+    def create_invoices(self, date_today, components, contract_persons,
+                        pending_corrections, next_invoice_id,
+                        next_invoice_line_id, new_invoices, new_invoice_lines,
+                        new_gl_posts, new_collections):
+        """Method to create the invoices of the components loaded by
+        get_invoicing_data, with their invoice lines, general ledger posts
+        and collections. The contracts and components are changed in memory.
+        Returns the next invoice id and invoice line id.
+        """
         # Create an invoice for the first component's contract
         invoice = components[0].contract.invoice(
             date_today, next_invoice_id, self
@@ -143,6 +670,16 @@ class Tenancy(models.Model):
             # This is possible because components are ordered by contract_id
             if component.contract_id != previous_contract:
                 # Invoice for contract x is finished
+                # Add the pending corrections of contract x
+                for correction in pending_corrections.get(
+                        invoice.contract_id, []
+                ):
+                    correction.invoice(
+                        next_invoice_line_id, invoice,
+                        new_invoice_lines, new_gl_posts
+                    )
+                    next_invoice_line_id += 1
+
                 # Generate collections for contract x
                 while contract_persons and \
                         contract_persons[0].contract_id == invoice.contract_id:
@@ -168,6 +705,12 @@ class Tenancy(models.Model):
             previous_contract = component.contract_id
 
         # Finish the final invoice
+        for correction in pending_corrections.get(invoice.contract_id, []):
+            correction.invoice(
+                next_invoice_line_id, invoice, new_invoice_lines, new_gl_posts
+            )
+            next_invoice_line_id += 1
+
         while contract_persons and \
                 contract_persons[0].contract_id == invoice.contract_id:
             contract_persons[0].invoice(self, invoice, new_collections)
@@ -175,45 +718,535 @@ class Tenancy(models.Model):
 
         invoice.create_gl_post(new_gl_posts)
         invoice.contract.end_invoicing()
+        return next_invoice_id, next_invoice_line_id
+
+    def create_backfill_invoices(self, date_today, components,
+                                 contract_persons, pending_corrections,
+                                 next_invoice_id, next_invoice_line_id,
+                                 new_invoices, new_invoice_lines,
+                                 new_gl_posts, new_collections):
+        """Method to create an invoice for every period of the components
+        loaded by get_invoicing_data that starts on or before date_today.
+        The contracts with the earliest next invoicing date are invoiced
+        first, on that date and for one period, until all contracts are
+        invoiced up to date_today. The pending corrections are added to the
+        first invoice of their contract.
+        """
+        remaining_corrections = dict(pending_corrections)
+        while True:
+            invoicing_dates = [
+                component.contract.date_next_prolongation
+                for component in components
+                if component.date_next_prolongation
+                and component.contract.date_next_prolongation
+                and component.contract.date_next_prolongation <= date_today
+            ]
+            if not invoicing_dates:
+                return next_invoice_id, next_invoice_line_id
+
+            date = min(invoicing_dates)
+            period_components = [
+                component for component in components
+                if component.date_next_prolongation
+                and component.contract.date_next_prolongation == date
+            ]
+            contract_ids = {
+                component.contract_id for component in period_components
+            }
+            period_persons = [
+                person for person in contract_persons
+                if person.contract_id in contract_ids
+                and person.start_date <= date
+                and (person.end_date is None or person.end_date >= date)
+            ]
+            next_invoice_id, next_invoice_line_id = self.create_invoices(
+                date, period_components, period_persons, {
+                    contract_id: remaining_corrections.pop(contract_id, [])
+                    for contract_id in contract_ids
+                },
+                next_invoice_id, next_invoice_line_id,
+                new_invoices, new_invoice_lines, new_gl_posts, new_collections
+            )
+
+    def precompute_invoices(self, date):
+        """Method to compute the invoices of the invoicing run of a date in
+        advance, for example a few days before the end of the month. The
+        invoices are kept as one precomputed invoice per contract, and the
+        contracts, components and invoice number of the tenancy are not
+        changed. The precomputed invoice of a contract is no longer used when
+        the contract, its components, contract persons or invoices change, so
+        the invoicing run only needs to invoice those contracts itself. It
+        keeps the version of its contract as it was loaded, so a change while
+        the invoice is computed is detected as well. The same goes for the
+        version of the contract types, base components and VAT rates of the
+        tenancy.
+
+        Returns the number of precomputed invoices.
+        """
+        reference_data_version = self.get_reference_data_version()
+        components, contract_persons, pending_corrections = \
+            self.get_invoicing_data(date)
+
+        new_invoices = []
+        new_invoice_lines = []
+        new_gl_posts = []
+        new_collections = []
+        last_invoice_number = self.last_invoice_number
+        if components:
+            # The ids and invoice numbers are given when the invoices are used
+            self.create_invoices(
+                date, components, contract_persons, pending_corrections, 0, 0,
+                new_invoices, new_invoice_lines, new_gl_posts, new_collections
+            )
+        self.last_invoice_number = last_invoice_number
+
+        documents = {
+            invoice.invoice_id: {
+                'invoice': get_field_values(
+                    invoice,
+                    ['invoice_id', 'tenancy', 'contract', 'invoice_number']
+                ),
+                'invoice_lines': [],
+                'gl_posts': [],
+                'collections': [],
+                'contract': get_field_values(
+                    invoice.contract, PrecomputedInvoice.CONTRACT_FIELDS,
+                    include=True
+                ),
+                'components': [],
+                'pending_corrections': [
+                    correction.id for correction in
+                    pending_corrections.get(invoice.contract_id, [])
+                ]
+            }
+            for invoice in new_invoices
+        }
+        line_indexes = {}
+        for line in new_invoice_lines:
+            lines = documents[line.invoice.invoice_id]['invoice_lines']
+            line_indexes[line.invoice_line_id] = len(lines)
+            lines.append(
+                get_field_values(
+                    line, ['invoice_line_id', 'tenancy', 'invoice']
+                )
+            )
+        for post in new_gl_posts:
+            if post.invoice_line is not None:
+                invoice_id = post.invoice_line.invoice.invoice_id
+                line_index = line_indexes[post.invoice_line.invoice_line_id]
+            else:
+                invoice_id = post.invoice.invoice_id
+                line_index = None
+            values = get_field_values(
+                post, ['id', 'tenancy', 'invoice', 'invoice_line']
+            )
+            values['invoice_line'] = line_index
+            documents[invoice_id]['gl_posts'].append(values)
+        for collection in new_collections:
+            documents[collection.invoice.invoice_id]['collections'].append(
+                get_field_values(collection, ['id', 'tenancy', 'invoice'])
+            )
+        invoice_ids = {
+            invoice.contract_id: invoice.invoice_id for invoice in new_invoices
+        }
+        for component in components:
+            values = get_field_values(
+                component, PrecomputedInvoice.COMPONENT_FIELDS, include=True
+            )
+            values['component_id'] = component.component_id
+            documents[invoice_ids[component.contract_id]]['components'].append(
+                values
+            )
 
-        # End of main program loop
-        # Save the changes made to the database in one transaction
-        # If one fails, they will all fail
         with transaction.atomic():
-            # Loop over the components and associated contracts to update them
-            # Bulk update might overload the CPU in this case
-            previous_contract = -1
+            PrecomputedInvoice.objects.filter(tenancy=self).delete()
+            PrecomputedInvoice.objects.bulk_create(
+                PrecomputedInvoice(
+                    tenancy=self,
+                    contract_id=invoice.contract_id,
+                    version=invoice.contract.version,
+                    reference_data_version=reference_data_version,
+                    date=date,
+                    document=documents[invoice.invoice_id]
+                )
+                for invoice in new_invoices
+            )
+        return len(new_invoices)
+
+    def index_components(self, base_component_id, effective_date,
+                         percentage=None, amount=None, contract_type_id=None,
+                         as_of=None):
+        """Method to index the prices of the components of a base component,
+        for example for the annual rent increase. Every component that runs
+        on the effective date ends the day before, and is succeeded by a
+        component of which the price is increased by a percentage or an
+        amount. The price is the base amount, or the unit amount if the
+        component has no base amount.
+
+        Contracts that have been invoiced past the effective date get one
+        correction invoice, which credits the old price and charges the new
+        price for the invoiced period, or pending corrections if
+        INVOICE_ENGINE_DEFER_CORRECTIONS is True. The ids of all correction
+        invoices are reserved once and all changes are written in one
+        transaction.
+
+        The correction invoices are dated as_of, or today.
+
+        Returns the number of indexed components, contracts and correction
+        invoices.
+        """
+        date_today = as_of or dt.date.today()
+        components = self.component_set.filter(
+            Q(base_component_id=base_component_id)
+            & Q(start_date__lt=effective_date)
+            & (Q(end_date__gte=effective_date) | Q(end_date__isnull=True))
+            & Q(contract__status__in=[
+                Contract.DRAFT, Contract.ACTIVE, Contract.TERMINATED
+            ])
+            & (Q(contract__termination_date__gte=effective_date)
+               | Q(contract__termination_date__isnull=True))
+        ).order_by(
+            'contract_id', 'component_id'
+        ).select_related(
+            'contract'
+        )
+        if contract_type_id:
+            components = components.filter(
+                contract__contract_type_id=contract_type_id
+            )
+
+        with transaction.atomic():
+            # Prevent other processes from using the same invoice numbers
+            self.last_invoice_number, reference_data_version = \
+                Tenancy.objects.select_for_update().values_list(
+                    'last_invoice_number', 'reference_data_version'
+                ).get(company_id=self.company_id)
+            sync_generation(self.company_id, reference_data_version)
+
+            components = list(components)
+            contract_types = get_reference_data(
+                ContractType, self.company_id,
+                [component.contract.contract_type_id
+                 for component in components]
+            )
+            base_components = get_reference_data(
+                BaseComponent, self.company_id, [base_component_id]
+            )
+            vat_rates = get_reference_data(
+                VATRate, self.company_id,
+                [component.vat_rate_id for component in components]
+            )
+
+            contracts = {}
+            old_components = []
+            new_components = []
             for component in components:
-                if component.contract_id != previous_contract:
-                    component.contract.save(
-                        update_fields=[
-                            'balance',
-                            'date_next_prolongation',
-                            'date_prev_prolongation',
-                            'base_amount',
-                            'vat_amount',
-                            'total_amount'
-                        ]
+                # The components of a contract share one contract object, so
+                # that its amounts are accumulated
+                contract = contracts.setdefault(
+                    component.contract_id, component.contract
+                )
+                contract.contract_type = \
+                    contract_types[contract.contract_type_id]
+                component.contract = contract
+                component.base_component = \
+                    base_components[component.base_component_id]
+                if component.vat_rate_id is not None:
+                    component.vat_rate = vat_rates[component.vat_rate_id]
+
+                new_component = Component(
+                    tenancy_id=component.tenancy_id,
+                    contract=contract,
+                    base_component=component.base_component,
+                    vat_rate=component.vat_rate,
+                    description=component.description,
+                    start_date=effective_date,
+                    end_date=component.end_date,
+                    base_amount=component.base_amount,
+                    unit_id=component.unit_id,
+                    unit_amount=component.unit_amount,
+                    number_of_units=component.number_of_units
+                )
+                if component.base_amount:
+                    new_component.base_amount = index_price(
+                        component.base_amount, percentage, amount
                     )
+                else:
+                    new_component.unit_amount = index_price(
+                        component.unit_amount, percentage, amount
+                    )
+                contract.remove_component(component)
+                new_component.set_derived_fields()
 
-                component.save(
-                    update_fields=[
-                        'date_next_prolongation',
-                        'date_prev_prolongation',
-                        'vat_rate',
-                        'vat_amount',
-                        'total_amount'
-                    ]
+                if not contract.is_draft():
+                    new_component.date_next_prolongation = max(
+                        effective_date, contract.date_next_prolongation
+                    )
+                component.end_date = effective_date - dt.timedelta(days=1)
+
+                old_components.append(component)
+                new_components.append(new_component)
+
+            if not new_components:
+                return {'components': 0, 'contracts': 0, 'invoices': 0}
+
+            # The successors need a pk for their invoice lines
+            Component.objects.bulk_create(new_components)
+
+            # Credit the old price and charge the new price for the period
+            # between the effective date and the next invoicing date
+            corrections = [
+                (old, new) for old, new in zip(old_components, new_components)
+                if not old.contract.is_draft()
+                and effective_date < old.contract.date_next_prolongation
+            ]
+            correction_lines = []
+            for old, new in corrections:
+                # The old and the new component end on the same date
+                end_date = old.contract.date_next_prolongation
+                if new.end_date:
+                    end_date = min(new.end_date + dt.timedelta(days=1),
+                                   end_date)
+
+                correction_lines.append(
+                    (new, new.get_amounts_between_dates(effective_date, end_date))
                 )
-                previous_contract = component.contract_id
+                base, vat, total, unit = old.get_amounts_between_dates(
+                    effective_date, end_date
+                )
+                correction_lines.append((old, (-base, -vat, -total, -unit)))
 
-            Invoice.objects.bulk_create(new_invoices)
-            InvoiceLine.objects.bulk_create(new_invoice_lines)
-            GeneralLedgerPost.objects.bulk_create(new_gl_posts)
-            Collection.objects.bulk_create(new_collections)
+            new_invoices = []
+            new_invoice_lines = []
+            new_gl_posts = []
+            new_collections = []
+            new_corrections = []
+            if settings.INVOICE_ENGINE_DEFER_CORRECTIONS:
+                for component, (base, vat, total, unit) in correction_lines:
+                    component.create_pending_correction(
+                        base, vat, total, unit, new_corrections, date_today
+                    )
+                correction_lines = []
+
+            if correction_lines:
+                next_invoice_id, next_invoice_line_id = get_next_invoice_id()
+
+            for component, (base, vat, total, unit) in correction_lines:
+                contract = component.contract
+                if not new_invoices \
+                        or new_invoices[-1].contract_id != contract.contract_id:
+                    new_invoices.append(
+                        contract.create_invoice(
+                            date_today, next_invoice_id, self
+                        )
+                    )
+                    next_invoice_id += 1
+                component.create_invoice_line(
+                    next_invoice_line_id, new_invoices[-1],
+                    base, vat, total, unit,
+                    new_invoice_lines, new_gl_posts
+                )
+                next_invoice_line_id += 1
 
-            # Save the tenancy with the new last_invoice_number
+            contract_persons = {}
+            for person in ContractPerson.objects.filter(
+                Q(contract_id__in={invoice.contract_id
+                                   for invoice in new_invoices})
+                & Q(start_date__lte=date_today)
+                & (Q(end_date__gte=date_today) | Q(end_date__isnull=True))
+            ):
+                contract_persons.setdefault(person.contract_id, []).append(
+                    person
+                )
+            for invoice in new_invoices:
+                for person in contract_persons.get(invoice.contract_id, []):
+                    person.invoice(self, invoice, new_collections)
+                invoice.create_gl_post(new_gl_posts)
+
+            Component.objects.bulk_update(
+                old_components, ['end_date'], batch_size=1000
+            )
+            Contract.objects.bulk_update(
+                contracts.values(),
+                ['balance', 'base_amount', 'vat_amount', 'total_amount'],
+                batch_size=1000
+            )
+            save_invoices(
+                new_invoices, new_invoice_lines, new_gl_posts, new_collections
+            )
+            PendingCorrection.objects.bulk_create(new_corrections)
             self.save(update_fields=['last_invoice_number'])
+            # The components were written without their save method
+            contracts_changed(contracts)
+            InvoiceEvent.add_invoices(new_invoices, InvoiceEvent.INDEXATION)
+
+        return {
+            'components': len(new_components),
+            'contracts': len(contracts),
+            'invoices': len(new_invoices)
+        }
+
+    def activate_contracts(self, contract_ids=None):
+        """Method to activate draft contracts of this tenancy at once, or all
+        of its draft contracts if no ids are given. The contracts are checked
+        like in Contract.can_activate, but in one query for all contracts,
+        and the valid contracts are activated with one update per table.
+
+        Returns the ids of the activated contracts and a dictionary with the
+        reason why each other contract was not activated.
+        """
+        contracts = self.contract_set.all()
+        if contract_ids is None:
+            contracts = contracts.filter(status=Contract.DRAFT)
+        else:
+            contract_ids = set(contract_ids)
+            contracts = contracts.filter(contract_id__in=contract_ids)
+
+        contracts = contracts.annotate(
+            persons_percentage=Subquery(
+                ContractPerson.objects.filter(
+                    contract_id=OuterRef('contract_id'),
+                    start_date__lte=OuterRef('start_date')
+                ).values(
+                    'contract_id'
+                ).annotate(
+                    percentage=models.Sum('percentage_of_total')
+                ).values('percentage')
+            ),
+            has_components=Exists(
+                Component.objects.filter(contract_id=OuterRef('contract_id'))
+            )
+        ).order_by('contract_id')
+
+        with transaction.atomic():
+            activated = []
+            rejected = {}
+            # Lock the contracts, so they are not changed before activation
+            for contract in contracts.select_for_update(of=('self',)).only(
+                'contract_id', 'status', 'start_date'
+            ):
+                if not contract.is_draft():
+                    rejected[contract.contract_id] = \
+                        "The contract is not a draft."
+                elif not contract.start_date:
+                    rejected[contract.contract_id] = \
+                        "The contract has no start date."
+                elif contract.persons_percentage != 100:
+                    rejected[contract.contract_id] = \
+                        "The percentages of the contract persons do not " \
+                        "add up to 100."
+                elif not contract.has_components:
+                    rejected[contract.contract_id] = \
+                        "The contract has no components."
+                else:
+                    activated.append(contract.contract_id)
+
+            if contract_ids is not None:
+                for contract_id in contract_ids - set(activated) - set(rejected):
+                    rejected[contract_id] = "The contract does not exist."
+
+            if not activated:
+                return activated, rejected
+
+            contract_start_date = Subquery(
+                Contract.objects.filter(
+                    contract_id=OuterRef('contract_id')
+                ).values('start_date')
+            )
+            Component.objects.filter(
+                contract_id__in=activated,
+                start_date__lt=F('contract__start_date')
+            ).update(
+                start_date=contract_start_date
+            )
+            Component.objects.filter(
+                contract_id__in=activated
+            ).update(
+                date_next_prolongation=F('start_date')
+            )
+            ContractPerson.objects.filter(
+                contract_id__in=activated,
+                start_date__lt=F('contract__start_date')
+            ).update(
+                start_date=contract_start_date
+            )
+            Contract.objects.filter(
+                contract_id__in=activated
+            ).update(
+                date_next_prolongation=F('start_date'),
+                status=Case(
+                    When(termination_date__isnull=False,
+                         then=Value(Contract.TERMINATED)),
+                    default=Value(Contract.ACTIVE)
+                )
+            )
+            TenancySummary.add(
+                self.company_id, number_of_active_contracts=len(activated)
+            )
+            # The contracts were written without their save method
+            contracts_changed(activated)
+
+        return activated, rejected
+
+    def end_contracts(self, contract_ids=None, termination_date=None,
+                      as_of=None):
+        """Method to end contracts of this tenancy at once, for example after
+        the sale of a building. If a termination date is given, the active
+        and terminated contracts are terminated on that date first. Without
+        ids, all contracts that are terminated on or before as_of (or today)
+        are ended. See Contract.end_contracts.
+
+        Returns the ids of the ended contracts and a dictionary with the
+        reason why each other contract was not ended.
+        """
+        contracts = self.contract_set.all()
+        if contract_ids is None:
+            contracts = contracts.filter(
+                status=Contract.TERMINATED,
+                termination_date__lte=as_of or dt.date.today()
+            )
+        else:
+            contract_ids = set(contract_ids)
+            contracts = contracts.filter(contract_id__in=contract_ids)
+
+        with transaction.atomic():
+            # Prevent other processes from using the same invoice numbers
+            self.last_invoice_number = Tenancy.objects.select_for_update(
+            ).values_list(
+                'last_invoice_number', flat=True
+            ).get(company_id=self.company_id)
+
+            ended = []
+            rejected = {}
+            for contract in contracts.select_for_update(
+                    of=('self',)
+            ).select_related(
+                'contract_type'
+            ).order_by('contract_id'):
+                if termination_date \
+                        and (contract.is_active() or contract.is_terminated()):
+                    if termination_date < contract.start_date:
+                        rejected[contract.contract_id] = \
+                            "The termination date is before the start date " \
+                            "of the contract."
+                        continue
+                    contract.termination_date = termination_date
+                    contract.status = Contract.TERMINATED
+
+                if contract.can_end():
+                    ended.append(contract)
+                else:
+                    rejected[contract.contract_id] = \
+                        "The contract is not terminated."
+
+            ended_ids = [contract.contract_id for contract in ended]
+            if contract_ids is not None:
+                for contract_id in contract_ids - set(ended_ids) - set(rejected):
+                    rejected[contract_id] = "The contract does not exist."
+
+            Contract.end_contracts(ended, self, as_of)
+
+        return ended_ids, rejected
 
 
 class TenancyDependentModel(models.Model):
@@ -232,7 +1265,130 @@ class TenancyDependentModel(models.Model):
         abstract = True
 
 
-class ContractType(TenancyDependentModel):
+class ReferenceDataModel(TenancyDependentModel):
+    """This abstract class is inherited by the models that are cached per
+    tenancy by get_reference_data. Every change starts a new generation of
+    the cached data of the tenancy, and a new version of the reference data
+    of the tenancy in the database.
+    """
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.reference_data_changed()
+
+    def delete(self, using=None, keep_parents=False):
+        result = super().delete(using, keep_parents)
+        self.reference_data_changed()
+        return result
+
+    def reference_data_changed(self):
+        bump_generation(self.tenancy_id)
+        Tenancy.objects.filter(company_id=self.tenancy_id).update(
+            reference_data_version=get_next_version('reference_data_version')
+        )
+
+    class Meta:
+        abstract = True
+
+
+class VersionedContractModel(TenancyDependentModel):
+    """This abstract class is inherited by the contract and the models that
+    belong to a contract. Every change starts a new version of the contract,
+    which is used to cache the pages that show it.
+    """
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        contracts_changed([self.contract_id])
+
+    def delete(self, using=None, keep_parents=False):
+        contract_id = self.contract_id
+        result = super().delete(using, keep_parents)
+        contracts_changed([contract_id])
+        return result
+
+    class Meta:
+        abstract = True
+
+
+GL_DIMENSION_FIELDS = [
+    'gl_account',
+    'gl_account_vat',
+    'gl_dimension_base_component',
+    'gl_dimension_contract_1',
+    'gl_dimension_contract_2',
+    'gl_dimension_vat'
+]
+
+
+def gl_dimension_property(name):
+    """Static function to create a property for a general ledger dimension.
+    The value is read from the dimensions table, unless it was set on this
+    object and has not been saved yet.
+    """
+    def getter(self):
+        return self.get_gl_values()[name]
+
+    def setter(self, value):
+        if '_gl_values' not in self.__dict__:
+            self._gl_values = self.get_gl_values()
+        self._gl_values[name] = value
+
+    return property(getter, setter)
+
+
+class GeneralLedgerDimensionsModel(models.Model):
+    """This abstract class is inherited by models which store general ledger
+    dimensions. The account and dimensions are stored once per combination in
+    the general ledger dimensions table and referred to by a foreign key, but
+    can be read and set as if they were fields of the model itself.
+    """
+    gl_dimensions = models.ForeignKey(
+        'GeneralLedgerDimensions', null=True, on_delete=models.RESTRICT
+    )
+
+    gl_account = gl_dimension_property('gl_account')
+    gl_account_vat = gl_dimension_property('gl_account_vat')
+    gl_dimension_base_component = gl_dimension_property(
+        'gl_dimension_base_component'
+    )
+    gl_dimension_contract_1 = gl_dimension_property('gl_dimension_contract_1')
+    gl_dimension_contract_2 = gl_dimension_property('gl_dimension_contract_2')
+    gl_dimension_vat = gl_dimension_property('gl_dimension_vat')
+
+    def get_gl_values(self):
+        """Method to return the account and dimensions of this object as a
+        dictionary.
+        """
+        if '_gl_values' in self.__dict__:
+            return self._gl_values
+        if self.gl_dimensions_id is None:
+            return dict.fromkeys(GL_DIMENSION_FIELDS)
+        return {
+            name: getattr(self.gl_dimensions, name)
+            for name in GL_DIMENSION_FIELDS
+        }
+
+    def get_gl_tenancy_id(self):
+        return self.tenancy_id
+
+    def get_gl_dimensions_key(self):
+        """Method to return the key of the dimensions this object should refer
+        to, or None if the foreign key is up to date.
+        """
+        if '_gl_values' not in self.__dict__:
+            return None
+        return (self.get_gl_tenancy_id(), ) + tuple(
+            self._gl_values[name] for name in GL_DIMENSION_FIELDS
+        )
+
+    def save(self, *args, **kwargs):
+        encode_gl_dimensions([self])
+        super().save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
+class ContractType(ReferenceDataModel):
     """This class represents a certain type of contract, for instance for
     different kinds of rental cars for which they can make contracts.
     """
@@ -255,12 +1411,28 @@ class ContractType(TenancyDependentModel):
         """Method to determine whether the instance can be updated
         or deleted.
         """
+        if hasattr(self, 'in_use'):
+            return not self.in_use
         return not self.contract_set.filter(
             date_prev_prolongation__isnull=False
         ).exists()
 
+    @staticmethod
+    def annotate_in_use(qs):
+        """Static function to annotate whether the contract types are in
+        use, so that can_update_or_delete does not need a query per object.
+        """
+        return qs.annotate(
+            in_use=Exists(
+                Contract.objects.filter(
+                    contract_type=OuterRef('pk'),
+                    date_prev_prolongation__isnull=False
+                )
+            )
+        )
+
 
-class BaseComponent(TenancyDependentModel):
+class BaseComponent(ReferenceDataModel):
     """The base component represents a basic unit for a contract line.
     In the case of a housing provider, this could for instance be one line
     specifying the rent price, and one line specifying any service costs.
@@ -287,12 +1459,28 @@ class BaseComponent(TenancyDependentModel):
         return self.can_update_or_delete()
 
     def can_update_or_delete(self):
+        if hasattr(self, 'in_use'):
+            return not self.in_use
         return not self.component_set.filter(
             date_prev_prolongation__isnull=False
         ).exists()
 
+    @staticmethod
+    def annotate_in_use(qs):
+        """Static function to annotate whether the base components are in
+        use, so that can_update_or_delete does not need a query per object.
+        """
+        return qs.annotate(
+            in_use=Exists(
+                Component.objects.filter(
+                    base_component=OuterRef('pk'),
+                    date_prev_prolongation__isnull=False
+                )
+            )
+        )
+
 
-class VATRate(TenancyDependentModel):
+class VATRate(ReferenceDataModel):
     """The VAT rate defines the value added tax charged for a contract line.
     In the Netherlands, there are three types of VAT: none (0%), low (9%),
     or high (21%).
@@ -327,17 +1515,38 @@ class VATRate(TenancyDependentModel):
         return self.can_update_or_delete()
 
     def can_update_or_delete(self):
+        if hasattr(self, 'in_use'):
+            return not self.in_use
         return not self.component_set.exclude(
             contract__status=Contract.DRAFT
         ).exists()
 
+    @staticmethod
+    def annotate_in_use(qs):
+        """Static function to annotate whether the VAT rates are in use, so
+        that can_update_or_delete does not need a query per object.
+        """
+        return qs.annotate(
+            in_use=Exists(
+                Component.objects.filter(
+                    vat_rate=OuterRef('pk')
+                ).exclude(
+                    contract__status=Contract.DRAFT
+                )
+            )
+        )
+
     def create(self, kwargs):
         super().create(kwargs)
 
+        # The current VAT rate of this type is read from the database, because
+        # the cached VAT rates may not contain the VAT rates of other
+        # processes yet
         try:
-            old_vat_rate = self.tenancy.vatrate_set.exclude(
+            old_vat_rate = VATRate.objects.exclude(
                 vat_rate_id=self.vat_rate_id
             ).get(
+                tenancy_id=self.tenancy_id,
                 type=self.type,
                 end_date__isnull=True
             )
@@ -345,34 +1554,103 @@ class VATRate(TenancyDependentModel):
             old_vat_rate = None
 
         if old_vat_rate:
+            # Save the VAT rate because the components and the old VAT rate
+            # refer to it
+            self.save()
             if old_vat_rate.can_delete():
-                components = old_vat_rate.component_set.all()
-                for component in components:
-                    component.remove_from_contract()
-                    component.vat_rate = self
-                    component.update()
+                VATRate.replace_in_components(
+                    old_vat_rate.component_set.all(), self
+                )
                 old_vat_rate.delete()
             else:
                 old_vat_rate.end_date = self.start_date - dt.timedelta(days=1)
                 old_vat_rate.successor_vat_rate = self
+                # The components of the old VAT rate are invoiced with the
+                # new VAT rate from its start date, so the save invalidates
+                # the precomputed invoices
                 old_vat_rate.save(
                     update_fields=['successor_vat_rate', 'end_date']
                 )
 
     def update(self):
-        for component in self.component_set.all():
-            component.update()
+        return VATRate.replace_in_components(self.component_set.all(), self)
 
     def delete(self, using=None, keep_parents=False):
         with transaction.atomic():
-            for component in self.component_set.select_related('contract'):
-                component.remove_from_contract()
-                component.vat_rate = self.successor_vat_rate
-                component.update()
-            super().delete(using, keep_parents)
+            VATRate.replace_in_components(
+                self.component_set.all(), self.successor_vat_rate
+            )
+            return super().delete(using, keep_parents)
+
+    @staticmethod
+    def replace_in_components(components, vat_rate):
+        """Static function to set the VAT rate of the components (None for
+        no VAT), and to compute the VAT and total amounts of the components
+        and their contracts again. This takes a fixed number of queries for
+        any number of components. Returns the number of components and the
+        number of contracts that were updated.
+        """
+        decimal_field = models.DecimalField(max_digits=15, decimal_places=2)
+        # The base amount, or the amount of the units (see set_derived_fields)
+        amount = Coalesce(
+            Case(
+                When(
+                    Q(base_amount__isnull=True) | Q(base_amount=0),
+                    then=round_2(F('number_of_units') * F('unit_amount'))
+                ),
+                default=F('base_amount'),
+                output_field=decimal_field
+            ),
+            Value(ZERO, output_field=decimal_field)
+        )
+        if vat_rate:
+            vat_amount = round_2(
+                Value(div(vat_rate.percentage, 100),
+                      output_field=decimal_field) * amount
+            )
+        else:
+            vat_amount = Value(ZERO, output_field=decimal_field)
 
+        with transaction.atomic():
+            contract_ids = list(
+                components.order_by().values_list(
+                    'contract_id', flat=True
+                ).distinct()
+            )
 
-class Contract(TenancyDependentModel):
+            # Add the differences per contract before the components change
+            differences = components.filter(
+                contract=OuterRef('pk')
+            ).order_by().values('contract').annotate(
+                base_difference=models.Sum(
+                    amount - (F('total_amount') - F('vat_amount'))
+                ),
+                vat_difference=models.Sum(vat_amount - F('vat_amount')),
+                total_difference=models.Sum(
+                    amount + vat_amount - F('total_amount')
+                )
+            )
+            number_of_contracts = Contract.objects.filter(
+                contract_id__in=contract_ids
+            ).update(
+                base_amount=F('base_amount')
+                + Subquery(differences.values('base_difference')),
+                vat_amount=F('vat_amount')
+                + Subquery(differences.values('vat_difference')),
+                total_amount=F('total_amount')
+                + Subquery(differences.values('total_difference'))
+            )
+
+            number_of_components = components.update(
+                vat_rate=vat_rate,
+                vat_amount=vat_amount,
+                total_amount=amount + vat_amount
+            )
+            contracts_changed(contract_ids)
+        return number_of_components, number_of_contracts
+
+
+class Contract(VersionedContractModel):
     """The contract is an agreement between two parties (e.g. a company and a
     person). In this case, the person(s) agree to pay some amount per some time
     period in exchange for a service or product.
@@ -413,6 +1691,9 @@ class Contract(TenancyDependentModel):
 
     # Model fields
     contract_id = models.AutoField(primary_key=True)
+    # The time in nanoseconds of the last change of the contract or of its
+    # components, contract persons or invoices (see contracts_changed)
+    version = models.BigIntegerField(default=time.time_ns, editable=False)
     external_customer_id = models.PositiveIntegerField()
     status = models.CharField(
         max_length=1,
@@ -457,7 +1738,19 @@ class Contract(TenancyDependentModel):
     def __str__(self):
         return self.contract_type.description
 
+    @staticmethod
+    def get_page_version(company_id, contract_id):
+        """Return the versions of the contract and of the reference data of
+        its tenancy, which is everything the pages of the contract and its
+        invoices show, or None if the contract does not exist.
+        """
+        return Contract.objects.filter(
+            tenancy_id=company_id, contract_id=contract_id
+        ).values_list('version', 'tenancy__reference_data_version').first()
+
     def has_components(self):
+        if is_prefetched(self, 'component_set'):
+            return bool(self.component_set.all())
         return self.component_set.exists()
 
     def get_components(self):
@@ -470,6 +1763,8 @@ class Contract(TenancyDependentModel):
         return self.contractperson_set.all()
 
     def get_invoices(self):
+        if self.is_historic() and hasattr(self, 'contractarchive'):
+            return self.contractarchive.get_invoices()
         return self.invoice_set.all()
 
     def get_period(self):
@@ -513,11 +1808,17 @@ class Contract(TenancyDependentModel):
         and a start date.
         """
         return (self.is_draft()
-                and self.persons_percentage_is_full()
                 and self.start_date
+                and self.persons_percentage_is_full()
                 and self.has_components())
     
     def persons_percentage_is_full(self):
+        if is_prefetched(self, 'contractperson_set'):
+            return sum(
+                person.percentage_of_total
+                for person in self.contractperson_set.all()
+                if person.start_date and person.start_date <= self.start_date
+            ) == 100
         return self.contractperson_set.filter(
             start_date__lte=self.start_date
         ).aggregate(
@@ -542,101 +1843,186 @@ class Contract(TenancyDependentModel):
                 start_date=self.start_date
             )
             self.save()
+            TenancySummary.add(self.tenancy_id, number_of_active_contracts=1)
 
     def can_end(self):
         return self.status == Contract.TERMINATED
 
-    def end(self):
+    def end(self, as_of=None):
         """End the contract. If it is ended at a date that has already
         been invoiced, send a correction invoice for the period between
         the newly set end date and the last day that was invoiced.
         """
-        date_today = dt.date.today()
-        self.end_date = self.termination_date
-        self.status = Contract.ENDED
-        components = self.component_set.filter(
-            Q(end_date__isnull=True) | Q(end_date__gt=self.end_date)
-        )
-        persons = self.contractperson_set.filter(
-            Q(start_date__lte=date_today)
-            & (Q(end_date__gte=date_today) | Q(end_date__isnull=True))
-        )
+        Contract.end_contracts([self], self.tenancy, as_of)
+
+    @staticmethod
+    def end_contracts(contracts, tenancy, as_of=None):
+        """Static function to end terminated contracts of a tenancy at their
+        termination dates. The components and contract persons that run after
+        the end date are ended with the contract. Contracts that have been
+        invoiced past the end date get a correction invoice, which credits
+        the invoiced days after the end date and contains their pending
+        corrections.
+
+        The components and contract persons of all contracts are loaded in
+        two queries, the ids of all correction invoices are reserved once and
+        all changes are written with bulk writes in one transaction. The
+        correction invoices are dated as_of, or today.
+        """
+        date_today = as_of or dt.date.today()
+        contracts = {contract.contract_id: contract for contract in contracts}
+        if not contracts:
+            return
 
-        if self.end_date == self.date_next_prolongation - dt.timedelta(days=1):
-            # No need to invoice this contract in the future
-            self.date_next_prolongation = None
-            with transaction.atomic():
-                components.update(end_date=self.end_date)
-                persons.update(end_date=self.end_date)
-                self.save(
-                    update_fields=[
-                        'end_date', 'status', 'date_next_prolongation'
-                    ]
-                )
-        elif self.end_date < self.date_next_prolongation:
-            # Issue a correction invoice
-            invoice_id, invoice_line_id = get_next_invoice_id()
-            invoice = self.create_invoice(
-                date_today,
-                invoice_id,
-                self.tenancy
+        for contract in contracts.values():
+            contract.end_date = contract.termination_date
+            contract.status = Contract.ENDED
+
+        # The termination dates may not have been saved yet
+        components = [
+            component for component in Component.objects.filter(
+                Q(contract_id__in=contracts)
+                & Q(start_date__isnull=False)
+                & (Q(end_date__isnull=True) | Q(end_date__gt=min(
+                    contract.end_date for contract in contracts.values()
+                )))
+            ).order_by(
+                'contract_id', 'component_id'
+            ).select_related(
+                'base_component', 'vat_rate'
             )
+            if not component.end_date
+            or component.end_date > contracts[component.contract_id].end_date
+        ]
+        persons = list(
+            ContractPerson.objects.filter(
+                Q(contract_id__in=contracts)
+                & Q(start_date__lte=date_today)
+                & (Q(end_date__gte=date_today) | Q(end_date__isnull=True))
+            ).order_by('contract_id')
+        )
 
-            new_invoice_lines = []
-            new_gl_posts = []
-            new_collections = []
-
-            components = list(components)
-            for component in components:
-                component.end_date = self.end_date
-                component.date_next_prolongation = None
-                base, vat, total, unit = component.get_amounts_between_dates(
-                    self.end_date,
-                    min(component.end_date + dt.timedelta(days=1),
-                        self.date_next_prolongation)
+        # Compute the invoiced amounts after the end dates
+        credits = []
+        for component in components:
+            contract = contracts[component.contract_id]
+            component.contract = contract
+            invoiced_until = contract.date_next_prolongation
+            if invoiced_until and contract.end_date < invoiced_until:
+                start_date = max(
+                    component.start_date,
+                    contract.end_date + dt.timedelta(days=1)
                 )
+                end_date = invoiced_until
+                if component.end_date:
+                    end_date = min(
+                        component.end_date + dt.timedelta(days=1),
+                        invoiced_until
+                    )
+                if start_date < end_date:
+                    base, vat, total, unit = \
+                        component.get_amounts_between_dates(
+                            start_date, end_date
+                        )
+                    credits.append((component, (-base, -vat, -total, -unit)))
+                component.date_next_prolongation = None
+            component.end_date = contract.end_date
+
+        # Contracts that will not be invoiced again get their pending
+        # corrections on the correction invoice
+        pending_corrections = list(
+            PendingCorrection.objects.filter(
+                contract_id__in=[
+                    contract.contract_id for contract in contracts.values()
+                    if contract.date_next_prolongation
+                    and contract.end_date < contract.date_next_prolongation
+                ]
+            ).select_related(
+                'component__base_component', 'component__vat_rate'
+            ).order_by('id')
+        )
+        for correction in pending_corrections:
+            credits.append((
+                correction.component,
+                (correction.base_amount, correction.vat_amount,
+                 correction.total_amount, correction.unit_amount)
+            ))
+
+        new_invoices = []
+        new_invoice_lines = []
+        new_gl_posts = []
+        new_collections = []
+        invoices = {}
+        if credits:
+            next_invoice_id, next_invoice_line_id = get_next_invoice_id()
+            for component, (base, vat, total, unit) in credits:
+                invoice = invoices.get(component.contract_id)
+                if invoice is None:
+                    invoice = contracts[component.contract_id].create_invoice(
+                        date_today, next_invoice_id, tenancy
+                    )
+                    invoices[component.contract_id] = invoice
+                    new_invoices.append(invoice)
+                    next_invoice_id += 1
 
                 component.create_invoice_line(
-                    invoice_line_id,
+                    next_invoice_line_id,
                     invoice,
-                    -base,
-                    -vat,
-                    -total,
-                    -unit,
+                    base,
+                    vat,
+                    total,
+                    unit,
                     new_invoice_lines,
                     new_gl_posts
                 )
-                invoice_line_id += 1
+                next_invoice_line_id += 1
 
-            persons = list(persons)
-            for person in persons:
-                person.end_date = self.end_date
+        for person in persons:
+            person.end_date = contracts[person.contract_id].end_date
+            if person.contract_id in invoices:
                 person.invoice(
-                    self.tenancy,
-                    invoice,
-                    new_collections
+                    tenancy, invoices[person.contract_id], new_collections
                 )
+        for invoice in new_invoices:
             invoice.create_gl_post(new_gl_posts)
 
-            self.date_next_prolongation = None
+        # Contracts that are invoiced up to their end date need not be
+        # invoiced in the future. The others are invoiced until the end date.
+        for contract in contracts.values():
+            if contract.date_next_prolongation \
+                    and contract.end_date < contract.date_next_prolongation:
+                contract.date_next_prolongation = None
 
-            with transaction.atomic():
-                for component in components:
-                    component.save(
-                        update_fields=['end_date', 'date_next_prolongation']
-                    )
-                for person in persons:
-                    person.save(update_fields=['end_date'])
-                invoice.save()
-                InvoiceLine.objects.bulk_create(new_invoice_lines)
-                GeneralLedgerPost.objects.bulk_create(new_gl_posts)
-                Collection.objects.bulk_create(new_collections)
-                self.tenancy.save(update_fields=['last_invoice_number'])
-                self.save(
-                    update_fields=[
-                        'end_date', 'status', 'date_next_prolongation'
-                    ]
+        with transaction.atomic():
+            Component.objects.bulk_update(
+                components, ['end_date', 'date_next_prolongation'],
+                batch_size=1000
+            )
+            ContractPerson.objects.bulk_update(
+                persons, ['end_date'], batch_size=1000
+            )
+            if new_invoices:
+                save_invoices(
+                    new_invoices, new_invoice_lines, new_gl_posts,
+                    new_collections
                 )
+                PendingCorrection.objects.filter(
+                    id__in=[correction.id for correction in pending_corrections]
+                ).delete()
+                tenancy.save(update_fields=['last_invoice_number'])
+            Contract.objects.bulk_update(
+                contracts.values(),
+                ['termination_date', 'end_date', 'status',
+                 'date_next_prolongation', 'balance'],
+                batch_size=1000
+            )
+            TenancySummary.add(
+                tenancy.company_id,
+                number_of_active_contracts=-len(contracts)
+            )
+            # The contracts were written without their save method
+            contracts_changed(contracts)
+            InvoiceEvent.add_invoices(new_invoices, InvoiceEvent.ENDING)
 
     def is_draft(self):
         return self.status == Contract.DRAFT
@@ -734,8 +2120,17 @@ class Contract(TenancyDependentModel):
             gl_account=self.contract_type.gl_debit,
         )
 
+    class Meta:
+        # Used by the amount search of the contract list
+        indexes = [
+            models.Index(fields=['tenancy', 'total_amount']),
+            models.Index(fields=['tenancy', 'balance']),
+            # Used to read the contracts of a tenancy after a cursor
+            models.Index(fields=['tenancy', 'contract_id'])
+        ]
+
 
-class Component(TenancyDependentModel):
+class Component(VersionedContractModel):
     """A Contract is built up of one or more components.
     These 'contract lines' specify the amounts and services.
     """
@@ -762,8 +2157,9 @@ class Component(TenancyDependentModel):
     def __str__(self):
         return self.description
 
-    def create(self, kwargs):
+    def create(self, kwargs, as_of=None):
         """Also check if this component replaces an existing component.
+        The correction invoices are dated as_of, or today.
         """
         super().create(kwargs)
         self.contract = Contract.objects.get(
@@ -780,41 +2176,21 @@ class Component(TenancyDependentModel):
         # Save the component because it needs a pk for a correction invoice
         self.save()
 
-        invoice = None
-        line_id = None
-        new_invoice_lines = []
-        new_gl_posts = []
-        new_collections = []
-        date_today = dt.date.today()
+        # The corrections of the invoiced amounts, as components with amounts
+        corrections = []
+        date_today = as_of or dt.date.today()
 
         if not self.is_draft():
             self.date_next_prolongation = self.start_date
             if (self.date_next_prolongation
                     < self.contract.date_next_prolongation):
-                invoice_id, line_id = get_next_invoice_id()
-                invoice = self.contract.create_invoice(
-                    date_today,
-                    invoice_id,
-                    self.tenancy
-                )
-
-                base, vat, total, unit = self.get_amounts_between_dates(
-                    self.date_next_prolongation,
-                    self.contract.date_next_prolongation
-                )
-
-                self.create_invoice_line(
-                    line_id,
-                    invoice,
-                    base,
-                    vat,
-                    total,
-                    unit,
-                    new_invoice_lines,
-                    new_gl_posts
-                )
-                line_id += 1
-
+                corrections.append((
+                    self,
+                    self.get_amounts_between_dates(
+                        self.date_next_prolongation,
+                        self.contract.date_next_prolongation
+                    )
+                ))
                 self.date_next_prolongation = \
                     self.contract.date_next_prolongation
 
@@ -896,20 +2272,39 @@ class Component(TenancyDependentModel):
                 )
                 c.start_date = self.end_date + dt.timedelta(days=1)
 
-            if invoice:
-                c.create_invoice_line(
+            if corrections:
+                corrections.append((c, (-base, -vat, -total, -unit)))
+
+        new_invoices = []
+        new_invoice_lines = []
+        new_gl_posts = []
+        new_collections = []
+        new_corrections = []
+        if corrections and settings.INVOICE_ENGINE_DEFER_CORRECTIONS:
+            for component, (base, vat, total, unit) in corrections:
+                component.create_pending_correction(
+                    base, vat, total, unit, new_corrections, date_today
+                )
+        elif corrections:
+            invoice_id, line_id = get_next_invoice_id()
+            invoice = self.contract.create_invoice(
+                date_today,
+                invoice_id,
+                self.tenancy
+            )
+            for component, (base, vat, total, unit) in corrections:
+                component.create_invoice_line(
                     line_id,
                     invoice,
-                    -base,
-                    -vat,
-                    -total,
-                    -unit,
+                    base,
+                    vat,
+                    total,
+                    unit,
                     new_invoice_lines,
                     new_gl_posts
                 )
                 line_id += 1
 
-        if invoice:
             persons = self.contract.contractperson_set.filter(
                 Q(start_date__lte=date_today)
                 & (Q(end_date__gte=date_today) | Q(end_date__isnull=True))
@@ -918,19 +2313,26 @@ class Component(TenancyDependentModel):
                 person.invoice(self.tenancy, invoice, new_collections)
 
             invoice.create_gl_post(new_gl_posts)
+            new_invoices.append(invoice)
 
         with transaction.atomic():
             self.contract.save()
-            if invoice:
-                invoice.save()
-                InvoiceLine.objects.bulk_create(new_invoice_lines)
-                GeneralLedgerPost.objects.bulk_create(new_gl_posts)
-                Collection.objects.bulk_create(new_collections)
-                for component in components:
-                    component.save(update_fields=['start_date', 'end_date'])
+            if corrections:
+                save_invoices(
+                    new_invoices, new_invoice_lines, new_gl_posts,
+                    new_collections
+                )
+                PendingCorrection.objects.bulk_create(new_corrections)
+                # The contract is marked as changed by its save
+                Component.objects.bulk_update(
+                    components, ['start_date', 'end_date']
+                )
                 if new_component:
                     new_component.save()
                 self.tenancy.save(update_fields=['last_invoice_number'])
+                InvoiceEvent.add_invoices(
+                    new_invoices, InvoiceEvent.CORRECTION
+                )
 
     def get_amounts_between_dates(self, start_date, end_date):
         """Method that calculates the exact amount that should be paid for
@@ -1042,12 +2444,31 @@ class Component(TenancyDependentModel):
     def is_draft(self):
         return self.contract.is_draft()
 
-    def create_correction_invoice(self, start_date, end_date, factor):
+    def create_correction_invoice(self, start_date, end_date, factor,
+                                  as_of=None):
         """Create an invoice with one invoice line, specifically for
         this component. This can be needed in the case the start date
         or end date have been changed, affection already invoiced periods.
+        The invoice is dated as_of, or today.
         """
-        date_today = dt.date.today()
+        date_today = as_of or dt.date.today()
+        base_amount, vat_amount, total_amount, unit_amount = \
+            self.get_amounts_between_dates(start_date, end_date)
+
+        if settings.INVOICE_ENGINE_DEFER_CORRECTIONS:
+            new_corrections = []
+            self.create_pending_correction(
+                factor*base_amount,
+                factor*vat_amount,
+                factor*total_amount,
+                factor*unit_amount,
+                new_corrections,
+                date_today
+            )
+            PendingCorrection.objects.bulk_create(new_corrections)
+            contracts_changed([self.contract_id])
+            return
+
         invoice_id, invoice_line_id = get_next_invoice_id()
         invoice = self.contract.create_invoice(
             date_today,
@@ -1057,8 +2478,6 @@ class Component(TenancyDependentModel):
         new_invoice_lines = []
         new_gl_posts = []
         new_collections = []
-        base_amount, vat_amount, total_amount, unit_amount = \
-            self.get_amounts_between_dates(start_date, end_date)
 
         self.create_invoice_line(
             invoice_line_id,
@@ -1082,15 +2501,16 @@ class Component(TenancyDependentModel):
         invoice.create_gl_post(new_gl_posts)
 
         with transaction.atomic():
-            invoice.save()
-            InvoiceLine.objects.bulk_create(new_invoice_lines)
-            GeneralLedgerPost.objects.bulk_create(new_gl_posts)
-            Collection.objects.bulk_create(new_collections)
+            save_invoices(
+                [invoice], new_invoice_lines, new_gl_posts, new_collections
+            )
             self.tenancy.save(update_fields=['last_invoice_number'])
+            InvoiceEvent.add_invoices([invoice], InvoiceEvent.CORRECTION)
 
-    def change_end_date(self, old_end_date):
+    def change_end_date(self, old_end_date, as_of=None):
         """When the end date of this component is changed, check in what
-        period the new end date falls. Send a correction invoice if needed.
+        period the new end date falls. Send a correction invoice if needed,
+        dated as_of or today.
         """
         if self.is_draft():
             return
@@ -1102,30 +2522,31 @@ class Component(TenancyDependentModel):
                     self.date_next_prolongation = None
                     start = self.end_date
                     end = min(old_end_date, self.contract.date_next_prolongation)
-                    self.create_correction_invoice(start, end, -1)
+                    self.create_correction_invoice(start, end, -1, as_of)
                 elif old_end_date < self.end_date and old_end_date < self.contract.date_next_prolongation:
                     self.date_next_prolongation = None \
                         if self.end_date < self.contract.date_next_prolongation \
                         else self.contract.date_next_prolongation
                     start = old_end_date
                     end = min(self.end_date, self.contract.date_next_prolongation)
-                    self.create_correction_invoice(start, end, 1)
+                    self.create_correction_invoice(start, end, 1, as_of)
             else:
                 # New end date is None
                 if old_end_date < self.contract.date_next_prolongation:
                     # send positive invoice for period between old end date and next invoicing date
                     self.date_next_prolongation = self.contract.date_next_prolongation
-                    self.create_correction_invoice(old_end_date, self.contract.date_next_prolongation, 1)
+                    self.create_correction_invoice(old_end_date, self.contract.date_next_prolongation, 1, as_of)
         else:
             # End date is changed from None to something
             if self.end_date < self.contract.date_next_prolongation:
                 # Send negative invoice for period between new end date and next invoicing date
                 self.date_next_prolongation = None
-                self.create_correction_invoice(self.end_date, self.contract.date_next_prolongation, -1)
+                self.create_correction_invoice(self.end_date, self.contract.date_next_prolongation, -1, as_of)
 
-    def change_start_date(self, old_start_date):
+    def change_start_date(self, old_start_date, as_of=None):
         """When the start date of this component is changed, check in what
-        period the new end date falls. Send a correction invoice if needed.
+        period the new end date falls. Send a correction invoice if needed,
+        dated as_of or today.
         """
         if self.is_draft():
             return
@@ -1135,19 +2556,39 @@ class Component(TenancyDependentModel):
             # and min(old start date, next invoicing date)
             start = self.start_date
             end = min(old_start_date, self.contract.date_next_prolongation)
-            self.create_correction_invoice(start, end, 1)
+            self.create_correction_invoice(start, end, 1, as_of)
 
         elif old_start_date < self.start_date and old_start_date < self.contract.date_next_prolongation:
             # Send negative invoice for period between old start date
             # and min(new start date, next invoicing date)
             start = old_start_date
             end = min(self.start_date, self.contract.date_next_prolongation)
-            self.create_correction_invoice(start, end, -1)
+            self.create_correction_invoice(start, end, -1, as_of)
+
+    def create_pending_correction(self, base_amount, vat_amount, total_amount,
+                                  unit_amount, new_corrections, date=None):
+        """Keep a correction for the next invoice of the contract, instead of
+        creating an invoice line for it now. The correction is dated date, or
+        today.
+        """
+        new_corrections.append(
+            PendingCorrection(
+                tenancy_id=self.tenancy_id,
+                contract_id=self.contract_id,
+                component=self,
+                date=date or dt.date.today(),
+                base_amount=base_amount,
+                vat_amount=vat_amount,
+                total_amount=total_amount,
+                unit_amount=unit_amount
+            )
+        )
 
     def create_invoice_line(self, next_id, invoice, base_amount, vat_amount,
                             total_amount, unit_amount,
                             new_invoice_lines, new_gl_posts):
         invoice_line = InvoiceLine(
+            tenancy_id=invoice.tenancy_id,
             invoice_line_id=next_id,
             component=self,
             invoice=invoice,
@@ -1162,6 +2603,7 @@ class Component(TenancyDependentModel):
             gl_dimension_contract_1=invoice.contract.gl_dimension_1,
             gl_dimension_contract_2=invoice.contract.gl_dimension_2,
             gl_dimension_vat=self.vat_rate.gl_dimension if self.vat_rate else None,
+            gl_account_vat=self.vat_rate.gl_account if self.vat_rate else None,
 
             number_of_units=self.number_of_units,
             unit_price=unit_amount,
@@ -1263,7 +2705,7 @@ class Component(TenancyDependentModel):
         )
 
 
-class ContractPerson(TenancyDependentModel):
+class ContractPerson(VersionedContractModel):
     """A contract contains one or more contract persons."""
     DIRECT_DEBIT = 'D'
     EMAIL = 'E'
@@ -1340,8 +2782,18 @@ class Invoice(TenancyDependentModel):
         return self.invoiceline_set.all()
 
     def get_collections(self):
+        # The collections of archived invoices are loaded already
+        if is_prefetched(self, 'collection_set'):
+            return self.collection_set.all()
         return self.collection_set.select_related('contract_person')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['tenancy', 'date']),
+            # Used to read the invoices of a tenancy after a cursor
+            models.Index(fields=['tenancy', 'invoice_id'])
+        ]
+
     def create_gl_post(self, new_gl_posts):
         new_gl_posts.append(
             GeneralLedgerPost(
@@ -1356,12 +2808,12 @@ class Invoice(TenancyDependentModel):
                 gl_dimension_vat=None,
                 description="Debtors",
                 amount_debit=self.total_amount,
-                amount_credit=0.0
+                amount_credit=ZERO
             )
         )
 
 
-class InvoiceLine(models.Model):
+class InvoiceLine(TenancyDependentModel, GeneralLedgerDimensionsModel):
     invoice_line_id = models.PositiveIntegerField(primary_key=True)
     component = models.ForeignKey(Component, on_delete=models.CASCADE)
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE)
@@ -1370,11 +2822,6 @@ class InvoiceLine(models.Model):
     base_amount = models.DecimalField(max_digits=15, decimal_places=2, null=True)
     vat_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     total_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
-    gl_account = models.CharField(max_length=10)
-    gl_dimension_base_component = models.CharField(max_length=10)
-    gl_dimension_contract_1 = models.CharField(max_length=10)
-    gl_dimension_contract_2 = models.CharField(max_length=10)
-    gl_dimension_vat = models.CharField(max_length=10, null=True)
     unit_price = models.DecimalField(max_digits=15, decimal_places=2, null=True)
     unit_id = models.CharField(max_length=10, null=True)
     number_of_units = models.DecimalField(max_digits=15, decimal_places=2, null=True)
@@ -1395,7 +2842,7 @@ class InvoiceLine(models.Model):
                     gl_dimension_vat=None,
                     description="Proceeds",
                     amount_credit=total_without_vat,
-                    amount_debit=0.0
+                    amount_debit=ZERO
                 )
             )
 
@@ -1407,17 +2854,23 @@ class InvoiceLine(models.Model):
                     invoice=None,
                     invoice_line=self,
                     date=self.invoice.date,
-                    gl_account=self.component.vat_rate.gl_account,
+                    gl_account=self.gl_account_vat,
                     gl_dimension_base_component=self.gl_dimension_base_component,
                     gl_dimension_contract_1=self.gl_dimension_contract_1,
                     gl_dimension_contract_2=self.gl_dimension_contract_2,
                     gl_dimension_vat=self.gl_dimension_vat,
                     description="VAT",
                     amount_credit=self.vat_amount,
-                    amount_debit=0.0
+                    amount_debit=ZERO
                 )
             )
 
+    class Meta:
+        # Used to read the invoice lines of a tenancy after a cursor
+        indexes = [
+            models.Index(fields=['tenancy', 'invoice_line_id'])
+        ]
+
 
 class Collection(TenancyDependentModel):
     contract_person = models.ForeignKey(
@@ -1449,18 +2902,620 @@ class Collection(TenancyDependentModel):
             self.contract_person.phone
         ]
 
+    class Meta:
+        # Used to read the collections of a tenancy after a cursor
+        indexes = [
+            models.Index(fields=['tenancy', 'id'])
+        ]
+
+
+class PendingCorrection(TenancyDependentModel):
+    """A correction of the invoiced amounts of a component that has not been
+    invoiced yet. Only used if INVOICE_ENGINE_DEFER_CORRECTIONS is True, in
+    which case the correction is added to the next invoice of the contract.
+    """
+    contract = models.ForeignKey(Contract, on_delete=models.CASCADE)
+    component = models.ForeignKey(Component, on_delete=models.CASCADE)
+    date = models.DateField()
+    base_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    vat_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    total_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    unit_amount = models.DecimalField(max_digits=15, decimal_places=2)
+
+    def invoice(self, next_id, invoice, new_invoice_lines, new_gl_posts):
+        """Add the correction to an invoice of the contract."""
+        self.component.create_invoice_line(
+            next_id,
+            invoice,
+            self.base_amount,
+            self.vat_amount,
+            self.total_amount,
+            self.unit_amount,
+            new_invoice_lines,
+            new_gl_posts
+        )
+
+
+class PrecomputedInvoice(TenancyDependentModel):
+    """The invoice of a contract in an upcoming invoicing run, computed in
+    advance by Tenancy.precompute_invoices. The document contains the
+    invoice with its invoice lines, general ledger posts and collections,
+    the changed fields of the contract and its components, and the pending
+    corrections it contains. The invoicing run of the date gives it an id
+    and invoice number and saves it as is.
+
+    Only used if INVOICE_ENGINE_PRECOMPUTE_INVOICES is True. It is only
+    valid as long as the contract and the reference data of the tenancy have
+    the versions it was computed from, so every change of the contract (see
+    contracts_changed) or of a contract type, base component or VAT rate
+    invalidates it.
+    """
+    # The fields of the contracts and components that are changed by
+    # invoicing them
+    CONTRACT_FIELDS = [
+        'balance',
+        'date_next_prolongation',
+        'date_prev_prolongation',
+        'base_amount',
+        'vat_amount',
+        'total_amount'
+    ]
+    COMPONENT_FIELDS = [
+        'date_next_prolongation',
+        'date_prev_prolongation',
+        'vat_rate',
+        'vat_amount',
+        'total_amount'
+    ]
+
+    contract = models.OneToOneField(Contract, on_delete=models.CASCADE)
+    # The versions of the contract and of the reference data of the tenancy
+    # the invoice was computed from
+    version = models.BigIntegerField()
+    reference_data_version = models.BigIntegerField()
+    date = models.DateField()
+    document = models.JSONField(encoder=DjangoJSONEncoder)
+
+    @staticmethod
+    def get_valid(tenancy, date):
+        """Return the precomputed invoices of a tenancy for the invoicing run
+        of a date of which the contract and the reference data have not
+        changed since.
+        """
+        return PrecomputedInvoice.objects.filter(
+            tenancy=tenancy, date=date, version=F('contract__version'),
+            reference_data_version=F('tenancy__reference_data_version')
+        )
+
+    def invoice(self, tenancy, invoice_id, next_invoice_line_id,
+                new_invoices, new_invoice_lines, new_gl_posts,
+                new_collections):
+        """Create the invoice with its invoice lines, general ledger posts
+        and collections from the document. Returns the contract and the
+        components with the fields changed by invoicing them, to be saved
+        with bulk_update.
+        """
+        tenancy.last_invoice_number += 1
+        invoice = from_field_values(
+            Invoice,
+            self.document['invoice'],
+            invoice_id=invoice_id,
+            tenancy=tenancy,
+            contract_id=self.contract_id,
+            invoice_number=tenancy.last_invoice_number
+        )
+        invoice.expiration_date = invoice.date + dt.timedelta(
+            days=tenancy.days_until_invoice_expiration
+        )
+        new_invoices.append(invoice)
+
+        invoice_lines = []
+        for values in self.document['invoice_lines']:
+            invoice_lines.append(from_field_values(
+                InvoiceLine,
+                values,
+                tenancy=tenancy,
+                invoice_line_id=next_invoice_line_id,
+                invoice=invoice
+            ))
+            next_invoice_line_id += 1
+        new_invoice_lines.extend(invoice_lines)
+
+        for values in self.document['gl_posts']:
+            values = dict(values)
+            line_index = values.pop('invoice_line')
+            new_gl_posts.append(from_field_values(
+                GeneralLedgerPost,
+                values,
+                tenancy=tenancy,
+                invoice=invoice if line_index is None else None,
+                invoice_line=invoice_lines[line_index]
+                if line_index is not None else None
+            ))
+
+        for values in self.document['collections']:
+            new_collections.append(from_field_values(
+                Collection, values, tenancy=tenancy, invoice=invoice
+            ))
+
+        contract = from_field_values(
+            Contract, self.document['contract'], contract_id=self.contract_id
+        )
+        # Add the invoice to the balance in the database instead of
+        # overwriting it
+        contract.balance = F('balance') + invoice.total_amount
+        components = [
+            from_field_values(Component, values)
+            for values in self.document['components']
+        ]
+        return contract, components
+
+
+class InvoiceEvent(TenancyDependentModel):
+    """An entry in the outbox of the invoices that were created, so that
+    other systems can read the new invoices in the order in which they were
+    created, instead of searching the invoices by date. Every process that
+    saves invoices adds one event per tenancy at the end of the same
+    transaction as the invoices, with the range of the ids of its invoices.
+
+    Consumers read the events of a tenancy after the id of the last event
+    they read, so the ids of a tenancy must be in the order in which its
+    events are committed. The events are therefore added under a lock of the
+    tenancy that is held until the commit. Events of different tenancies are
+    added at the same time, so their ids are only in the order of the commits
+    within a tenancy.
+    """
+    # The key of the advisory locks that serialize the adding of events,
+    # which is combined with the company id of the tenancy
+    LOCK_ID = 0x1E7E27
+
+    RUN = 'R'
+    CORRECTION = 'C'
+    INDEXATION = 'I'
+    ENDING = 'E'
+    EVENT_TYPE_CHOICES = [
+        (RUN, 'Invoicing run'),
+        (CORRECTION, 'Correction'),
+        (INDEXATION, 'Price indexation'),
+        (ENDING, 'Ending of contracts')
+    ]
+
+    event_type = models.CharField(max_length=1, choices=EVENT_TYPE_CHOICES)
+    created = models.DateTimeField(auto_now_add=True)
+    first_invoice_id = models.PositiveIntegerField()
+    last_invoice_id = models.PositiveIntegerField()
+    number_of_invoices = models.PositiveIntegerField()
+    total_amount = models.DecimalField(max_digits=15, decimal_places=2)
+
+    @staticmethod
+    def add_invoices(invoices, event_type):
+        """Add an event for the invoices of every tenancy. Another
+        transaction that adds events for one of these tenancies waits until
+        this one is committed or rolled back, so this should be the last
+        statement of a transaction. The row of the tenancy should be locked
+        before, as the processes that save invoices do.
+        """
+        events = {}
+        for invoice in invoices:
+            event = events.get(invoice.tenancy_id)
+            if event is None:
+                events[invoice.tenancy_id] = InvoiceEvent(
+                    tenancy_id=invoice.tenancy_id,
+                    event_type=event_type,
+                    first_invoice_id=invoice.invoice_id,
+                    last_invoice_id=invoice.invoice_id,
+                    number_of_invoices=1,
+                    total_amount=invoice.total_amount
+                )
+                continue
+            event.first_invoice_id = min(
+                event.first_invoice_id, invoice.invoice_id
+            )
+            event.last_invoice_id = max(
+                event.last_invoice_id, invoice.invoice_id
+            )
+            event.number_of_invoices += 1
+            event.total_amount += invoice.total_amount
+        if not events:
+            return
+
+        with transaction.atomic():
+            # The ids are taken from the sequence after the lock, so an
+            # event never gets a lower id than an event of the tenancy that
+            # was committed before it
+            with connection.cursor() as cursor:
+                for tenancy_id in sorted(events):
+                    cursor.execute(
+                        'SELECT pg_advisory_xact_lock(%s, %s)',
+                        [InvoiceEvent.LOCK_ID, tenancy_id]
+                    )
+            InvoiceEvent.objects.bulk_create(events.values())
+
+    def get_invoices(self):
+        return Invoice.objects.filter(
+            tenancy_id=self.tenancy_id,
+            invoice_id__range=(self.first_invoice_id, self.last_invoice_id)
+        )
+
+    class Meta:
+        # Used to read the events of a tenancy after a cursor
+        indexes = [
+            models.Index(fields=['tenancy', 'id'])
+        ]
+
+
+class GeneralLedgerDimensions(TenancyDependentModel):
+    """A combination of a general ledger account and dimensions. There are
+    only a few combinations per tenancy, so invoice lines and general ledger
+    posts refer to a combination instead of storing the values on every row.
+    Every combination is unique per tenancy, including the empty dimensions
+    (see migration 0073).
+    """
+    gl_dimensions_id = models.AutoField(primary_key=True)
+    gl_account = models.CharField(max_length=10, null=True)
+    gl_account_vat = models.CharField(max_length=10, null=True)
+    gl_dimension_base_component = models.CharField(max_length=10, null=True)
+    gl_dimension_contract_1 = models.CharField(max_length=10, null=True)
+    gl_dimension_contract_2 = models.CharField(max_length=10, null=True)
+    gl_dimension_vat = models.CharField(max_length=10, null=True)
+
+    def get_key(self):
+        return (self.tenancy_id, ) + tuple(
+            getattr(self, name) for name in GL_DIMENSION_FIELDS
+        )
+
+
+class GeneralLedgerPost(TenancyDependentModel, GeneralLedgerDimensionsModel):
+    """The table of this model is partitioned by month on the date in the
+    database (see migration 0059), so queries that filter on the date only
+    read the partitions of the months involved. The partitions are created by
+    the create_general_ledger_partitions management command.
+    """
+    # The columns of the general ledger export, in the order in which they
+    # were stored before the dimensions were moved to their own table. Posts
+    # that are derived from the invoices have no id, so every post is
+    # identified by its invoice or invoice line and its description.
+    EXPORT_FIELDS = [
+        'tenancy', 'invoice', 'invoice_line', 'date', 'gl_account',
+        'gl_dimension_base_component', 'gl_dimension_contract_1',
+        'gl_dimension_contract_2', 'gl_dimension_vat', 'description',
+        'amount_debit', 'amount_credit'
+    ]
 
-class GeneralLedgerPost(TenancyDependentModel):
     invoice = models.ForeignKey(Invoice, null=True, on_delete=models.CASCADE)
     invoice_line = models.ForeignKey(
         InvoiceLine, null=True, on_delete=models.CASCADE
     )
     date = models.DateField()
+    description = models.CharField(max_length=30)
+    amount_debit = models.DecimalField(max_digits=15, decimal_places=2)
+    amount_credit = models.DecimalField(max_digits=15, decimal_places=2)
+
+    class Meta:
+        # Used to read the general ledger posts of a tenancy after a cursor
+        indexes = [
+            models.Index(fields=['tenancy', 'id'])
+        ]
+
+
+class GeneralLedgerBalance(TenancyDependentModel):
+    """The general ledger balance is a rollup of the general ledger posts
+    per day, account and dimensions. It is updated every time general ledger
+    posts are created, so the trial balance can be read from this table
+    without scanning all posts. There is one balance per key, including the
+    empty dimensions (see migration 0072).
+    """
+    date = models.DateField()
     gl_account = models.CharField(max_length=10)
     gl_dimension_base_component = models.CharField(null=True, max_length=10)
     gl_dimension_contract_1 = models.CharField(max_length=10)
     gl_dimension_contract_2 = models.CharField(max_length=10)
     gl_dimension_vat = models.CharField(null=True, max_length=10)
-    description = models.CharField(max_length=30)
-    amount_debit = models.DecimalField(max_digits=15, decimal_places=2)
-    amount_credit = models.DecimalField(max_digits=15, decimal_places=2)
+    amount_debit = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    amount_credit = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    number_of_posts = models.PositiveIntegerField(default=0)
+
+    @staticmethod
+    def get_key(obj):
+        """Return the key of the balance a general ledger post belongs to.
+        Also works for the balance itself.
+        """
+        return (
+            obj.tenancy_id,
+            obj.date,
+            obj.gl_account,
+            obj.gl_dimension_base_component,
+            obj.gl_dimension_contract_1,
+            obj.gl_dimension_contract_2,
+            obj.gl_dimension_vat
+        )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tenancy', 'date', 'gl_account'])
+        ]
+
+
+def to_document(obj):
+    """Static function to return the values of the fields of an object as a
+    dictionary that can be stored in a JSON document.
+    """
+    return {
+        field.attname: getattr(obj, field.attname)
+        for field in obj._meta.concrete_fields
+    }
+
+
+def from_document(model, values):
+    """Static function to recreate an object of model from the values that
+    were stored with to_document. The object is not saved.
+    """
+    obj = model(**{
+        field.attname: field.to_python(values.get(field.attname))
+        for field in model._meta.concrete_fields
+    })
+    obj._state.adding = False
+    return obj
+
+
+def load_gl_dimensions(objects):
+    """Static function to load the general ledger dimensions of objects
+    that were not read from the database, in one query.
+    """
+    dimensions = GeneralLedgerDimensions.objects.in_bulk(
+        {obj.gl_dimensions_id for obj in objects if obj.gl_dimensions_id}
+    )
+    for obj in objects:
+        if obj.gl_dimensions_id:
+            obj.gl_dimensions = dimensions[obj.gl_dimensions_id]
+
+
+def set_prefetched_objects(obj, cache_name, objects):
+    """Static function to fill the cache of a reverse relation of obj, as if
+    the objects were loaded with prefetch_related.
+    """
+    qs = getattr(obj, cache_name).all()
+    qs._result_cache = objects
+    qs._prefetch_done = True
+    obj.__dict__.setdefault('_prefetched_objects_cache', {})[cache_name] = qs
+
+
+class ContractArchive(TenancyDependentModel):
+    """The invoices of a historic contract, with their invoice lines,
+    collections and general ledger posts, stored as a single document. This
+    keeps the tables of the invoicing process small, while the history of a
+    contract can still be shown. Postgres compresses large documents.
+    """
+    contract = models.OneToOneField(
+        Contract, primary_key=True, on_delete=models.CASCADE
+    )
+    archive_date = models.DateField()
+    last_invoice_id = models.PositiveIntegerField(null=True)
+    last_invoice_line_id = models.PositiveIntegerField(null=True)
+    # The ids of the archived invoices, to find an invoice without searching
+    # the documents
+    invoice_ids = ArrayField(models.PositiveIntegerField(), default=list)
+    document = models.JSONField(encoder=DjangoJSONEncoder)
+
+    class Meta:
+        indexes = [
+            # Used to find the highest id that was used by archived invoices
+            models.Index(fields=['last_invoice_id']),
+            models.Index(fields=['last_invoice_line_id']),
+            # Used to find the archive of an invoice
+            GinIndex(fields=['invoice_ids']),
+        ]
+
+    def archive(self, invoices):
+        """Method to store the invoices in the document. The invoices should
+        have their invoice lines, collections and general ledger posts
+        prefetched.
+        """
+        documents = []
+        for invoice in invoices:
+            invoice_lines = list(invoice.invoiceline_set.all())
+            gl_posts = list(invoice.generalledgerpost_set.all())
+            for invoice_line in invoice_lines:
+                gl_posts.extend(invoice_line.generalledgerpost_set.all())
+            gl_posts.sort(key=lambda post: post.id)
+
+            document = to_document(invoice)
+            document['invoice_lines'] = [to_document(x) for x in invoice_lines]
+            document['collections'] = [
+                to_document(x) for x in invoice.collection_set.all()
+            ]
+            document['gl_posts'] = [to_document(x) for x in gl_posts]
+            documents.append(document)
+
+            self.invoice_ids.append(invoice.invoice_id)
+            self.last_invoice_id = max(
+                self.last_invoice_id or 0, invoice.invoice_id
+            )
+            for invoice_line in invoice_lines:
+                self.last_invoice_line_id = max(
+                    self.last_invoice_line_id or 0,
+                    invoice_line.invoice_line_id
+                )
+
+        self.document = {'invoices': documents}
+
+    def get_invoices(self):
+        """Method to reassemble the archived invoices, with their invoice
+        lines and collections.
+        """
+        contract = self.contract
+        components = {x.component_id: x for x in contract.get_components()}
+        persons = {x.contract_person_id: x for x in contract.get_contract_persons()}
+
+        invoices = []
+        all_invoice_lines = []
+        for document in self.document['invoices']:
+            invoice = from_document(Invoice, document)
+            invoice.tenancy = self.tenancy
+            invoice.contract = contract
+
+            invoice_lines = []
+            for values in document['invoice_lines']:
+                invoice_line = from_document(InvoiceLine, values)
+                # Archives of before the tenancy was stored on the lines
+                invoice_line.tenancy_id = self.tenancy_id
+                invoice_line.invoice = invoice
+                invoice_line.component = components.get(invoice_line.component_id)
+                invoice_lines.append(invoice_line)
+
+            collections = []
+            for values in document['collections']:
+                collection = from_document(Collection, values)
+                collection.invoice = invoice
+                collection.contract_person = persons.get(
+                    collection.contract_person_id
+                )
+                collections.append(collection)
+
+            set_prefetched_objects(invoice, 'invoiceline_set', invoice_lines)
+            set_prefetched_objects(invoice, 'collection_set', collections)
+            invoices.append(invoice)
+            all_invoice_lines.extend(invoice_lines)
+
+        load_gl_dimensions(all_invoice_lines)
+        return invoices
+
+    def get_gl_posts(self):
+        """Method to reassemble the archived general ledger posts. If the
+        posts of an invoice were not stored, they are derived from the
+        invoice.
+        """
+        gl_posts = []
+        derived_invoices = []
+        for invoice, document in zip(self.get_invoices(),
+                                     self.document['invoices']):
+            if document['gl_posts']:
+                gl_posts.extend(
+                    from_document(GeneralLedgerPost, values)
+                    for values in document['gl_posts']
+                )
+            else:
+                derived_invoices.append(invoice)
+        load_gl_dimensions(gl_posts)
+        gl_posts.extend(derive_general_ledger_posts(derived_invoices))
+        return gl_posts
+
+    @staticmethod
+    def get_archived_invoice(company_id, invoice_id):
+        """Static method to return an archived invoice, or None if there is
+        no archived invoice with this id.
+        """
+        archive = ContractArchive.objects.filter(
+            tenancy_id=company_id,
+            invoice_ids__contains=[invoice_id]
+        ).first()
+        if archive:
+            for invoice in archive.get_invoices():
+                if invoice.invoice_id == invoice_id:
+                    return invoice
+        return None
+
+
+class TenancySummary(models.Model):
+    """The figures shown on the dashboard of a tenancy. They are updated by
+    the invoicing process and the contract lifecycle methods, so that the
+    dashboard does not have to read all contracts and invoices.
+
+    The overdue amount changes with the date, so it is computed again by the
+    refresh_tenancy_summaries management command, which should be run daily.
+    """
+    tenancy = models.OneToOneField(
+        Tenancy, primary_key=True, on_delete=models.CASCADE
+    )
+    # Contracts that are invoiced: active and terminated contracts
+    number_of_active_contracts = models.PositiveIntegerField(default=0)
+    # The balance of the invoices that are not archived
+    open_balance = models.DecimalField(
+        max_digits=15, decimal_places=2, default=0
+    )
+    last_run_date = models.DateField(null=True)
+    last_run_number_of_invoices = models.PositiveIntegerField(default=0)
+    last_run_total_amount = models.DecimalField(
+        max_digits=15, decimal_places=2, default=0
+    )
+    overdue_amount = models.DecimalField(
+        max_digits=15, decimal_places=2, default=0
+    )
+    overdue_date = models.DateField(null=True)
+
+    def get_details(self):
+        return {
+            'active contracts': self.number_of_active_contracts,
+            'open balance': self.open_balance,
+            'last invoicing run': self.last_run_date,
+            'invoices in last run': self.last_run_number_of_invoices,
+            'amount of last run': self.last_run_total_amount,
+            'overdue amount on {}'.format(self.overdue_date):
+                self.overdue_amount,
+        }
+
+    @staticmethod
+    def add(tenancy_id, **amounts):
+        """Static function to add amounts to the fields of the summary of a
+        tenancy. If the tenancy has no summary yet, it is computed instead.
+        """
+        updated = TenancySummary.objects.filter(
+            tenancy_id=tenancy_id
+        ).update(**{
+            name: F(name) + amount for name, amount in amounts.items()
+        })
+        if not updated:
+            TenancySummary.refresh(tenancy_id)
+
+    @staticmethod
+    def add_invoices(invoices, factor=1):
+        """Static function to add new invoices to the open balances, or to
+        remove them with factor -1.
+        """
+        open_balances = {}
+        for invoice in invoices:
+            open_balances[invoice.tenancy_id] = \
+                open_balances.get(invoice.tenancy_id, ZERO) \
+                + factor * invoice.balance
+        for tenancy_id, open_balance in open_balances.items():
+            TenancySummary.add(tenancy_id, open_balance=open_balance)
+
+    @staticmethod
+    def refresh(tenancy_id, date=None):
+        """Static function to compute the summary of a tenancy from its
+        contracts and invoices. The last invoicing run is taken to be the
+        last date with invoices.
+        """
+        date = date or dt.date.today()
+        number_of_active_contracts = Contract.objects.filter(
+            tenancy_id=tenancy_id,
+            status__in=[Contract.ACTIVE, Contract.TERMINATED]
+        ).count()
+        invoices = Invoice.objects.filter(tenancy_id=tenancy_id)
+        totals = invoices.aggregate(
+            models.Max('date'), models.Sum('balance')
+        )
+        last_run_date = totals.get('date__max')
+        last_run = invoices.filter(date=last_run_date).aggregate(
+            number_of_invoices=models.Count('invoice_id'),
+            total_amount=models.Sum('total_amount')
+        )
+        overdue_amount = invoices.filter(
+            expiration_date__lt=date,
+            balance__gt=0
+        ).aggregate(models.Sum('balance')).get('balance__sum')
+
+        summary, created = TenancySummary.objects.update_or_create(
+            tenancy_id=tenancy_id,
+            defaults={
+                'number_of_active_contracts': number_of_active_contracts,
+                'open_balance': totals.get('balance__sum') or ZERO,
+                'last_run_date': last_run_date,
+                'last_run_number_of_invoices':
+                    last_run.get('number_of_invoices'),
+                'last_run_total_amount': last_run.get('total_amount') or ZERO,
+                'overdue_amount': overdue_amount or ZERO,
+                'overdue_date': date,
+            }
+        )
+        return summary
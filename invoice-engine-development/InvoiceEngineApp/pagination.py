@@ -0,0 +1,249 @@
+import base64
+import binascii
+import collections.abc
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+def get_estimated_count(queryset):
+    """Static function to return the number of rows the query planner
+    expects the queryset to return, without running it. Returns None if the
+    database cannot estimate it.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class ApproximateCountPaginator(Paginator):
+    """Paginator that does not count all objects of large lists. The objects
+    are counted up to INVOICE_ENGINE_EXACT_COUNT_LIMIT, which is the exact
+    count of smaller lists, such as most filtered lists. Only if the list
+    contains at least that many objects, the estimate of the query planner
+    is used as the count.
+    """
+    @cached_property
+    def bounded_count(self):
+        limit = settings.INVOICE_ENGINE_EXACT_COUNT_LIMIT
+        if not hasattr(self.object_list, 'query'):
+            return len(self.object_list[:limit])
+        return self.object_list[:limit].count()
+
+    @cached_property
+    def estimated_count(self):
+        if not hasattr(self.object_list, 'query'):
+            return None
+        return get_estimated_count(self.object_list)
+
+    @cached_property
+    def is_approximate(self):
+        return (self.bounded_count >= settings.INVOICE_ENGINE_EXACT_COUNT_LIMIT
+                and self.estimated_count is not None)
+
+    @cached_property
+    def count(self):
+        if self.is_approximate:
+            # The list contains at least the counted objects
+            return max(self.estimated_count, self.bounded_count)
+        if self.bounded_count < settings.INVOICE_ENGINE_EXACT_COUNT_LIMIT:
+            return self.bounded_count
+        return super().count
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # The estimate may be too low, so the pages after the estimated
+            # last page are allowed as well
+            if self.is_approximate and int(number) > 1:
+                return int(number)
+            raise
+
+    def page(self, number):
+        if not self.is_approximate:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(
+            self.object_list[bottom:bottom + self.per_page], number, self
+        )
+
+
+class KeysetPaginator:
+    """Paginator that finds a page by the ordering values of the last object
+    of the previous page (or the first object of the next page), instead of
+    counting and skipping all objects before it. Every page is therefore as
+    fast as the first one, but the pages are not numbered.
+
+    The queryset is ordered by its own ordering, followed by the primary key
+    so that the order is unique. The ordering may only contain fields of the
+    model itself and annotations.
+    """
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.model = object_list.model
+
+        self.ordering = [
+            name if isinstance(name, str) else None
+            for name in object_list.query.order_by
+        ]
+        if None in self.ordering:
+            raise ValueError("Keyset pagination needs an ordering by name.")
+        if not {'pk', '-pk', self.model._meta.pk.name,
+                '-' + self.model._meta.pk.name} & set(self.ordering):
+            self.ordering.append('pk')
+
+    def page(self, after=None, before=None):
+        """Return the page after the object of the cursor after, before the
+        object of the cursor before, or the first page if neither is given.
+        """
+        if before:
+            values = self.decode_cursor(before)
+            qs = self.object_list.order_by(*self.ordering).reverse().filter(
+                self.get_seek_filter(values, reverse=True)
+            )
+            objects = list(qs[:self.per_page + 1])
+            has_previous = len(objects) > self.per_page
+            objects = objects[:self.per_page][::-1]
+            return KeysetPage(objects, self, has_previous, True)
+
+        qs = self.object_list.order_by(*self.ordering)
+        if after:
+            qs = qs.filter(self.get_seek_filter(self.decode_cursor(after)))
+        objects = list(qs[:self.per_page + 1])
+        has_next = len(objects) > self.per_page
+        return KeysetPage(objects[:self.per_page], self, bool(after), has_next)
+
+    def get_seek_filter(self, values, reverse=False):
+        """Return the filter for the objects that come after the values in
+        the ordering. Null values are sorted last in ascending order and
+        first in descending order, as Postgres does.
+        """
+        seek_filter = None
+        for name, value in reversed(list(zip(self.ordering, values))):
+            descending = name.startswith('-') != reverse
+            name = name.lstrip('-')
+            if value is None:
+                equal = Q(**{name + '__isnull': True})
+                after = Q(**{name + '__isnull': False}) if descending else None
+            else:
+                equal = Q(**{name: value})
+                if descending:
+                    after = Q(**{name + '__lt': value})
+                else:
+                    after = Q(**{name + '__gt': value})
+                    if self.is_nullable(name):
+                        after |= Q(**{name + '__isnull': True})
+
+            if seek_filter is None:
+                seek_filter = after
+            elif after is None:
+                seek_filter = equal & seek_filter
+            else:
+                seek_filter = after | (equal & seek_filter)
+
+        # No object can come after the last possible values
+        return seek_filter if seek_filter is not None else Q(pk__in=[])
+
+    def get_cursor(self, obj):
+        # The objects of a values() queryset are dictionaries
+        if isinstance(obj, dict):
+            values = [obj[name.lstrip('-')] for name in self.ordering]
+        else:
+            values = [getattr(obj, name.lstrip('-')) for name in self.ordering]
+        return base64.urlsafe_b64encode(
+            json.dumps(values, cls=DjangoJSONEncoder).encode()
+        ).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (binascii.Error, ValueError):
+            raise InvalidCursor(cursor)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor(cursor)
+
+        decoded = []
+        for name, value in zip(self.ordering, values):
+            field = self.get_field(name.lstrip('-'))
+            if field is None:
+                # Annotations are stored as plain JSON values
+                decoded.append(value)
+                continue
+            try:
+                decoded.append(field.to_python(value))
+            except ValidationError:
+                raise InvalidCursor(cursor)
+        return decoded
+
+    def get_field(self, name):
+        """Return the model field of a name in the ordering, or None for an
+        annotation.
+        """
+        if name == 'pk':
+            return self.model._meta.pk
+        try:
+            return self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def is_nullable(self, name):
+        field = self.get_field(name)
+        return field is None or field.null
+
+
+class KeysetPage(collections.abc.Sequence):
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return '<Keyset page of {} objects>'.format(len(self))
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_cursor(self):
+        if self.has_next():
+            return self.paginator.get_cursor(self.object_list[-1])
+        return None
+
+    def previous_cursor(self):
+        if self.has_previous():
+            return self.paginator.get_cursor(self.object_list[0])
+        return None
@@ -1,9 +1,25 @@
+import csv
 import datetime as dt
 import decimal as dc
-
-from django.test import TestCase
+import json
+import threading
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from InvoiceEngineApp.models import Contract, Invoice, InvoiceLine, Collection, \
-    GeneralLedgerPost
+    GeneralLedgerPost, GeneralLedgerBalance, GeneralLedgerDimensions, \
+    ContractArchive, TenancySummary, VATRate, Component, PendingCorrection, \
+    InvoiceEvent, PrecomputedInvoice, Tenancy, get_field_values, \
+    get_next_invoice_id
+from InvoiceEngineApp.importing import (
+    ContractImporter,
+    read_csv,
+    read_json_lines
+)
+from InvoiceEngineApp.views.tenancy_views import get_general_ledger_posts
 from model_bakery import baker
 
 
@@ -56,6 +72,134 @@ class ContractMethodsTest(TestCase):
         self.assertEqual(date, dt.date(2020, 2, 13))
 
 
+    def test_activate_contracts(self):
+        """Method to test whether only the draft contracts that can be
+        activated are activated at once, and the others are reported.
+        """
+        tenancy = self.contract.tenancy
+        contracts = baker.make(
+            'Contract',
+            tenancy=tenancy,
+            status=Contract.DRAFT,
+            start_date=dt.date(2021, 1, 1),
+            _quantity=3
+        )
+        for contract, percentage in zip(contracts, [100, 50, 100]):
+            baker.make(
+                'ContractPerson',
+                contract=contract,
+                percentage_of_total=percentage,
+                start_date=dt.date(2020, 12, 1)
+            )
+        for contract in contracts[:2]:
+            baker.make(
+                'Component',
+                contract=contract,
+                start_date=dt.date(2020, 12, 1)
+            )
+        self.contract.tenancy = tenancy
+        self.contract.status = Contract.ACTIVE
+        self.contract.save()
+
+        activated, rejected = tenancy.activate_contracts(
+            [contract.contract_id for contract in contracts]
+            + [self.contract.contract_id]
+        )
+        self.assertEqual(activated, [contracts[0].contract_id])
+        self.assertEqual(
+            sorted(rejected),
+            sorted([contracts[1].contract_id, contracts[2].contract_id,
+                    self.contract.contract_id])
+        )
+
+        contract = Contract.objects.get(contract_id=contracts[0].contract_id)
+        self.assertEqual(contract.status, Contract.ACTIVE)
+        self.assertEqual(contract.date_next_prolongation, dt.date(2021, 1, 1))
+        component = contract.component_set.get()
+        self.assertEqual(component.start_date, dt.date(2021, 1, 1))
+        self.assertEqual(component.date_next_prolongation, dt.date(2021, 1, 1))
+        self.assertEqual(
+            contract.contractperson_set.get().start_date, dt.date(2021, 1, 1)
+        )
+        self.assertEqual(
+            TenancySummary.objects.get(tenancy=tenancy)
+            .number_of_active_contracts, 2
+        )
+
+
+class VATRateMethodsTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy')
+        self.vat_rate = baker.make(
+            'VATRate',
+            tenancy=self.tenancy,
+            type=2,
+            start_date=dt.date(2020, 1, 1),
+            end_date=None,
+            percentage=dc.Decimal(9)
+        )
+        self.contract = baker.make(
+            'Contract',
+            tenancy=self.tenancy,
+            status=Contract.DRAFT,
+            base_amount=dc.Decimal('135.09'),
+            vat_amount=dc.Decimal('12.16'),
+            total_amount=dc.Decimal('147.25')
+        )
+        for base_amount, unit_amount, number_of_units, vat_amount in [
+            (dc.Decimal('100.05'), None, None, dc.Decimal('9.00')),
+            (None, dc.Decimal('10.01'), dc.Decimal('3.50'), dc.Decimal('3.16'))
+        ]:
+            amount = base_amount or dc.Decimal('35.04')
+            baker.make(
+                'Component',
+                tenancy=self.tenancy,
+                contract=self.contract,
+                vat_rate=self.vat_rate,
+                base_amount=base_amount,
+                unit_amount=unit_amount,
+                number_of_units=number_of_units,
+                vat_amount=vat_amount,
+                total_amount=amount + vat_amount
+            )
+
+    def test_replace_vat_rate(self):
+        """Method to test whether a new VAT rate that replaces an unused VAT
+        rate gives the components and contract the same amounts as updating
+        the components one by one.
+        """
+        vat_rate = VATRate(
+            type=2,
+            description='High',
+            start_date=dt.date(2021, 1, 1),
+            percentage=dc.Decimal(21),
+            gl_account='1600',
+            gl_dimension='H'
+        )
+        vat_rate.create({'company_id': self.tenancy.company_id})
+        self.assertFalse(
+            VATRate.objects.filter(vat_rate_id=self.vat_rate.vat_rate_id)
+            .exists()
+        )
+
+        components = Component.objects.order_by('component_id')
+        self.assertEqual(
+            [(c.vat_rate_id, c.vat_amount, c.total_amount) for c in components],
+            [(vat_rate.vat_rate_id, dc.Decimal('21.01'), dc.Decimal('121.06')),
+             (vat_rate.vat_rate_id, dc.Decimal('7.36'), dc.Decimal('42.40'))]
+        )
+        self.contract.refresh_from_db()
+        self.assertEqual(self.contract.base_amount, dc.Decimal('135.09'))
+        self.assertEqual(self.contract.vat_amount, dc.Decimal('28.37'))
+        self.assertEqual(self.contract.total_amount, dc.Decimal('163.46'))
+
+        # Without a successor, the VAT is removed
+        self.assertEqual(vat_rate.delete()[0], 1)
+        self.contract.refresh_from_db()
+        self.assertEqual(self.contract.vat_amount, 0)
+        self.assertEqual(self.contract.total_amount, dc.Decimal('135.09'))
+
+
 class ComponentMethodsTest(TestCase):
     def setUp(self):
         self.component = baker.make(
@@ -512,3 +656,859 @@ class ComponentMethodsTest(TestCase):
                 self.assertEqual(post.amount_debit, 300)
 
         self.assertListEqual(container_credit, [])
+
+    def test_index_components(self):
+        """Method to test whether indexing the prices ends the components,
+        creates their successors and credits the old price and charges the
+        new price for the period that has been invoiced already.
+        """
+        tenancy = self.component.tenancy
+        contract = self.component.contract
+        contract.tenancy = tenancy
+        contract.status = Contract.ACTIVE
+        contract.base_amount = dc.Decimal(50)
+        contract.vat_amount = dc.Decimal(10)
+        contract.total_amount = dc.Decimal(60)
+        contract.save()
+        for obj in [contract.contract_type, self.component.base_component,
+                    self.component.vat_rate]:
+            obj.tenancy = tenancy
+            obj.save()
+        baker.make(
+            'ContractPerson',
+            contract=contract,
+            percentage_of_total=100,
+            start_date=dt.date(2020, 1, 1),
+            end_date=None
+        )
+
+        report = tenancy.index_components(
+            self.component.base_component_id,
+            dt.date(2021, 4, 1),
+            percentage=dc.Decimal(10)
+        )
+        self.assertEqual(
+            report, {'components': 1, 'contracts': 1, 'invoices': 1}
+        )
+
+        self.component.refresh_from_db()
+        self.assertEqual(self.component.end_date, dt.date(2021, 3, 31))
+        successor = Component.objects.exclude(
+            component_id=self.component.component_id
+        ).get()
+        self.assertEqual(successor.start_date, dt.date(2021, 4, 1))
+        self.assertEqual(successor.end_date, dt.date(2021, 10, 1))
+        self.assertEqual(successor.date_next_prolongation, dt.date(2021, 5, 1))
+        self.assertEqual(successor.base_amount, 55)
+        self.assertEqual(successor.vat_amount, 11)
+        self.assertEqual(successor.total_amount, 66)
+
+        # One month was invoiced already
+        invoice = Invoice.objects.get()
+        self.assertEqual(invoice.base_amount, 5)
+        self.assertEqual(invoice.vat_amount, 1)
+        self.assertEqual(invoice.total_amount, 6)
+        self.assertEqual(
+            sorted(line.total_amount for line in InvoiceLine.objects.all()),
+            [-60, 66]
+        )
+        self.assertEqual(Collection.objects.get().amount, 6)
+
+        contract.refresh_from_db()
+        self.assertEqual(contract.balance, 6)
+        self.assertEqual(contract.total_amount, 66)
+
+        # The components that run on the date have been indexed
+        report = tenancy.index_components(
+            self.component.base_component_id,
+            dt.date(2021, 4, 1),
+            amount=dc.Decimal(5)
+        )
+        self.assertEqual(report['components'], 0)
+
+    def test_end_contracts(self):
+        """Method to test whether ending contracts at once ends their
+        components and credits the days that were invoiced after the end
+        date, and whether a contract that ends after the invoiced period is
+        still ended.
+        """
+        tenancy = self.component.tenancy
+        contract = self.component.contract
+        contract.tenancy = tenancy
+        contract.status = Contract.ACTIVE
+        contract.save()
+        baker.make(
+            'ContractPerson',
+            contract=contract,
+            percentage_of_total=100,
+            start_date=dt.date(2020, 1, 1),
+            end_date=None
+        )
+
+        ended, rejected = tenancy.end_contracts(
+            [contract.contract_id], termination_date=dt.date(2021, 3, 31)
+        )
+        self.assertEqual(ended, [contract.contract_id])
+        self.assertEqual(rejected, {})
+
+        contract.refresh_from_db()
+        self.assertEqual(contract.status, Contract.ENDED)
+        self.assertEqual(contract.end_date, dt.date(2021, 3, 31))
+        self.assertIsNone(contract.date_next_prolongation)
+        self.assertEqual(contract.balance, -60)
+        self.component.refresh_from_db()
+        self.assertEqual(self.component.end_date, dt.date(2021, 3, 31))
+        self.assertIsNone(self.component.date_next_prolongation)
+
+        # The month of April was invoiced already
+        invoice = Invoice.objects.get()
+        self.assertEqual(invoice.base_amount, -50)
+        self.assertEqual(invoice.total_amount, -60)
+        self.assertEqual(Collection.objects.get().amount, -60)
+        self.assertEqual(
+            contract.contractperson_set.get().end_date, dt.date(2021, 3, 31)
+        )
+
+        # A contract that ends after the invoiced period is invoiced until
+        # its end date
+        component = baker.make(
+            'Component',
+            contract__status=Contract.TERMINATED,
+            contract__start_date=dt.date(2020, 1, 1),
+            contract__termination_date=dt.date(2021, 8, 31),
+            contract__date_next_prolongation=dt.date(2021, 5, 1),
+            start_date=dt.date(2020, 1, 1),
+            end_date=None
+        )
+        component.contract.end()
+        component.contract.refresh_from_db()
+        self.assertEqual(component.contract.status, Contract.ENDED)
+        self.assertEqual(
+            component.contract.date_next_prolongation, dt.date(2021, 5, 1)
+        )
+        component.refresh_from_db()
+        self.assertEqual(component.end_date, dt.date(2021, 8, 31))
+        self.assertEqual(Invoice.objects.count(), 1)
+
+    def test_general_ledger_balances(self):
+        """Method to test whether the general ledger balances are updated
+        together with the general ledger posts.
+        """
+        self.component.create_correction_invoice(
+            dt.date(2020, 1, 1),
+            dt.date(2020, 2, 1),
+            -1
+        )
+        self.component.create_correction_invoice(
+            dt.date(2020, 1, 1),
+            dt.date(2020, 3, 1),
+            1
+        )
+
+        # Every account/dimension combination has one balance per day
+        balances = list(GeneralLedgerBalance.objects.all())
+        self.assertEqual(balances.__len__(), 3)
+        for balance in balances:
+            posts = GeneralLedgerPost.objects.filter(
+                gl_dimensions__gl_account=balance.gl_account,
+                gl_dimensions__gl_dimension_vat=balance.gl_dimension_vat
+            )
+            self.assertEqual(balance.number_of_posts, 2)
+            self.assertEqual(
+                balance.amount_debit,
+                sum(post.amount_debit for post in posts)
+            )
+            self.assertEqual(
+                balance.amount_credit,
+                sum(post.amount_credit for post in posts)
+            )
+
+        debtors = GeneralLedgerBalance.objects.get(
+            gl_account=self.component.contract.contract_type.gl_debit
+        )
+        self.assertEqual(debtors.amount_debit, 60)
+
+    def test_general_ledger_dimensions(self):
+        """Method to test whether the general ledger dimensions are stored
+        once per combination and read back correctly.
+        """
+        self.component.create_correction_invoice(
+            dt.date(2020, 1, 1),
+            dt.date(2020, 2, 1),
+            -1
+        )
+        number_of_dimensions = GeneralLedgerDimensions.objects.count()
+        self.component.create_correction_invoice(
+            dt.date(2020, 1, 1),
+            dt.date(2020, 3, 1),
+            1
+        )
+        self.assertEqual(
+            GeneralLedgerDimensions.objects.count(), number_of_dimensions
+        )
+
+        debtors = GeneralLedgerPost.objects.filter(description="Debtors")
+        self.assertEqual(debtors.count(), 2)
+        for post in debtors:
+            self.assertEqual(
+                post.gl_account, self.component.contract.contract_type.gl_debit
+            )
+            self.assertIsNone(post.gl_dimension_base_component)
+
+        invoice_line = InvoiceLine.objects.first()
+        self.assertEqual(
+            invoice_line.gl_account, self.component.base_component.gl_credit
+        )
+        self.assertEqual(
+            invoice_line.gl_account_vat, self.component.vat_rate.gl_account
+        )
+
+    def test_unique_general_ledger_keys(self):
+        """Method to test whether the balances and dimensions that another
+        process created at the same time are not created twice, also when
+        dimensions are empty.
+        """
+        self.component.create_correction_invoice(
+            dt.date(2020, 1, 1),
+            dt.date(2020, 2, 1),
+            -1
+        )
+        for model in (GeneralLedgerDimensions, GeneralLedgerBalance):
+            objects = list(model.objects.all())
+            for obj in objects:
+                obj.pk = None
+            model.objects.bulk_create(objects, ignore_conflicts=True)
+            self.assertEqual(model.objects.count(), len(objects))
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    objects[0].save()
+
+    def test_historic_contract_archive(self):
+        """Method to test whether the invoices of a contract that ended long
+        ago are moved to the archive and can be read back.
+        """
+        self.component.create_correction_invoice(
+            dt.date(2020, 1, 1),
+            dt.date(2020, 2, 1),
+            -1
+        )
+        self.component.create_correction_invoice(
+            dt.date(2020, 1, 1),
+            dt.date(2020, 3, 1),
+            1
+        )
+        invoices = list(Invoice.objects.order_by('date', 'invoice_id'))
+        invoice_lines = list(InvoiceLine.objects.order_by('invoice_line_id'))
+        next_ids = get_next_invoice_id()
+        balances = sorted(
+            GeneralLedgerBalance.objects.values_list(
+                'gl_account', 'amount_debit', 'amount_credit'
+            )
+        )
+
+        contract = self.component.contract
+        contract.status = Contract.ENDED
+        contract.end_date = dt.date(2010, 1, 1)
+        contract.save()
+        call_command('archive_historic_contracts', stdout=StringIO())
+
+        contract.refresh_from_db()
+        self.assertTrue(contract.is_historic())
+        self.assertFalse(Invoice.objects.exists())
+        self.assertFalse(InvoiceLine.objects.exists())
+        self.assertFalse(GeneralLedgerPost.objects.exists())
+        self.assertEqual(ContractArchive.objects.count(), 1)
+        self.assertEqual(get_next_invoice_id(), next_ids)
+
+        archived_invoices = contract.get_invoices()
+        self.assertEqual(
+            [(x.invoice_id, x.total_amount, x.date) for x in archived_invoices],
+            [(x.invoice_id, x.total_amount, x.date) for x in invoices]
+        )
+        self.assertEqual(
+            [(x.invoice_line_id, x.gl_account, x.component)
+             for invoice in archived_invoices
+             for x in invoice.get_invoice_lines()],
+            [(x.invoice_line_id, x.gl_account, x.component)
+             for x in invoice_lines]
+        )
+        archived_invoice = ContractArchive.get_archived_invoice(
+            contract.tenancy_id, invoices[-1].invoice_id
+        )
+        self.assertEqual(archived_invoice.invoice_id, invoices[-1].invoice_id)
+        self.assertIsNone(ContractArchive.get_archived_invoice(
+            contract.tenancy_id, next_ids[0]
+        ))
+
+        # The archived posts are still part of the balances
+        call_command('rebuild_general_ledger_balances', stdout=StringIO())
+        self.assertEqual(
+            sorted(
+                GeneralLedgerBalance.objects.values_list(
+                    'gl_account', 'amount_debit', 'amount_credit'
+                )
+            ),
+            balances
+        )
+
+    def test_tenancy_summary(self):
+        """Method to test whether the summary of the tenancy that is updated
+        by the invoices equals the summary computed from the invoices.
+        """
+        self.component.create_correction_invoice(
+            dt.date(2020, 1, 1),
+            dt.date(2020, 2, 1),
+            -1
+        )
+        self.component.create_correction_invoice(
+            dt.date(2020, 1, 1),
+            dt.date(2020, 3, 1),
+            1
+        )
+        invoices = list(Invoice.objects.all())
+        self.assertEqual(invoices.__len__(), 2)
+        tenancy_id = invoices[0].tenancy_id
+
+        summary = TenancySummary.objects.get(tenancy_id=tenancy_id)
+        self.assertEqual(
+            summary.open_balance, sum(invoice.balance for invoice in invoices)
+        )
+        self.assertEqual(
+            summary.open_balance,
+            TenancySummary.refresh(tenancy_id).open_balance
+        )
+
+        contract = self.component.contract
+        contract.status = Contract.ENDED
+        contract.end_date = dt.date(2010, 1, 1)
+        contract.save()
+        call_command('archive_historic_contracts', stdout=StringIO())
+        summary.refresh_from_db()
+        self.assertEqual(summary.open_balance, 0)
+
+    def test_deferred_corrections(self):
+        """Method to test whether deferred corrections are added to the next
+        invoice of the contract instead of being invoiced immediately.
+        """
+        tenancy = self.component.tenancy
+        contract = self.component.contract
+        contract.tenancy = tenancy
+        contract.save()
+        for obj in [contract.contract_type, self.component.base_component,
+                    self.component.vat_rate]:
+            obj.tenancy = tenancy
+            obj.save()
+
+        with override_settings(INVOICE_ENGINE_DEFER_CORRECTIONS=True):
+            self.component.create_correction_invoice(
+                dt.date(2020, 1, 1),
+                dt.date(2020, 2, 1),
+                -1
+            )
+        self.assertFalse(Invoice.objects.exists())
+        correction = PendingCorrection.objects.get()
+        self.assertEqual(correction.contract_id, contract.contract_id)
+        self.assertEqual(correction.total_amount, -60)
+
+        tenancy.invoice_contracts()
+        invoice = Invoice.objects.get()
+        self.assertIn(
+            -60,
+            [line.total_amount for line in invoice.invoiceline_set.all()]
+        )
+        self.assertFalse(PendingCorrection.objects.exists())
+
+    def test_derived_general_ledger_posts(self):
+        """Method to test whether the general ledger posts derived from the
+        invoices are equal to the stored general ledger posts.
+        """
+        fields = GeneralLedgerPost.EXPORT_FIELDS
+        tenancy = self.component.tenancy
+
+        self.component.create_correction_invoice(
+            dt.date(2020, 1, 1),
+            dt.date(2020, 2, 1),
+            -1
+        )
+        stored_posts = [
+            [getattr(post, field) for field in fields]
+            for post in get_general_ledger_posts(
+                tenancy.company_id, tenancy.tenancy_id, dt.date.today()
+            )
+        ]
+        Invoice.objects.all().delete()
+
+        with override_settings(INVOICE_ENGINE_STORE_GL_POSTS=False):
+            self.component.create_correction_invoice(
+                dt.date(2020, 1, 1),
+                dt.date(2020, 2, 1),
+                -1
+            )
+            self.assertFalse(GeneralLedgerPost.objects.exists())
+            derived_posts = [
+                [getattr(post, field) for field in fields]
+                for post in get_general_ledger_posts(
+                    tenancy.company_id, tenancy.tenancy_id, dt.date.today()
+                )
+            ]
+
+        self.assertEqual(stored_posts.__len__(), 3)
+        # The invoice and invoice line have a new id
+        for stored_post, derived_post in zip(stored_posts, derived_posts):
+            self.assertEqual(
+                [str(value) for value in stored_post[3:]],
+                [str(value) for value in derived_post[3:]]
+            )
+
+        # The posts are still derived after the setting is switched back
+        self.assertEqual(
+            [[getattr(post, field) for field in fields]
+             for post in get_general_ledger_posts(
+                tenancy.company_id, tenancy.tenancy_id, dt.date.today()
+            )],
+            derived_posts
+        )
+        call_command('rebuild_general_ledger_balances', stdout=StringIO())
+        self.assertEqual(
+            [
+                sum(balance.number_of_posts
+                    for balance in GeneralLedgerBalance.objects.all()),
+                sum(balance.amount_credit
+                    for balance in GeneralLedgerBalance.objects.all())
+            ],
+            [
+                len(derived_posts),
+                sum(post[fields.index('amount_credit')]
+                    for post in derived_posts)
+            ]
+        )
+
+    def test_invoice_events(self):
+        """Method to test whether every process that creates invoices adds an
+        invoice event with the range of its invoices.
+        """
+        tenancy = self.component.tenancy
+        contract = self.component.contract
+        contract.tenancy = tenancy
+        contract.save()
+        for obj in [contract.contract_type, self.component.base_component,
+                    self.component.vat_rate]:
+            obj.tenancy = tenancy
+            obj.save()
+
+        self.component.create_correction_invoice(
+            dt.date(2020, 1, 1),
+            dt.date(2020, 2, 1),
+            -1
+        )
+        correction = Invoice.objects.get()
+        event = InvoiceEvent.objects.get()
+        self.assertEqual(event.event_type, InvoiceEvent.CORRECTION)
+        self.assertEqual(event.number_of_invoices, 1)
+        self.assertEqual(event.total_amount, -60)
+        self.assertEqual(list(event.get_invoices()), [correction])
+
+        tenancy.invoice_contracts()
+        event = InvoiceEvent.objects.latest('id')
+        self.assertEqual(event.event_type, InvoiceEvent.RUN)
+        self.assertEqual(event.number_of_invoices, 1)
+        self.assertEqual(
+            list(event.get_invoices()),
+            list(Invoice.objects.exclude(invoice_id=correction.invoice_id))
+        )
+
+    def test_precompute_invoices(self):
+        """Method to test whether the invoicing run saves the precomputed
+        invoices as if it had computed them itself, and whether a change of
+        the contract discards its precomputed invoice, also while it is
+        computed or used.
+        """
+        tenancy = self.component.tenancy
+        contract = self.component.contract
+        contract.tenancy = tenancy
+        contract.save()
+        for obj in [contract.contract_type, self.component.base_component,
+                    self.component.vat_rate]:
+            obj.tenancy = tenancy
+            obj.save()
+        person = baker.make(
+            "ContractPerson",
+            tenancy=tenancy,
+            contract=contract,
+            percentage_of_total=100,
+            start_date=dt.date(2020, 1, 1),
+            end_date=None,
+            payment_day=1
+        )
+
+        def get_run_output():
+            invoice = Invoice.objects.get()
+            return (
+                get_field_values(invoice, ['invoice_id']),
+                [get_field_values(line, ['invoice_line_id', 'invoice'])
+                 for line in InvoiceLine.objects.order_by('pk')],
+                [get_field_values(post, ['id', 'invoice', 'invoice_line'])
+                 for post in GeneralLedgerPost.objects.order_by('pk')],
+                [get_field_values(collection, ['id', 'invoice'])
+                 for collection in Collection.objects.order_by('pk')],
+                get_field_values(Contract.objects.get(), ['version']),
+                get_field_values(Component.objects.get(), [])
+            )
+
+        # Invoice the contract without precomputing and undo it afterwards
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Tenancy.objects.get(pk=tenancy.pk).invoice_contracts()
+                expected = get_run_output()
+                raise ValueError
+
+        # Changes are made by another process, which has a cache of its own
+        other_process = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'other-process'
+        }})
+
+        def change_contract():
+            with other_process:
+                person.save()
+
+        def is_valid():
+            return PrecomputedInvoice.get_valid(
+                tenancy, dt.date.today()
+            ).exists()
+
+        with override_settings(INVOICE_ENGINE_PRECOMPUTE_INVOICES=True):
+            tenancy = Tenancy.objects.get(pk=tenancy.pk)
+            self.assertEqual(tenancy.precompute_invoices(dt.date.today()), 1)
+            self.assertFalse(Invoice.objects.exists())
+            self.assertTrue(is_valid())
+            change_contract()
+            self.assertFalse(is_valid())
+
+            # A change while the invoices are computed
+            create_invoices = Tenancy.create_invoices
+
+            def create_invoices_and_change(*args, **kwargs):
+                result = create_invoices(*args, **kwargs)
+                change_contract()
+                return result
+
+            with mock.patch.object(
+                    Tenancy, 'create_invoices', create_invoices_and_change):
+                tenancy.precompute_invoices(dt.date.today())
+            self.assertFalse(is_valid())
+
+            # A change after the run has read the precomputed invoices
+            tenancy.precompute_invoices(dt.date.today())
+
+            def get_next_invoice_id_and_change():
+                change_contract()
+                return get_next_invoice_id()
+
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    with mock.patch(
+                            'InvoiceEngineApp.models.get_next_invoice_id',
+                            get_next_invoice_id_and_change):
+                        Tenancy.objects.get(pk=tenancy.pk).invoice_contracts()
+                    self.assertEqual(get_run_output(), expected)
+                    raise ValueError
+
+            self.assertTrue(is_valid())
+            with self.assertNumQueries(1):
+                # The components are not loaded again
+                self.assertEqual(
+                    tenancy.get_invoicing_data(
+                        dt.date.today(), [contract.contract_id]
+                    ),
+                    ([], [], {})
+                )
+            tenancy.invoice_contracts()
+            self.assertEqual(get_run_output(), expected)
+            self.assertFalse(PrecomputedInvoice.objects.exists())
+
+    def test_precompute_invoices_reference_data(self):
+        """Method to test whether a change of the reference data by another
+        process invalidates the precomputed invoices, and whether the
+        invoicing run uses the changed reference data.
+        """
+        tenancy = self.component.tenancy
+        contract = self.component.contract
+        contract.tenancy = tenancy
+        contract.save()
+        base_component = self.component.base_component
+        for obj in [contract.contract_type, base_component,
+                    self.component.vat_rate]:
+            obj.tenancy = tenancy
+            obj.save()
+        baker.make(
+            "ContractPerson",
+            tenancy=tenancy,
+            contract=contract,
+            percentage_of_total=100,
+            start_date=dt.date(2020, 1, 1),
+            end_date=None,
+            payment_day=1
+        )
+
+        with override_settings(INVOICE_ENGINE_PRECOMPUTE_INVOICES=True):
+            tenancy = Tenancy.objects.get(pk=tenancy.pk)
+            tenancy.precompute_invoices(dt.date.today())
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'other-process'
+            }}):
+                base_component.gl_credit = '8100'
+                base_component.save()
+            self.assertFalse(PrecomputedInvoice.get_valid(
+                tenancy, dt.date.today()
+            ).exists())
+
+            tenancy.invoice_contracts()
+            self.assertEqual(InvoiceLine.objects.get().gl_account, '8100')
+
+    def test_invoice_contracts_backfill(self):
+        """Method to test whether a backfill creates an invoice for every
+        missed invoicing period, dated on the invoicing date of the period.
+        """
+        tenancy = self.component.tenancy
+        contract = self.component.contract
+        contract.tenancy = tenancy
+        contract.save()
+        for obj in [contract.contract_type, self.component.base_component,
+                    self.component.vat_rate]:
+            obj.tenancy = tenancy
+            obj.save()
+        self.component.date_next_prolongation = dt.date(2021, 5, 1)
+        self.component.date_prev_prolongation = dt.date(2021, 4, 1)
+        self.component.save()
+        baker.make(
+            "ContractPerson",
+            tenancy=tenancy,
+            contract=contract,
+            percentage_of_total=100,
+            start_date=dt.date(2020, 1, 1),
+            end_date=None,
+            payment_day=1
+        )
+
+        tenancy.invoice_contracts(as_of=dt.date(2021, 7, 15), backfill=True)
+
+        invoices = list(Invoice.objects.order_by('invoice_id'))
+        self.assertEqual(
+            [invoice.date for invoice in invoices],
+            [dt.date(2021, 5, 1), dt.date(2021, 6, 1), dt.date(2021, 7, 1)]
+        )
+        self.assertEqual(
+            [invoice.total_amount for invoice in invoices], [60, 60, 60]
+        )
+        self.assertEqual(Collection.objects.count(), 3)
+        contract.refresh_from_db()
+        self.assertEqual(contract.date_next_prolongation, dt.date(2021, 8, 1))
+        self.assertEqual(contract.balance, 180)
+        self.component.refresh_from_db()
+        self.assertEqual(
+            self.component.date_next_prolongation, dt.date(2021, 8, 1)
+        )
+
+
+class InvoiceEventOrderTest(TransactionTestCase):
+    def setUp(self):
+        self.tenancy = baker.make(Tenancy)
+
+    def add_event(self, invoice_id, added, commit=None, tenancy=None):
+        """Method to add an event in a transaction of its own connection,
+        which is committed when commit is set.
+        """
+        try:
+            with transaction.atomic():
+                InvoiceEvent.add_invoices(
+                    [Invoice(tenancy=tenancy or self.tenancy,
+                             invoice_id=invoice_id, total_amount=10)],
+                    InvoiceEvent.RUN
+                )
+                added.set()
+                if commit is not None:
+                    commit.wait(5)
+        finally:
+            connection.close()
+
+    def test_commit_order(self):
+        """Method to test whether an event that is added while another
+        transaction has added an event, is only committed after it and with
+        a higher id, so a reader never skips an event.
+        """
+        first_added = threading.Event()
+        first_commit = threading.Event()
+        second_added = threading.Event()
+        first = threading.Thread(
+            target=self.add_event, args=(1, first_added, first_commit)
+        )
+        second = threading.Thread(
+            target=self.add_event, args=(2, second_added)
+        )
+
+        first.start()
+        self.assertTrue(first_added.wait(5))
+        second.start()
+        # The second transaction waits for the first one
+        self.assertFalse(second_added.wait(0.5))
+        self.assertFalse(InvoiceEvent.objects.exists())
+
+        first_commit.set()
+        first.join(5)
+        second.join(5)
+        events = list(InvoiceEvent.objects.order_by('id'))
+        self.assertEqual(
+            [event.first_invoice_id for event in events], [1, 2]
+        )
+
+    def test_other_tenancy(self):
+        """Method to test whether an event of another tenancy is added
+        without waiting for the transaction of the first tenancy.
+        """
+        other_tenancy = baker.make(Tenancy)
+        first_added = threading.Event()
+        first_commit = threading.Event()
+        second_added = threading.Event()
+        first = threading.Thread(
+            target=self.add_event, args=(1, first_added, first_commit)
+        )
+        second = threading.Thread(
+            target=self.add_event,
+            args=(2, second_added, None, other_tenancy)
+        )
+
+        first.start()
+        self.assertTrue(first_added.wait(5))
+        second.start()
+        self.assertTrue(second_added.wait(5))
+        second.join(5)
+        self.assertEqual(
+            list(InvoiceEvent.objects.values_list('tenancy_id', flat=True)),
+            [other_tenancy.company_id]
+        )
+
+        first_commit.set()
+        first.join(5)
+        self.assertEqual(InvoiceEvent.objects.count(), 2)
+
+
+class ContractImportTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy', number_of_contracts=0)
+        self.contract_type = baker.make('ContractType', tenancy=self.tenancy)
+        self.base_component = baker.make(
+            'BaseComponent', tenancy=self.tenancy, unit_id=None
+        )
+        self.vat_rate = baker.make(
+            'VATRate', tenancy=self.tenancy, percentage=dc.Decimal(20)
+        )
+        self.contract = {
+            'external_customer_id': 1,
+            'contract_type': self.contract_type.contract_type_id,
+            'invoicing_period': Contract.MONTH,
+            'pricing_type': Contract.PERIOD,
+            'start_date': '2021-01-01',
+            'gl_dimension_1': 'A',
+            'gl_dimension_2': 'B'
+        }
+        self.component = {
+            'base_component': self.base_component.base_component_id,
+            'vat_rate': self.vat_rate.vat_rate_id,
+            'description': 'Rent',
+            'start_date': '2021-01-01',
+            'base_amount': '50.00'
+        }
+        self.contract_person = {
+            'type': 'P',
+            'start_date': '2021-01-01',
+            'name': 'John Doe',
+            'address': 'Street 1',
+            'city': 'Groningen',
+            'payment_method': 'I',
+            'email': 'john@example.com',
+            'phone': '0612345678',
+            'percentage_of_total': '100',
+            'payment_day': 1
+        }
+
+    def test_import_json_lines(self):
+        """Method to test whether valid contracts are imported with their
+        components and contract persons, and invalid contracts are reported.
+        """
+        lines = [
+            dict(self.contract, components=[self.component],
+                 contract_persons=[self.contract_person]),
+            dict(self.contract, contract_type=None),
+            dict(self.contract, contract_persons=[
+                dict(self.contract_person, percentage_of_total='50')
+            ]),
+        ]
+        file = StringIO('\n'.join(json.dumps(line) for line in lines)
+                        + '\nnot json\n')
+
+        report = ContractImporter(self.tenancy, batch_size=2).import_contracts(
+            read_json_lines(file)
+        )
+        self.assertEqual(report['contracts'], 1)
+        self.assertEqual(report['components'], 1)
+        self.assertEqual(report['contract_persons'], 1)
+        self.assertEqual(
+            [line_number for line_number, messages in report['errors']],
+            [2, 3, 4]
+        )
+
+        contract = Contract.objects.get(tenancy=self.tenancy)
+        self.assertTrue(contract.is_draft())
+        self.assertEqual(contract.total_amount, 60)
+        component = contract.component_set.get()
+        self.assertEqual(component.vat_amount, 10)
+        self.assertEqual(contract.contractperson_set.get().name, 'John Doe')
+        self.tenancy.refresh_from_db()
+        self.assertEqual(self.tenancy.number_of_contracts, 1)
+
+        # The imported contract can be activated
+        activated, rejected = self.tenancy.activate_contracts()
+        self.assertEqual(activated, [contract.contract_id])
+
+    def test_import_twice(self):
+        """Method to test whether a second import in the same transaction
+        uses the staging tables of the first one.
+        """
+        with transaction.atomic():
+            for i in range(2):
+                report = ContractImporter(self.tenancy).import_contracts(
+                    [(1, self.contract, [self.component], [])]
+                )
+                self.assertEqual(report['contracts'], 1)
+        self.assertEqual(
+            Component.objects.filter(tenancy=self.tenancy).count(), 2
+        )
+
+    def test_read_csv(self):
+        """Method to test whether the components and contract persons in a
+        CSV file belong to the contract before them.
+        """
+        fields = ['record'] + sorted(
+            set(self.contract) | set(self.component)
+            | set(self.contract_person)
+        )
+        file = StringIO()
+        writer = csv.DictWriter(file, fields)
+        writer.writeheader()
+        writer.writerow(dict(self.contract, record='contract'))
+        writer.writerow(dict(self.component, record='component'))
+        writer.writerow(dict(self.contract_person, record='contract_person'))
+        writer.writerow(dict(self.contract, record='contract'))
+        file.seek(0)
+
+        contracts = list(read_csv(file))
+        self.assertEqual(
+            [(line_number, len(components), len(persons))
+             for line_number, contract, components, persons in contracts],
+            [(2, 1, 1), (5, 0, 0)]
+        )
+        self.assertEqual(
+            contracts[0][1]['gl_dimension_1'], self.contract['gl_dimension_1']
+        )
@@ -1,4 +1,5 @@
 from django.test import TestCase
+from InvoiceEngineApp.caching import get_reference_data
 from InvoiceEngineApp.models import *
 from model_bakery import baker
 import datetime
@@ -168,6 +169,76 @@ class VATRateTest(TestCase):
         self.assertNotEqual(obj.gl_dimension, self.vatrate.gl_dimension)
         self.assertEqual(VATRate.objects.count(), 1)
 
+    def test_reference_data_cache(self):
+        company_id = self.vatrate.tenancy_id
+        get_reference_data(VATRate, company_id)
+        with self.assertNumQueries(0):
+            vat_rates = get_reference_data(VATRate, company_id)
+        self.assertEqual(list(vat_rates), [self.vatrate.vat_rate_id])
+
+        # A change of a VAT rate of the tenancy is visible immediately
+        successor = baker.make(
+            VATRate,
+            tenancy_id=company_id,
+            type=5,
+            start_date=datetime.date(2022, 1, 1),
+            percentage=21.0
+        )
+        self.vatrate.successor_vat_rate = successor
+        self.vatrate.save()
+        vat_rates = get_reference_data(VATRate, company_id)
+        self.assertEqual(
+            vat_rates[self.vatrate.vat_rate_id].successor_vat_rate,
+            vat_rates[successor.vat_rate_id]
+        )
+
+        successor.delete()
+        self.assertEqual(
+            list(get_reference_data(VATRate, company_id)),
+            [self.vatrate.vat_rate_id]
+        )
+
+        # A VAT rate created by another process is read from the database
+        # when it is asked for
+        other, = VATRate.objects.bulk_create([baker.prepare(
+            VATRate, tenancy_id=company_id, type=6, percentage=0
+        )])
+        self.assertNotIn(other.vat_rate_id, get_reference_data(
+            VATRate, company_id
+        ))
+        self.assertIn(other.vat_rate_id, get_reference_data(
+            VATRate, company_id, [other.vat_rate_id]
+        ))
+
+    def test_create_with_stale_cache(self):
+        """The current VAT rate of the type is ended by a new VAT rate, even
+        if it is not in the cached VAT rates yet.
+        """
+        company_id = self.vatrate.tenancy_id
+        self.vatrate.end_date = datetime.date(2021, 12, 31)
+        self.vatrate.save()
+        get_reference_data(VATRate, company_id)
+        # Created by another process, so the cache is not changed
+        current, = VATRate.objects.bulk_create([baker.prepare(
+            VATRate, tenancy_id=company_id, type=5, percentage=9,
+            start_date=datetime.date(2022, 1, 1), end_date=None
+        )])
+        baker.make(
+            'Component', tenancy_id=company_id, vat_rate=current,
+            contract__status='A'
+        )
+
+        new = VATRate(
+            tenancy_id=company_id, type=5, description='New',
+            start_date=datetime.date(2023, 1, 1), percentage=21,
+            gl_account='Account', gl_dimension='Dimension'
+        )
+        new.create({'company_id': company_id})
+
+        current.refresh_from_db()
+        self.assertEqual(current.end_date, datetime.date(2022, 12, 31))
+        self.assertEqual(current.successor_vat_rate, new)
+
 
 class ContractTest(TestCase):
     def setUp(self):
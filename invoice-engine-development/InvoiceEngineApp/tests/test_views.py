@@ -1,7 +1,31 @@
+import datetime as dt
+import decimal as dc
+import json
+
 from django.contrib.auth.models import User
-from django.test import RequestFactory, TestCase
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+from django.test import RequestFactory, TestCase, override_settings
+from model_bakery import baker
 
+from InvoiceEngineApp.models import Contract, Invoice, Tenancy
+from InvoiceEngineApp.pagination import (
+    ApproximateCountPaginator,
+    KeysetPaginator,
+    get_estimated_count
+)
+from InvoiceEngineApp.views.api_views import api_list
+from InvoiceEngineApp.views.base_component_views import BaseComponentListView
+from InvoiceEngineApp.views.contract_type_views import ContractTypeListView
+from InvoiceEngineApp.views.contract_views import (
+    ContractDetailView,
+    ContractListView,
+)
+from InvoiceEngineApp.views.general_ledger_views import TrialBalanceView
 from InvoiceEngineApp.views.general_views import UserProfilePage
+from InvoiceEngineApp.views.invoice_views import InvoiceListView
+from InvoiceEngineApp.views.vat_rate_views import VATRateListView
 
 
 class ProfileTest(TestCase):
@@ -18,3 +42,486 @@ class ProfileTest(TestCase):
         request.user = self.user
         response = UserProfilePage.as_view()(request)
         self.assertEqual(response.status_code, 200)
+
+
+class TenancyViewTestCase(TestCase):
+    """Test case for the views of a tenancy, which are requested by the user
+    that owns the tenancy.
+    """
+    def setUp(self):
+        # The number of queries should not depend on what earlier tests
+        # left in the cache
+        cache.clear()
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+            username='1234', email='jacob@…', password='top_secret')
+        self.tenancy = baker.make('Tenancy', tenancy_id=1234)
+
+    def get_request(self, path, data=None, **headers):
+        request = self.factory.get(path, data, **headers)
+        request.user = self.user
+        return request
+
+
+class ContractDetailTest(TenancyViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.contract = baker.make(
+            'Contract',
+            tenancy=self.tenancy,
+            status=Contract.DRAFT,
+            start_date=dt.date(2020, 1, 1)
+        )
+        baker.make('Invoice', tenancy=self.tenancy, contract=self.contract)
+
+    def get_details(self, **headers):
+        request = self.get_request('/contract', **headers)
+        response = ContractDetailView.as_view()(
+            request,
+            company_id=self.tenancy.company_id,
+            contract_id=self.contract.contract_id
+        )
+        # Pages from the cache are already rendered
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_invoice_order(self):
+        """The invoices are shown from the newest to the oldest."""
+        Invoice.objects.all().delete()
+        invoices = [
+            baker.make(
+                'Invoice',
+                tenancy=self.tenancy,
+                contract=self.contract,
+                date=date
+            )
+            for date in (dt.date(2020, 2, 1), dt.date(2020, 3, 1),
+                         dt.date(2020, 1, 1))
+        ]
+        response = self.get_details()
+        self.assertEqual(
+            list(response.context_data['object_list']),
+            [invoices[1], invoices[0], invoices[2]]
+        )
+
+    def test_cached_page(self):
+        response = self.get_details()
+        etag = response['ETag']
+
+        # Repeated views only check the access and query the version
+        with self.assertNumQueries(2):
+            cached = self.get_details()
+        self.assertEqual(cached.content, response.content)
+        with self.assertNumQueries(2):
+            response = self.get_details(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # A change of a contract person is shown immediately
+        baker.make(
+            'ContractPerson',
+            tenancy=self.tenancy,
+            contract=self.contract,
+            name='Jan de Vries'
+        )
+        response = self.get_details(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn(b'Jan de Vries', response.content)
+
+    def test_change_in_other_process(self):
+        """A change made by another process, which has a cache of its own,
+        is shown immediately as well.
+        """
+        other_process = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'other-process'
+        }})
+        etag = self.get_details()['ETag']
+        with other_process:
+            baker.make(
+                'ContractPerson',
+                tenancy=self.tenancy,
+                contract=self.contract,
+                name='Jan de Vries'
+            )
+        response = self.get_details(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Jan de Vries', response.content)
+
+        etag = response['ETag']
+        with other_process:
+            contract_type = self.contract.contract_type
+            contract_type.tenancy = self.tenancy
+            contract_type.description = 'Parking space'
+            contract_type.save()
+        response = self.get_details(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Parking space', response.content)
+
+    def test_number_of_queries(self):
+        """The number of queries should not depend on the number of
+        components and contract persons.
+        """
+        for number in [1, 20]:
+            baker.make(
+                'Component',
+                tenancy=self.tenancy,
+                contract=self.contract,
+                _quantity=number
+            )
+            baker.make(
+                'ContractPerson',
+                tenancy=self.tenancy,
+                contract=self.contract,
+                start_date=dt.date(2020, 1, 1),
+                percentage_of_total=dc.Decimal(1),
+                _quantity=number
+            )
+            with self.assertNumQueries(7):
+                response = self.get_details()
+            self.assertEqual(response.status_code, 200)
+
+
+class TenancyAccessTest(TenancyViewTestCase):
+    def get_list(self):
+        request = self.get_request('/list')
+        return InvoiceListView.as_view()(
+            request, company_id=self.tenancy.company_id
+        )
+
+    def test_access(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_list().status_code, 200)
+
+        # Access is withdrawn as soon as the tenancy changes owner
+        self.tenancy.tenancy_id = 5678
+        self.tenancy.save()
+        with self.assertRaises(Http404):
+            self.get_list()
+
+        # An owner that is rolled back does not get access
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.tenancy.tenancy_id = 1234
+                self.tenancy.save()
+                raise ValueError
+        self.assertFalse(Tenancy.has_access(self.tenancy.company_id, '1234'))
+
+        company_id = self.tenancy.company_id
+        self.tenancy.tenancy_id = 1234
+        self.tenancy.save()
+        self.tenancy.delete()
+        self.assertFalse(Tenancy.has_access(company_id, '1234'))
+        self.assertFalse(Tenancy.has_access(company_id, ''))
+
+
+class ListViewQueriesTest(TenancyViewTestCase):
+    """The number of queries of a list page should not depend on the number
+    of objects on the page.
+    """
+    def get_list(self, view):
+        request = self.get_request('/list')
+        response = view.as_view()(request, company_id=self.tenancy.company_id)
+        response.render()
+        return response
+
+    def assert_list_queries(self, view, number, make_object):
+        """Render the list with one object and with a full page of objects,
+        which should take the same number of queries.
+        """
+        make_object()
+        with self.assertNumQueries(number):
+            self.assertEqual(self.get_list(view).status_code, 200)
+
+        for i in range(view.paginate_by):
+            make_object()
+        with self.assertNumQueries(number):
+            self.assertEqual(self.get_list(view).status_code, 200)
+
+    def test_contract_type_list(self):
+        self.assert_list_queries(
+            ContractTypeListView, 3,
+            lambda: baker.make(
+                'Contract',
+                tenancy=self.tenancy,
+                contract_type__tenancy=self.tenancy,
+                date_prev_prolongation=dt.date(2020, 1, 1)
+            )
+        )
+
+    def test_base_component_list(self):
+        self.assert_list_queries(
+            BaseComponentListView, 3,
+            lambda: baker.make(
+                'Component',
+                tenancy=self.tenancy,
+                base_component__tenancy=self.tenancy
+            )
+        )
+
+    def test_vat_rate_list(self):
+        self.assert_list_queries(
+            VATRateListView, 3,
+            lambda: baker.make(
+                'Component',
+                tenancy=self.tenancy,
+                vat_rate__tenancy=self.tenancy,
+                contract__status=Contract.ACTIVE
+            )
+        )
+
+    def test_contract_list(self):
+        self.assert_list_queries(
+            ContractListView, 3,
+            lambda: baker.make(
+                'ContractPerson',
+                tenancy=self.tenancy,
+                contract__tenancy=self.tenancy,
+                percentage_of_total=dc.Decimal(100)
+            )
+        )
+
+    def test_invoice_list(self):
+        self.assert_list_queries(
+            InvoiceListView, 2,
+            lambda: baker.make('Invoice', tenancy=self.tenancy)
+        )
+
+    def test_trial_balance(self):
+        self.assert_list_queries(
+            TrialBalanceView, 3,
+            lambda: baker.make(
+                'GeneralLedgerBalance',
+                tenancy=self.tenancy,
+                date=dt.date.today()
+            )
+        )
+
+
+class KeysetPaginationTest(TenancyViewTestCase):
+    def get_page(self, **kwargs):
+        request = self.get_request('/invoices', kwargs)
+        response = InvoiceListView.as_view()(
+            request, company_id=self.tenancy.company_id
+        )
+        response.render()
+        return response.context_data['page_obj']
+
+    @staticmethod
+    def get_all_pages(paginator):
+        """Page forward through all pages and back again, and return the
+        objects of both directions.
+        """
+        page = paginator.page()
+        forward = list(page)
+        while page.has_next():
+            page = paginator.page(after=page.next_cursor())
+            forward.extend(page)
+        backward = list(page)
+        while page.has_previous():
+            page = paginator.page(before=page.previous_cursor())
+            backward = list(page) + backward
+        return forward, backward
+
+    def test_next_and_previous(self):
+        # Several invoices have the same date, so the primary key decides
+        for i in range(25):
+            baker.make(
+                'Invoice',
+                tenancy=self.tenancy,
+                date=dt.date(2021, 1, 1) + dt.timedelta(days=i // 3)
+            )
+        invoices = list(Invoice.objects.order_by('-date', 'invoice_id'))
+
+        pages = [self.get_page()]
+        while pages[-1].has_next():
+            pages.append(self.get_page(after=pages[-1].next_cursor()))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([i for page in pages for i in page], invoices)
+
+        previous = self.get_page(before=pages[-1].previous_cursor())
+        self.assertEqual(list(previous), list(pages[1]))
+        self.assertTrue(previous.has_previous())
+        self.assertTrue(previous.has_next())
+
+    def test_null_values(self):
+        for date in [None, dt.date(2021, 1, 1), None, dt.date(2021, 3, 1),
+                     dt.date(2021, 1, 1), None, dt.date(2021, 2, 1)]:
+            baker.make(
+                'Contract',
+                tenancy=self.tenancy,
+                date_next_prolongation=date
+            )
+
+        for ordering in ['date_next_prolongation', '-date_next_prolongation']:
+            qs = Contract.objects.order_by(ordering)
+            forward, backward = self.get_all_pages(KeysetPaginator(qs, 2))
+            expected = list(qs.order_by(ordering, 'pk'))
+            self.assertEqual(forward, expected)
+            self.assertEqual(backward, expected)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(Http404):
+            self.get_page(after='invalid')
+        with self.assertRaises(Http404):
+            self.get_page(before='WyIyMDIxIl0=')
+
+
+class ApproximateCountTest(TestCase):
+    def setUp(self):
+        self.tenancy = baker.make('Tenancy')
+        baker.make('Invoice', tenancy=self.tenancy, _quantity=15)
+        self.invoices = Invoice.objects.filter(
+            tenancy=self.tenancy
+        ).order_by('invoice_id')
+
+    @override_settings(INVOICE_ENGINE_EXACT_COUNT_LIMIT=10 ** 9)
+    def test_exact_count(self):
+        """Small lists are counted in one query, without an estimate."""
+        paginator = ApproximateCountPaginator(self.invoices, 10)
+        with self.assertNumQueries(1):
+            self.assertFalse(paginator.is_approximate)
+            self.assertEqual(paginator.count, 15)
+        self.assertEqual(len(paginator.page(2)), 5)
+
+    @override_settings(INVOICE_ENGINE_EXACT_COUNT_LIMIT=10)
+    def test_count_limit(self):
+        """The count of a list with more objects than the limit is never
+        lower than the limit, even if the estimate is.
+        """
+        paginator = ApproximateCountPaginator(self.invoices, 10)
+        self.assertTrue(paginator.is_approximate)
+        self.assertGreaterEqual(paginator.count, 10)
+
+    @override_settings(INVOICE_ENGINE_EXACT_COUNT_LIMIT=0)
+    def test_approximate_count(self):
+        paginator = ApproximateCountPaginator(self.invoices, 10)
+        self.assertTrue(paginator.is_approximate)
+        self.assertEqual(paginator.count, get_estimated_count(self.invoices))
+
+        # Pages after the estimated last page are allowed but may be empty
+        self.assertEqual(len(paginator.page(2)), 5)
+        self.assertEqual(len(paginator.page(paginator.num_pages + 100)), 0)
+
+
+class ContractSearchTest(TenancyViewTestCase):
+    def make_contract(self, *names):
+        contract = baker.make('Contract', tenancy=self.tenancy)
+        for name in names:
+            baker.make(
+                'ContractPerson',
+                tenancy=self.tenancy,
+                contract=contract,
+                name=name,
+                address='Grote Markt 1',
+                city='Groningen'
+            )
+        return contract
+
+    def search(self, **kwargs):
+        request = self.get_request('/contracts', kwargs)
+        response = ContractListView.as_view()(
+            request, company_id=self.tenancy.company_id
+        )
+        return list(response.context_data['object_list'])
+
+    def test_search_name(self):
+        """Contracts with several matching persons are returned once, and
+        exact matches come first.
+        """
+        partial = self.make_contract('Jan de Vries', 'Janneke de Vries')
+        exact = self.make_contract('Jan')
+        self.make_contract('Piet')
+
+        self.assertEqual(self.search(name='jan'), [exact, partial])
+
+    def test_search_address(self):
+        contract = self.make_contract('Jan', 'Piet')
+        self.make_contract()
+
+        self.assertEqual(self.search(address='groningen'), [contract])
+        self.assertEqual(self.search(address='markt'), [contract])
+        self.assertEqual(self.search(address='Assen'), [])
+
+    def test_search_amounts(self):
+        small = baker.make(
+            'Contract', tenancy=self.tenancy,
+            total_amount=dc.Decimal('99.99'), balance=dc.Decimal(0)
+        )
+        large = baker.make(
+            'Contract', tenancy=self.tenancy,
+            total_amount=dc.Decimal('1000.00'), balance=dc.Decimal(-50)
+        )
+
+        self.assertEqual(self.search(total_amount='99.99'), [small])
+        self.assertEqual(self.search(total_amount='100'), [])
+        self.assertEqual(
+            self.search(total_amount='100', amount_tolerance='0.01'), [small]
+        )
+        self.assertEqual(self.search(total_amount_min='100'), [large])
+        self.assertEqual(self.search(balance_max='-10'), [large])
+        self.assertEqual(self.search(balance='0'), [small])
+
+
+class ApiTest(TenancyViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.invoices = baker.make(
+            'Invoice', tenancy=self.tenancy, _quantity=5
+        )
+        baker.make('Invoice')
+
+    def get(self, resource, **params):
+        request = self.get_request('/api', params)
+        response = api_list(
+            request, company_id=self.tenancy.company_id, resource=resource
+        )
+        return response.status_code, json.loads(response.content)
+
+    def test_pages(self):
+        """The pages contain the invoices of the tenancy in the order of their
+        id, with the selected fields and the id.
+        """
+        results = []
+        after = None
+        with self.assertNumQueries(6):
+            while True:
+                params = {'limit': 2, 'fields': 'total_amount'}
+                if after:
+                    params['after'] = after
+                status, data = self.get('invoices', **params)
+                self.assertEqual(status, 200)
+                results.extend(data['results'])
+                after = data['next']
+                if not after:
+                    break
+
+        self.assertEqual(
+            [result['invoice_id'] for result in results],
+            sorted(invoice.invoice_id for invoice in self.invoices)
+        )
+        self.assertEqual(set(results[0]), {'invoice_id', 'total_amount'})
+
+    def test_gl_dimensions(self):
+        gl_dimensions = baker.make(
+            'GeneralLedgerDimensions', tenancy=self.tenancy, gl_account='8000'
+        )
+        line = baker.make(
+            'InvoiceLine', tenancy=self.tenancy, invoice=self.invoices[0],
+            gl_dimensions=gl_dimensions
+        )
+        baker.make('InvoiceLine')
+
+        status, data = self.get('invoice_lines', fields='gl_account')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['results'], [
+            {'invoice_line_id': line.invoice_line_id, 'gl_account': '8000'}
+        ])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get('invoices', fields='password')[0], 400)
+        self.assertEqual(self.get('invoices', limit='0')[0], 400)
+        self.assertEqual(self.get('invoices', after='x')[0], 400)
+        with self.assertRaises(Http404):
+            self.get('users')
@@ -8,6 +8,8 @@ from InvoiceEngineApp.views.contract_views import *
 from InvoiceEngineApp.views.component_views import *
 from InvoiceEngineApp.views.contract_person_views import *
 from InvoiceEngineApp.views.invoice_views import *
+from InvoiceEngineApp.views.general_ledger_views import *
+from InvoiceEngineApp.views.api_views import *
 
 
 urlpatterns = [
@@ -106,6 +108,14 @@ urlpatterns = [
          ContractCreateView.as_view(),
          name='contract_create'
          ),
+    path('profile/tenancies/<int:company_id>/contracts/activate/',
+         contracts_activation_view,
+         name='contracts_activate'
+         ),
+    path('profile/tenancies/<int:company_id>/contracts/deactivate/',
+         contracts_ending_view,
+         name='contracts_end'
+         ),
     path('profile/tenancies/<int:company_id>/contracts/<int:contract_id>/',
          ContractDetailView.as_view(),
          name='contract_details'
@@ -128,6 +138,10 @@ urlpatterns = [
          ),
 
     # Component pages.
+    path('profile/tenancies/<int:company_id>/components/index/',
+         ComponentIndexationView.as_view(),
+         name='component_indexation'
+         ),
     path('profile/tenancies/<int:company_id>/contracts/<int:contract_id>/component/create/',
          ComponentCreateView.as_view(),
          name='component_create'
@@ -156,4 +170,20 @@ urlpatterns = [
          InvoiceDetailView.as_view(),
          name='invoice_details'
          ),
+
+    # General ledger pages.
+    path('profile/tenancies/<int:company_id>/trial_balance/',
+         TrialBalanceView.as_view(),
+         name='trial_balance'
+         ),
+    path('profile/tenancies/<int:company_id>/trial_balance/api',
+         trial_balance_api,
+         name='trial_balance_api'
+         ),
+
+    # API urls.
+    path('profile/tenancies/<int:company_id>/api/<str:resource>/',
+         api_list,
+         name='api_list'
+         ),
 ]
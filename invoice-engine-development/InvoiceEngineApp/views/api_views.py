@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db.models import F
+from django.http import Http404, JsonResponse
+
+from InvoiceEngineApp.models import (
+    GL_DIMENSION_FIELDS,
+    Collection,
+    Contract,
+    GeneralLedgerPost,
+    Invoice,
+    InvoiceEvent,
+    InvoiceLine,
+    Tenancy
+)
+from InvoiceEngineApp.pagination import InvalidCursor, KeysetPaginator
+
+
+class ApiResource:
+    """A list of objects of a tenancy that can be read with the API. The
+    fields are the columns of the model, with the account and dimensions
+    instead of the foreign key to the general ledger dimensions.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.key = model._meta.pk.attname
+        self.expressions = {}
+        for field in model._meta.concrete_fields:
+            if field.name == 'gl_dimensions':
+                for name in GL_DIMENSION_FIELDS:
+                    self.expressions[name] = F('gl_dimensions__' + name)
+            else:
+                self.expressions[field.attname] = None
+
+    def get_queryset(self, company_id, fields):
+        """Return the values of the fields of the objects of the tenancy,
+        ordered by their key. The key is always returned, because it is the
+        cursor of the next page.
+        """
+        if self.key not in fields:
+            fields = [self.key] + fields
+        names = [name for name in fields if self.expressions[name] is None]
+        expressions = {
+            name: self.expressions[name] for name in fields
+            if self.expressions[name] is not None
+        }
+        return self.model.objects.filter(tenancy_id=company_id).values(
+            *names, **expressions
+        ).order_by(self.key)
+
+
+API_RESOURCES = {
+    'contracts': ApiResource(Contract),
+    'invoices': ApiResource(Invoice),
+    'invoice_lines': ApiResource(InvoiceLine),
+    'gl_posts': ApiResource(GeneralLedgerPost),
+    'collections': ApiResource(Collection),
+    'invoice_events': ApiResource(InvoiceEvent),
+}
+
+
+@login_required(login_url='/login/')
+def api_list(request, company_id, resource):
+    """Return a page of the contracts, invoices, invoice lines, general
+    ledger posts, collections or invoice events of a tenancy as JSON, in the
+    order of their key. The next page is requested with the cursor in 'next'
+    as the after parameter, so every page is read from the index on the
+    tenancy and the key and is as fast as the first one. The fields
+    parameter selects a comma separated list of fields, and the limit
+    parameter the number of objects per page.
+    """
+    if not Tenancy.has_access(company_id, request.user.username):
+        raise Http404("No Tenancy matches the given query.")
+    if resource not in API_RESOURCES:
+        raise Http404("Unknown resource.")
+    api_resource = API_RESOURCES[resource]
+
+    fields = list(api_resource.expressions)
+    if request.GET.get('fields'):
+        fields = request.GET['fields'].split(',')
+        unknown = [name for name in fields
+                   if name not in api_resource.expressions]
+        if unknown:
+            return JsonResponse(
+                {'error': "Unknown fields: {}.".format(', '.join(unknown))},
+                status=400
+            )
+
+    limit = settings.INVOICE_ENGINE_API_PAGE_SIZE
+    if request.GET.get('limit'):
+        try:
+            limit = int(request.GET['limit'])
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= settings.INVOICE_ENGINE_API_PAGE_SIZE:
+            return JsonResponse(
+                {'error': "The limit must be between 1 and {}.".format(
+                    settings.INVOICE_ENGINE_API_PAGE_SIZE
+                )},
+                status=400
+            )
+
+    paginator = KeysetPaginator(
+        api_resource.get_queryset(company_id, fields), limit
+    )
+    try:
+        page = paginator.page(after=request.GET.get('after'))
+    except InvalidCursor:
+        return JsonResponse({'error': "Invalid cursor."}, status=400)
+
+    return JsonResponse({
+        'results': page.object_list,
+        'next': page.next_cursor()
+    })
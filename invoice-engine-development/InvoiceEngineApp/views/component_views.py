@@ -1,8 +1,12 @@
+from django.contrib import messages
 from django.http import HttpResponseRedirect
+from django.urls import reverse
+from django.views.generic import FormView
 
-from InvoiceEngineApp.forms import ComponentForm
+from InvoiceEngineApp.forms import ComponentForm, ComponentIndexationForm
 from InvoiceEngineApp.models import Component
 from InvoiceEngineApp.views.parent_views import (
+    TenancyAccessMixin,
     ParentCreateView,
     ParentUpdateView,
     ParentDeleteView
@@ -78,3 +82,43 @@ class ComponentDeleteView(ParentDeleteView):
     success_page = "contract_details"
     pk_url_kwarg = 'component_id'
     is_contract = True
+
+
+class ComponentIndexationView(TenancyAccessMixin, FormView):
+    """Index the prices of the components of a base component for all
+    contracts of the tenancy at once.
+    """
+    form_class = ComponentIndexationForm
+    template_name = 'InvoiceEngineApp/display_form.html'
+
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        form.filter_selectors(self.kwargs.get('company_id'))
+        return form
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['list_page'] = ['tenancy_details', self.kwargs.get('company_id')]
+        return context
+
+    def form_valid(self, form):
+        contract_type = form.cleaned_data.get('contract_type')
+        report = self.get_tenancy().index_components(
+            form.cleaned_data.get('base_component').base_component_id,
+            form.cleaned_data.get('effective_date'),
+            percentage=form.cleaned_data.get('percentage'),
+            amount=form.cleaned_data.get('amount'),
+            contract_type_id=(contract_type.contract_type_id
+                              if contract_type else None)
+        )
+        messages.success(
+            self.request,
+            "Indexed {components} components of {contracts} contracts and "
+            "created {invoices} correction invoices.".format(**report)
+        )
+        return super().form_valid(form)
+
+    def get_success_url(self):
+        return reverse(
+            'tenancy_details', args=[self.kwargs.get('company_id')]
+        )
@@ -1,4 +1,6 @@
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db.models import Prefetch
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
@@ -7,9 +9,10 @@ from InvoiceEngineApp.forms import (
     ContractForm,
     ContractSearchForm,
 )
-from InvoiceEngineApp.models import Contract
+from InvoiceEngineApp.models import Contract, Component, Tenancy
 from InvoiceEngineApp.views.parent_views import (
     ParentListView,
+    VersionedPageMixin,
     ParentCreateView,
     ParentUpdateView,
     ParentDeleteView,
@@ -50,6 +53,46 @@ def contract_activation_view(request, company_id, contract_id):
     return get_details_page(company_id, contract_id)
 
 
+@login_required(login_url='/login/')
+def contracts_activation_view(request, company_id):
+    """View function to activate all draft contracts of a tenancy that can
+    be activated. The contracts that cannot be activated are reported.
+    """
+    tenancy = get_object_or_404(
+        Tenancy.objects.filter(
+            company_id=company_id,
+            tenancy_id=request.user.username
+        )
+    )
+    activated, rejected = tenancy.activate_contracts()
+    messages.success(
+        request, "Activated {} contracts.".format(len(activated))
+    )
+    for contract_id, reason in sorted(rejected.items()):
+        messages.warning(
+            request, "Contract {}: {}".format(contract_id, reason)
+        )
+
+    return HttpResponseRedirect(reverse("contract_list", args=[company_id]))
+
+
+@login_required(login_url='/login/')
+def contracts_ending_view(request, company_id):
+    """View function to end all contracts of a tenancy that are terminated
+    on or before today.
+    """
+    tenancy = get_object_or_404(
+        Tenancy.objects.filter(
+            company_id=company_id,
+            tenancy_id=request.user.username
+        )
+    )
+    ended, rejected = tenancy.end_contracts()
+    messages.success(request, "Ended {} contracts.".format(len(ended)))
+
+    return HttpResponseRedirect(reverse("contract_list", args=[company_id]))
+
+
 @login_required(login_url='/login/')
 def contract_ending_view(request, company_id, contract_id):
     """View function to set the status of the contract to ACTIVE, so
@@ -70,6 +113,7 @@ class ContractListView(ParentListView):
     form_class = ContractSearchForm
     model = Contract
     ordering = ['date_next_prolongation']
+    keyset_pagination = True
 
     def get_context_data(self, **kwargs):
         """Add the search form to the context data."""
@@ -85,8 +129,12 @@ class ContractListView(ParentListView):
 
         # Filter the contract list further by user input
         if form.is_valid():
-            return form.filter_queryset(qs)
-        return qs
+            qs = form.filter_queryset(qs)
+        return qs.select_related(
+            'contract_type'
+        ).prefetch_related(
+            'contractperson_set'
+        )
 
 
 class ContractCreateView(ParentCreateView):
@@ -102,7 +150,7 @@ class ContractCreateView(ParentCreateView):
         return form
 
 
-class ContractDetailView(ParentListView):
+class ContractDetailView(VersionedPageMixin, ParentListView):
     """DetailView for contract.  It is implemented as a ListView because
     is has to list all invoices corresponding to the contract.
     """
@@ -110,15 +158,42 @@ class ContractDetailView(ParentListView):
     ordering = ['-date']
     object = None
 
+    def get_version(self):
+        return Contract.get_page_version(
+            self.kwargs.get('company_id'), self.kwargs.get('contract_id')
+        )
+
     def get_object(self, queryset=Contract.objects.all()):
+        """Load the contract with everything the page shows, so the number
+        of queries does not depend on the number of components and persons.
+        """
         qs = queryset.filter(
+            tenancy_id=self.kwargs.get('company_id'),
             contract_id=self.kwargs.get('contract_id'),
+        ).select_related(
+            'tenancy', 'contract_type'
+        ).prefetch_related(
+            Prefetch(
+                'component_set',
+                queryset=Component.objects.select_related(
+                    'base_component', 'vat_rate'
+                )
+            ),
+            'contractperson_set'
         )
         return get_object_or_404(qs)
 
     def get_queryset(self):
         self.object = self.get_object()
-        return self.object.get_invoices()
+        invoices = self.object.get_invoices()
+        # The invoices of an archived contract are reassembled as a list
+        if isinstance(invoices, list):
+            return sorted(
+                invoices,
+                key=lambda x: (x.date, x.invoice_id),
+                reverse=True
+            )
+        return invoices.order_by('-date', '-invoice_id')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -0,0 +1,73 @@
+from django.contrib.auth.decorators import login_required
+from django.db.models import Sum, F
+from django.http import JsonResponse, Http404
+
+from InvoiceEngineApp.forms import TrialBalanceForm
+from InvoiceEngineApp.models import GeneralLedgerBalance, Tenancy
+from InvoiceEngineApp.views.parent_views import ParentListView
+
+
+def get_trial_balance(qs):
+    """Sum the general ledger balances of the queryset per account and
+    dimensions. The balances are already summed per day, so this only
+    reads a small number of rows.
+    """
+    return qs.values(
+        'gl_account',
+        'gl_dimension_base_component',
+        'gl_dimension_contract_1',
+        'gl_dimension_contract_2',
+        'gl_dimension_vat'
+    ).annotate(
+        total_debit=Sum('amount_debit'),
+        total_credit=Sum('amount_credit')
+    ).annotate(
+        balance=F('total_debit') - F('total_credit')
+    ).order_by(
+        'gl_account',
+        'gl_dimension_base_component',
+        'gl_dimension_contract_1',
+        'gl_dimension_contract_2',
+        'gl_dimension_vat'
+    )
+
+
+@login_required(login_url='/login/')
+def trial_balance_api(request, company_id):
+    """Return the trial balance of a tenancy as JSON. The period and account
+    can be selected with the same parameters as the trial balance page.
+    """
+    if not Tenancy.has_access(company_id, request.user.username):
+        raise Http404("No Tenancy matches the given query.")
+
+    form = TrialBalanceForm(request.GET)
+    start_date, end_date = form.get_period()
+    qs = form.filter_queryset(
+        GeneralLedgerBalance.objects.filter(tenancy_id=company_id)
+    )
+
+    return JsonResponse({
+        'start_date': start_date,
+        'end_date': end_date,
+        'balances': list(get_trial_balance(qs))
+    })
+
+
+class TrialBalanceView(ParentListView):
+    """Show the trial balance of a tenancy for the selected period."""
+    template_name = 'InvoiceEngineApp/trial_balance.html'
+    form_class = TrialBalanceForm
+    model = GeneralLedgerBalance
+    paginate_by = 50
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        form = self.form_class(self.request.GET)
+        return get_trial_balance(form.filter_queryset(qs))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = self.form_class(self.request.GET)
+        context['form'] = form
+        context['start_date'], context['end_date'] = form.get_period()
+        return context
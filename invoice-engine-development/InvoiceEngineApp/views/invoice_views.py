@@ -1,9 +1,13 @@
-from django.shortcuts import get_object_or_404
+from django.http import Http404
 from django.views.generic import DetailView
 
-from InvoiceEngineApp.models import Invoice
+from InvoiceEngineApp.caching import (
+    get_invoice_contract_id,
+    set_invoice_contract_id
+)
+from InvoiceEngineApp.models import Contract, ContractArchive, Invoice
 from InvoiceEngineApp.views.parent_views import (
-    ParentListView, TenancyAccessMixin,
+    ParentListView, TenancyAccessMixin, VersionedPageMixin,
 )
 
 
@@ -11,11 +15,23 @@ class InvoiceListView(ParentListView):
     template_name = 'InvoiceEngineApp/invoice_list.html'
     model = Invoice
     ordering = ['-date']
+    keyset_pagination = True
 
 
-class InvoiceDetailView(TenancyAccessMixin, DetailView):
+class InvoiceDetailView(TenancyAccessMixin, VersionedPageMixin, DetailView):
     template_name = 'InvoiceEngineApp/invoice_details.html'
 
+    def get_version(self):
+        """An invoice never changes, but the page also shows the contract
+        persons of the contract and the contract type.
+        """
+        contract_id = get_invoice_contract_id(self.kwargs.get('invoice_id'))
+        if contract_id is None:
+            return None
+        return Contract.get_page_version(
+            self.kwargs.get('company_id'), contract_id
+        )
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data()
         context['list_page'] = ["invoice_list", self.kwargs.get('company_id')]
@@ -23,6 +39,16 @@ class InvoiceDetailView(TenancyAccessMixin, DetailView):
 
     def get_object(self, queryset=Invoice.objects.all()):
         qs = queryset.filter(
+            tenancy_id=self.kwargs.get('company_id'),
             invoice_id=self.kwargs.get('invoice_id'),
         )
-        return get_object_or_404(qs)
+        invoice = qs.first()
+        if invoice is None:
+            # The invoice may belong to a historic contract
+            invoice = ContractArchive.get_archived_invoice(
+                self.kwargs.get('company_id'), self.kwargs.get('invoice_id')
+            )
+        if invoice is None:
+            raise Http404("No Invoice matches the given query.")
+        set_invoice_contract_id(invoice.invoice_id, invoice.contract_id)
+        return invoice
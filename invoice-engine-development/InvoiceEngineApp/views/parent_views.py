@@ -1,7 +1,14 @@
+import hashlib
+
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import cache
 from django.db import transaction
-from django.http import Http404
+from django.http import Http404, HttpResponse
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date, quote_etag
 from django.views.generic import (
     ListView,
     CreateView,
@@ -10,31 +17,115 @@ from django.views.generic import (
 )
 
 from InvoiceEngineApp.models import Tenancy
+from InvoiceEngineApp.pagination import (
+    ApproximateCountPaginator,
+    InvalidCursor,
+    KeysetPaginator
+)
 
 
 class TenancyAccessMixin(LoginRequiredMixin):
     # Redirect to the login page if the user is not logged in.
     login_url = '/login/'
     kwargs = None
+    tenancy = None
 
     def dispatch(self, request, *args, **kwargs):
-        """"Perform a check whether this user has access to this tenancy."""
-        tenancy_qs = Tenancy.objects.filter(
-            company_id=self.kwargs.get('company_id'),
-            tenancy_id=request.user.username
-        )
-        if not tenancy_qs.exists():
+        """"Perform a check whether this user has access to this tenancy.
+        The tenancy itself is only fetched when it is used.
+        """
+        if not Tenancy.has_access(
+                self.kwargs.get('company_id'), request.user.username
+        ):
             raise Http404("No Tenancy matches the given query.")
 
+        request.tenancy = SimpleLazyObject(self.get_tenancy)
         return super().dispatch(request, *args, **kwargs)
 
+    def get_tenancy(self):
+        """Return the tenancy of this page, fetched once per request."""
+        if self.tenancy is None:
+            self.tenancy = Tenancy.objects.get(
+                company_id=self.kwargs.get('company_id')
+            )
+        return self.tenancy
+
+
+class VersionedPageMixin:
+    """Cache the rendered page by the version of its content, and answer
+    conditional requests with 304 Not Modified, both with only the query for
+    the version. The versions are kept in the database, so a change in any
+    process is seen by all of them. Views define get_version, which returns
+    the versions of everything the page shows (times in nanoseconds of the
+    last changes), or None if they are not known.
+    """
+    def get_version(self):
+        raise NotImplementedError
+
+    def get_etag(self, version):
+        # The page shows the username and depends on the query string
+        content = '{}:{}:{}'.format(
+            version, self.request.user.username,
+            self.request.get_full_path()
+        )
+        return quote_etag(hashlib.md5(content.encode()).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        version = self.get_version()
+        if version is None:
+            return super().get(request, *args, **kwargs)
+
+        etag = self.get_etag(version)
+        last_modified = max(version) // 10 ** 9
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            key = 'page:{}'.format(etag)
+            content = cache.get(key)
+            if content is None:
+                response = super().get(request, *args, **kwargs)
+                response.render()
+                cache.set(
+                    key, response.content,
+                    settings.INVOICE_ENGINE_CACHE_TIMEOUT
+                )
+            else:
+                response = HttpResponse(content)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
 
 class ParentListView(TenancyAccessMixin, ListView):
     """This class defines common methods of ListViews used in this project."""
     paginate_by = 10
+    paginator_class = ApproximateCountPaginator
+    # Page through the list with the after and before cursors instead of
+    # page numbers, so that deep pages are as fast as the first one. Only
+    # worth it for lists that grow with the contracts, such as the invoices.
+    keyset_pagination = False
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.keyset_pagination:
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = KeysetPaginator(queryset, page_size)
+        try:
+            page = paginator.page(
+                after=self.request.GET.get('after'),
+                before=self.request.GET.get('before')
+            )
+        except InvalidCursor:
+            raise Http404("Invalid page.")
+        return paginator, page, page.object_list, page.has_other_pages()
 
     def get_queryset(self):
         qs = super().get_queryset()
+        # Determine whether the objects can be changed in the same query
+        if hasattr(qs.model, 'annotate_in_use'):
+            qs = qs.model.annotate_in_use(qs)
         return qs.filter(
             tenancy_id=self.kwargs.get('company_id')
         )
@@ -60,6 +151,7 @@ class ParentCreateView(TenancyAccessMixin, CreateView):
         return context
 
     def form_valid(self, form):
+        form.instance.tenancy = self.get_tenancy()
         with transaction.atomic():
             form.instance.create(self.kwargs)
             return super().form_valid(form)
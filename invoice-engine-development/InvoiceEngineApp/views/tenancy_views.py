@@ -4,7 +4,7 @@ import zipfile
 from io import BytesIO, StringIO
 
 from django.contrib.auth.decorators import login_required
-from django.db.models import Max
+from django.db.models import Max, Exists, OuterRef, Prefetch
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
@@ -21,8 +21,12 @@ from InvoiceEngineApp.models import (
     Collection,
     Invoice,
     GeneralLedgerPost,
-    ContractPerson
+    ContractPerson,
+    InvoiceLine,
+    TenancySummary,
+    derive_general_ledger_posts
 )
+from InvoiceEngineApp.pagination import ApproximateCountPaginator
 
 
 @login_required(login_url='/login/')
@@ -94,20 +98,60 @@ def export_invoices(request, company_id):
 @login_required(login_url='/login/')
 def export_glposts(request, company_id):
     return general_export(
-        GeneralLedgerPost, company_id, request.user.username, "glposts"
+        GeneralLedgerPost, company_id, request.user.username, "glposts",
+        get_objects=get_general_ledger_posts
     )
 
 
-def general_export(model, company_id, tenancy_id, file_name):
-    date = Invoice.objects.aggregate(Max('date')).get('date__max')
-    qs = list(
-        model.objects.filter(
+def get_general_ledger_posts(company_id, tenancy_id, date):
+    """Return the general ledger posts of a certain date. The posts of the
+    invoices that were created while INVOICE_ENGINE_STORE_GL_POSTS was False
+    are not stored, so they are derived from the invoices, also after the
+    setting is switched back.
+    """
+    gl_posts = list(
+        GeneralLedgerPost.objects.filter(
             tenancy_id=company_id,
             tenancy__tenancy_id=tenancy_id,
             date=date
+        ).select_related(
+            'tenancy', 'invoice', 'invoice_line', 'gl_dimensions'
         )
     )
 
+    invoices = Invoice.objects.filter(
+        ~Exists(GeneralLedgerPost.objects.filter(invoice=OuterRef('pk'))),
+        tenancy_id=company_id,
+        tenancy__tenancy_id=tenancy_id,
+        date=date
+    ).select_related(
+        'tenancy', 'contract'
+    ).prefetch_related(
+        Prefetch(
+            'invoiceline_set',
+            queryset=InvoiceLine.objects.select_related(
+                'gl_dimensions'
+            ).order_by('invoice_line_id')
+        )
+    ).order_by('invoice_id')
+    gl_posts.extend(derive_general_ledger_posts(invoices))
+
+    return gl_posts
+
+
+def general_export(model, company_id, tenancy_id, file_name, get_objects=None):
+    date = Invoice.objects.aggregate(Max('date')).get('date__max')
+    if get_objects:
+        qs = get_objects(company_id, tenancy_id, date)
+    else:
+        qs = list(
+            model.objects.filter(
+                tenancy_id=company_id,
+                tenancy__tenancy_id=tenancy_id,
+                date=date
+            )
+        )
+
     if not qs:
         return HttpResponseRedirect(reverse('tenancy_list'))
 
@@ -117,7 +161,9 @@ def general_export(model, company_id, tenancy_id, file_name):
 
     opts = model._meta
     writer = csv.writer(response)
-    field_names = [field.name for field in opts.fields]
+    field_names = getattr(
+        model, 'EXPORT_FIELDS', [field.name for field in opts.fields]
+    )
     writer.writerow(field_names)
 
     for obj in qs:
@@ -146,6 +192,7 @@ class TenancyListView(ListView):
     template_name = 'InvoiceEngineApp/tenancy_list.html'
     model = Tenancy
     paginate_by = 10
+    paginator_class = ApproximateCountPaginator
 
     def get_queryset(self):
         # The user should only see the tenancy objects associated with themselves.
@@ -164,7 +211,15 @@ class TenancyDetailView(DetailView):
 
     def get_object(self, queryset=Tenancy.objects.all()):
         qs = Tenancy.objects.filter(company_id=self.kwargs.get('company_id'))
-        return get_object_or_404(qs.filter(tenancy_id=self.request.user.username))
+        tenancy = get_object_or_404(
+            qs.filter(
+                tenancy_id=self.request.user.username
+            ).select_related('tenancysummary')
+        )
+        # The summary is computed once, and kept up to date afterwards
+        if not hasattr(tenancy, 'tenancysummary'):
+            tenancy.tenancysummary = TenancySummary.refresh(tenancy.company_id)
+        return tenancy
 
 
 @method_decorator(login_required(login_url='/login/'), name='dispatch')
@@ -11,7 +11,8 @@ from InvoiceEngineApp.models import (
     ContractPerson,
     InvoiceLine,
     Collection,
-    GeneralLedgerPost
+    GeneralLedgerPost,
+    GeneralLedgerBalance
 )
 
 
@@ -169,12 +170,14 @@ def clear_invoices():
     # This method removes all invoices and invoice lines from the database
     print("started clearing invoices at " + datetime.datetime.now().__str__())
     Invoice.objects.all().delete()
+    GeneralLedgerBalance.objects.all().delete()
     print("ended clearing invoices at " + datetime.datetime.now().__str__())
 
 
 def clear_contracts_and_invoices():
     print("started clearing at " + datetime.datetime.now().__str__())
     GeneralLedgerPost.objects.all().delete()
+    GeneralLedgerBalance.objects.all().delete()
     InvoiceLine.objects.all().delete()
     Collection.objects.all().delete()
     Invoice.objects.all().delete()
@@ -130,5 +130,52 @@ STATICFILES_DIRS = [
     '/var/www/static/',
 ]
 
+# Caches
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# The local memory cache is only shared by the threads of one process. When
+# running several processes, use a shared cache such as memcached, so that
+# changes made by one process are seen by all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 LOGIN_REDIRECT_URL = '/profile/'
 LOGOUT_REDIRECT_URL = '/'
+
+
+# Invoice engine
+
+# When False, the general ledger posts are not stored by the invoicing
+# process. They are derived from the invoices and invoice lines when exported,
+# which reduces the amount of rows written per invoicing run. The posts of
+# invoices without stored posts are always derived, so the setting can be
+# switched back without losing them from the export and the balances.
+INVOICE_ENGINE_STORE_GL_POSTS = True
+
+# When True, the correction invoices for changed components are not sent
+# immediately. The corrections are kept as pending corrections and added to
+# the next invoice of the contract by the invoicing process, which results in
+# fewer invoices and fewer writes.
+INVOICE_ENGINE_DEFER_CORRECTIONS = False
+
+# When True, the invoices of an invoicing run can be computed in advance with
+# the precompute_invoices management command. The invoicing run then only
+# computes the invoices of contracts that changed after they were precomputed.
+# Every change of a contract also invalidates its precomputed invoice.
+INVOICE_ENGINE_PRECOMPUTE_INVOICES = False
+
+# Lists are counted up to this many objects. Lists that contain at least this
+# many objects show the estimate of the query planner instead of an exact
+# count, because counting all objects of a large list is slow.
+INVOICE_ENGINE_EXACT_COUNT_LIMIT = 10000
+
+# The maximum number of objects per page of the API, which is also the
+# number of objects returned when no limit is given.
+INVOICE_ENGINE_API_PAGE_SIZE = 1000
+
+# The number of seconds objects are kept in the cache, such as the reference
+# data of each tenancy.
+INVOICE_ENGINE_CACHE_TIMEOUT = 60 * 60